@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap3.core.results import RESULT_NO_SUCH_OBJECT, RESULT_UNWILLING_TO_PERFORM
+from ldap3.core.exceptions import LDAPSocketOpenError, LDAPSocketReceiveError, LDAPSocketSendError, LDAPSessionTerminatedByServerError
+
+from adtool import cli, router
+from adtool.coalesce import MembershipCoalescer, DEFAULT_MAX_CHANGES
+
+logger = logging.getLogger(__name__)
+
+# ---- asyncio API ----
+#
+# For event-loop services that cannot call the blocking cli functions.
+# Requests are queued to a small, fixed pool of worker threads, each owning
+# one bound DC connection, so thousands of concurrent coroutines share a few
+# connections and never get a thread of their own.
+#
+#   async with aio.ADClient(connections=4) as client:
+#       await client.create_user("John.Doe", "Str0ng-Passw0rd!")
+#       await client.add_user_to_group("John.Doe", "Helpdesk")
+#       async for name in client.list_users_in_group("Helpdesk"):
+#           print(name)
+#
+# Failures raise ADError with the LDAP result attached.
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_MAX_PENDING = 10000
+LIST_PAGE_SIZE = 500
+ACCOUNTDISABLE = 2
+
+# Socket errors after which a worker drops its connection and binds again
+CONNECTION_ERRORS = (LDAPSocketOpenError, LDAPSocketReceiveError, LDAPSocketSendError, LDAPSessionTerminatedByServerError)
+
+
+
+class ADError(Exception):
+
+    def __init__(self, message, result=None):
+        Exception.__init__(self, message)
+        self.result = result
+
+
+# ---- Operations, run on a worker's connection ----
+#
+# Same LDAP requests as the cli commands, returning values instead of printing.
+
+def find_entry(conn, name, attributes=("distinguishedName",)):
+    conn.search(cli.BASE_DN, f"(sAMAccountName={name})", attributes=list(attributes))
+    if not conn.entries:
+        return None
+    return conn.entries[0]
+
+# DN of a user or group, from the cache when one is given
+def resolve_dn(conn, name, cache=None):
+    dn = cache.get(name) if cache is not None else None
+    if dn is None:
+        entry = find_entry(router.reader(conn), name)
+        if entry is None:
+            return None
+        dn = entry.distinguishedName.value
+        if cache is not None:
+            cache.put(name, dn)
+    return dn
+
+def check_result(conn, message):
+    if conn.result["result"] != 0:
+        raise ADError(f"{message}: {conn.result['description']} {conn.result['message']}".strip(), conn.result)
+
+def create_user(conn, username, password, cache=None):
+    first, last = username.split(".")
+    display_name = f"{first} {last}"
+    user_dn = f"CN={display_name},{cli.USERS_DN}"
+
+    if find_entry(conn, username, ["sAMAccountName"]) is not None:
+        raise ADError("User already exists.")
+
+    conn.add(
+        user_dn,
+        ["top", "person", "organizationalPerson", "user"],
+        {
+            "sAMAccountName": username,
+            "userPrincipalName": f"{username}@lab.local",
+            "givenName": first,
+            "sn": last,
+            "displayName": display_name,
+        }
+    )
+    check_result(conn, "User creation failed")
+
+    conn.extend.microsoft.modify_password(user_dn, password)
+    check_result(conn, "Setting password failed")
+    conn.modify(user_dn, {"userAccountControl": [(MODIFY_REPLACE, [512])]})
+    check_result(conn, "Enabling user failed")
+    logger.info(f"User created and enabled: {username}")
+    if cache is not None:
+        cache.put(username, user_dn)
+    return user_dn
+
+def create_group(conn, group_name, cache=None):
+    group_dn = f"CN={group_name},{cli.USERS_DN}"
+    conn.add(group_dn, ["top", "group"], {"sAMAccountName": group_name})
+    check_result(conn, "Group creation failed")
+    if cache is not None:
+        cache.put(group_name, group_dn)
+    return group_dn
+
+# (user DN, group DN) for a membership change
+def resolve_membership(conn, username, group_name, cache=None):
+    user_dn = resolve_dn(conn, username, cache)
+    if user_dn is None:
+        raise ADError("User not found.")
+    group_dn = resolve_dn(conn, group_name, cache)
+    if group_dn is None:
+        raise ADError("Group not found.")
+    return user_dn, group_dn
+
+def change_membership(conn, username, group_name, operation, cache=None):
+    user_dn, group_dn = resolve_membership(conn, username, group_name, cache)
+
+    conn.modify(group_dn, {"member": [(operation, [user_dn])]})
+    if conn.result["result"] in (RESULT_NO_SUCH_OBJECT, RESULT_UNWILLING_TO_PERFORM) and cache is not None:
+        # a cached DN may be stale (object renamed or deleted)
+        cache.evict(username)
+        cache.evict(group_name)
+    check_result(conn, "Failed to change group membership")
+    return group_dn
+
+def set_disabled(conn, username, disabled):
+    user = find_entry(conn, username, ["distinguishedName", "userAccountControl"])
+    if user is None:
+        raise ADError("User not found.")
+
+    current_uac = int(user.userAccountControl.value)
+    new_uac = current_uac | ACCOUNTDISABLE if disabled else current_uac & ~ACCOUNTDISABLE
+    conn.modify(user.distinguishedName.value, {"userAccountControl": [(MODIFY_REPLACE, [new_uac])]})
+    check_result(conn, "Failed to disable user" if disabled else "Failed to enable user")
+    return new_uac
+
+# One page of a group listing; returns (names, cookie for the next page)
+def list_page(conn, group_name, cookie):
+    conn.search(
+        cli.BASE_DN,
+        f"(memberOf=CN={group_name},{cli.USERS_DN})",
+        attributes=["sAMAccountName"],
+        paged_size=LIST_PAGE_SIZE,
+        paged_cookie=cookie
+    )
+    check_result(conn, "Listing group members failed")
+    names = [entry["attributes"]["sAMAccountName"] for entry in conn.response if entry.get("type") == "searchResEntry"]
+    control = conn.result.get("controls", {}).get("1.2.840.113556.1.4.319", {})
+    return names, control.get("value", {}).get("cookie") or None
+
+
+class ADClient(object):
+
+    # connect is called once per worker to open a bound connection;
+    # it defaults to cli.connect() and its credentials.json. Pass a
+    # cache.ResolutionCache to skip repeated user and group lookups, and
+    # coalesce_window (seconds) to buffer membership changes per group and
+    # send them as one modify (see coalesce.py) from a connection of its own.
+    def __init__(self, connections=DEFAULT_CONNECTIONS, connect=None, max_pending=DEFAULT_MAX_PENDING, cache=None,
+                 coalesce_window=None, coalesce_max=DEFAULT_MAX_CHANGES):
+        self.connect = connect or cli.connect
+        self.cache = cache
+        self.coalescer = None
+        self.coalescer_conn = None
+        if coalesce_window:
+            self.coalescer = MembershipCoalescer(self._coalesced_modify, coalesce_window, coalesce_max)
+        self.executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix="adtool-aio")
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.pending = asyncio.Semaphore(max_pending)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # Bound connection of the current worker thread
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def _drop_connection(self):
+        conn = self.local.conn
+        self.local.conn = None
+        with self.lock:
+            if conn in self.connections:
+                self.connections.remove(conn)
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+    def _run(self, func, args, retry):
+        conn = self._connection()
+        try:
+            return func(conn, *args)
+        except CONNECTION_ERRORS:
+            if not retry:
+                self._drop_connection()
+                raise
+            logger.warning(f"Connection lost in {func.__name__}, binding again")
+            self._drop_connection()
+            return func(self._connection(), *args)
+
+    # Queue func(conn, *args) for a worker; at most max_pending calls wait at once.
+    # A call that fails on a lost connection is run once more on a new one.
+    async def call(self, func, *args, retry=True):
+        async with self.pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self._run, func, args, retry)
+
+    async def create_user(self, username, password):
+        return await self.call(create_user, username, password, self.cache)
+
+    async def create_group(self, group_name):
+        return await self.call(create_group, group_name, self.cache)
+
+    async def add_user_to_group(self, username, group_name):
+        return await self._change_membership(username, group_name, MODIFY_ADD)
+
+    async def delete_user_from_group(self, username, group_name):
+        return await self._change_membership(username, group_name, MODIFY_DELETE)
+
+    async def _change_membership(self, username, group_name, operation):
+        if self.coalescer is None:
+            return await self.call(change_membership, username, group_name, operation, self.cache)
+
+        user_dn, group_dn = await self.call(resolve_membership, username, group_name, self.cache)
+        result = await asyncio.wrap_future(self.coalescer.submit(group_dn, user_dn, operation))
+        if result["result"] != 0:
+            if self.cache is not None:
+                self.cache.evict(username)
+                self.cache.evict(group_name)
+            raise ADError(f"Failed to change group membership: {result['description']} {result['message']}".strip(), result)
+        return group_dn
+
+    # Runs on the coalescer's flush thread, on its own connection
+    def _coalesced_modify(self, group_dn, changes):
+        if self.coalescer_conn is None or self.coalescer_conn.closed:
+            self.coalescer_conn = self.connect()
+        self.coalescer_conn.modify(group_dn, {"member": changes})
+        return self.coalescer_conn.result
+
+    async def enable_user(self, username):
+        return await self.call(set_disabled, username, False)
+
+    async def disable_user(self, username):
+        return await self.call(set_disabled, username, True)
+
+    # sAMAccountNames of the group's members, fetched a page at a time.
+    # Paging cookies belong to one connection, so a single worker runs the
+    # whole search and hands pages over a small queue; it waits while the
+    # consumer is behind and stops if the consumer goes away.
+    async def list_users_in_group(self, group_name):
+        loop = asyncio.get_running_loop()
+        pages = asyncio.Queue(maxsize=2)
+        stopped = threading.Event()
+
+        def produce(conn):
+            # the same connection for every page, even if a pin runs out
+            conn = router.reader(conn)
+            cookie = None
+            while not stopped.is_set():
+                names, cookie = list_page(conn, group_name, cookie)
+                future = asyncio.run_coroutine_threadsafe(pages.put(names), loop)
+                while not stopped.is_set():
+                    try:
+                        future.result(timeout=0.1)
+                        break
+                    except TimeoutError:
+                        continue
+                if not cookie:
+                    return
+
+        producer = asyncio.ensure_future(self.call(produce, retry=False))
+        try:
+            while True:
+                getter = asyncio.ensure_future(pages.get())
+                done, _ = await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    for name in getter.result():
+                        yield name
+                    continue
+                getter.cancel()
+                while not pages.empty():
+                    for name in pages.get_nowait():
+                        yield name
+                producer.result()
+                return
+        finally:
+            stopped.set()
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        if self.coalescer is not None:
+            await loop.run_in_executor(None, self.coalescer.close)
+        await loop.run_in_executor(None, self.executor.shutdown, True)
+        with self.lock:
+            connections, self.connections = self.connections, []
+        if self.coalescer_conn is not None:
+            connections.append(self.coalescer_conn)
+        for conn in connections:
+            try:
+                conn.unbind()
+            except Exception:
+                pass
@@ -0,0 +1,314 @@
+import json
+import asyncio
+import logging
+from urllib.parse import unquote, urlsplit
+
+from ldap3.core.results import RESULT_ENTRY_ALREADY_EXISTS, RESULT_NO_SUCH_OBJECT
+
+from adtool import aio, cli
+from adtool.cache import ResolutionCache
+
+logger = logging.getLogger(__name__)
+
+# ---- Local HTTP/JSON API ----
+#
+#   adtool api [--host 127.0.0.1] [--port 8389] [--connections 4] [--max-queue 200] [--coalesce-ms 50]
+#
+#   POST   /users                          {"username": "John.Doe", "password": "..."}
+#   POST   /users/John.Doe/enable
+#   POST   /users/John.Doe/disable
+#   POST   /groups                         {"name": "Helpdesk"}
+#   POST   /groups/Helpdesk/members        {"username": "John.Doe"}
+#   DELETE /groups/Helpdesk/members/John.Doe
+#   GET    /groups/Helpdesk/members        chunked NDJSON, one {"sAMAccountName": ...} per line
+#   GET    /health
+#
+# Requests share an aio.ADClient (a few pooled DC connections) and one
+# resolution cache. At most --max-queue requests are in flight; past that
+# the server answers 503 with Retry-After instead of queueing more work for
+# the DC. Listings are written as they are read and wait for the client to
+# drain its socket, so a slow reader holds back its own search only. A
+# listing that fails after its 200 went out is logged and its connection
+# closed without the last chunk, so the client sees a truncated response.
+# With --coalesce-ms, membership changes to the same group that arrive
+# within that window are sent as one modify; each request still gets its
+# own response once the modify carrying it completes.
+#
+# There is no authentication: the service runs with the credentials in
+# credentials.json and listens on localhost by default.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8389
+DEFAULT_MAX_QUEUE = 200
+MAX_BODY = 65536
+
+STATUS_TEXT = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+}
+
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+# A chunked response failed part way and cannot be finished
+class StreamAborted(Exception):
+    pass
+
+
+# HTTP status for a failed directory operation
+def error_status(error):
+    message = str(error).lower()
+    code = (error.result or {}).get("result")
+    if "not found" in message or code == RESULT_NO_SUCH_OBJECT:
+        return 404
+    if "already exists" in message or code == RESULT_ENTRY_ALREADY_EXISTS:
+        return 409
+    return 502
+
+
+class APIServer(object):
+
+    def __init__(self, client, max_queue=DEFAULT_MAX_QUEUE):
+        self.client = client
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.served = 0
+        self.rejected = 0
+
+    # ---- Routing ----
+
+    def route(self, method, path):
+        parts = [unquote(p) for p in urlsplit(path).path.strip("/").split("/") if p]
+        if parts == ["health"] and method == "GET":
+            return self.health, []
+        if parts == ["users"] and method == "POST":
+            return self.create_user, []
+        if len(parts) == 3 and parts[0] == "users" and parts[2] in ("enable", "disable") and method == "POST":
+            return (self.enable_user if parts[2] == "enable" else self.disable_user), [parts[1]]
+        if parts == ["groups"] and method == "POST":
+            return self.create_group, []
+        if len(parts) == 3 and parts[0] == "groups" and parts[2] == "members":
+            if method == "GET":
+                return self.list_members, [parts[1]]
+            if method == "POST":
+                return self.add_member, [parts[1]]
+            raise HTTPError(405, "Use GET or POST")
+        if len(parts) == 4 and parts[0] == "groups" and parts[2] == "members" and method == "DELETE":
+            return self.delete_member, [parts[1], parts[3]]
+        raise HTTPError(404, "No such endpoint")
+
+    @staticmethod
+    def field(body, name):
+        value = body.get(name) if isinstance(body, dict) else None
+        if not isinstance(value, str) or not value:
+            raise HTTPError(400, f"Missing \"{name}\"")
+        return value
+
+    # ---- Endpoints; each returns (status, document) or streams itself ----
+
+    async def health(self, body, writer):
+        return 200, {
+            "in_flight": self.in_flight,
+            "max_queue": self.max_queue,
+            "served": self.served,
+            "rejected": self.rejected,
+            "connections": len(self.client.connections),
+            "cache": self.client.cache.stats() if self.client.cache else None,
+            "coalescing": self.client.coalescer.stats() if self.client.coalescer else None,
+        }
+
+    async def create_user(self, body, writer):
+        username = self.field(body, "username")
+        if len(username.split(".")) != 2:
+            raise HTTPError(400, "username must be First.Last")
+        dn = await self.client.create_user(username, self.field(body, "password"))
+        return 201, {"dn": dn}
+
+    async def create_group(self, body, writer):
+        dn = await self.client.create_group(self.field(body, "name"))
+        return 201, {"dn": dn}
+
+    async def add_member(self, body, writer, group_name):
+        await self.client.add_user_to_group(self.field(body, "username"), group_name)
+        return 200, {"group": group_name, "added": body["username"]}
+
+    async def delete_member(self, body, writer, group_name, username):
+        await self.client.delete_user_from_group(username, group_name)
+        return 200, {"group": group_name, "removed": username}
+
+    async def enable_user(self, body, writer, username):
+        uac = await self.client.enable_user(username)
+        return 200, {"username": username, "userAccountControl": uac}
+
+    async def disable_user(self, body, writer, username):
+        uac = await self.client.disable_user(username)
+        return 200, {"username": username, "userAccountControl": uac}
+
+    async def list_members(self, body, writer, group_name):
+        members = self.client.list_users_in_group(group_name)
+        try:
+            try:
+                # read the first page before committing to a 200
+                first = await members.__anext__()
+            except StopAsyncIteration:
+                first = None
+
+            await self.start_response(writer, 200, "application/x-ndjson", chunked=True)
+            try:
+                if first is not None:
+                    lines = [json.dumps({"sAMAccountName": first})]
+                    async for name in members:
+                        lines.append(json.dumps({"sAMAccountName": name}))
+                        if len(lines) >= 100:
+                            await self.write_chunk(writer, "\n".join(lines) + "\n")
+                            lines = []
+                    if lines:
+                        await self.write_chunk(writer, "\n".join(lines) + "\n")
+            except ConnectionError:
+                raise
+            except Exception as e:
+                logger.error(f"Listing members of {group_name} failed after the response started: {type(e).__name__}: {e}")
+                raise StreamAborted(str(e))
+            await self.write_chunk(writer, "")
+        finally:
+            await members.aclose()
+        return None
+
+    # ---- HTTP plumbing ----
+
+    @staticmethod
+    async def start_response(writer, status, content_type, length=None, chunked=False, headers=None):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", f"Content-Type: {content_type}"]
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        else:
+            lines.append(f"Content-Length: {length}")
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("ascii"))
+        await writer.drain()
+
+    @staticmethod
+    async def write_chunk(writer, text):
+        data = text.encode("utf-8")
+        writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        await writer.drain()
+
+    async def send_json(self, writer, status, document, headers=None):
+        data = json.dumps(document).encode("utf-8")
+        await self.start_response(writer, status, "application/json", len(data), headers=headers)
+        writer.write(data)
+        await writer.drain()
+
+    @staticmethod
+    async def read_request(reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        method, path, version = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), path, version, headers, body
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    method, path, version, headers, body = await self.read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except (ValueError, HTTPError) as e:
+                    status = e.status if isinstance(e, HTTPError) else 400
+                    await self.send_json(writer, status, {"error": str(e) or "Bad request"}, {"Connection": "close"})
+                    break
+
+                await self.dispatch(method, path, body, writer)
+                if headers.get("connection", "").lower() == "close" or version == "HTTP/1.0":
+                    break
+        except (ConnectionError, StreamAborted):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body, writer):
+        try:
+            handler, args = self.route(method, path)
+            document = json.loads(body) if body else {}
+        except HTTPError as e:
+            await self.send_json(writer, e.status, {"error": str(e)})
+            return
+        except ValueError:
+            await self.send_json(writer, 400, {"error": "Body is not valid JSON"})
+            return
+
+        if handler != self.health and self.in_flight >= self.max_queue:
+            self.rejected += 1
+            await self.send_json(writer, 503, {"error": "Too many requests in flight"}, {"Retry-After": "1"})
+            return
+
+        self.in_flight += 1
+        try:
+            result = await handler(document, writer, *args)
+            if result is not None:
+                await self.send_json(writer, *result)
+            self.served += 1
+        except HTTPError as e:
+            await self.send_json(writer, e.status, {"error": str(e)})
+        except aio.ADError as e:
+            await self.send_json(writer, error_status(e), {"error": str(e), "result": (e.result or {}).get("result")})
+        except (ConnectionError, StreamAborted):
+            raise
+        except Exception:
+            logger.exception(f"Unexpected error in {method} {path}")
+            await self.send_json(writer, 502, {"error": "Unexpected error. Check log file."})
+        finally:
+            self.in_flight -= 1
+
+
+async def serve(host, port, connections, max_queue, connect=None, ready=None, coalesce_window=None):
+    client = aio.ADClient(connections=connections, connect=connect, cache=ResolutionCache(), coalesce_window=coalesce_window)
+    async with client:
+        api = APIServer(client, max_queue)
+        server = await asyncio.start_server(api.handle, host, port)
+        address = server.sockets[0].getsockname()
+        print(f"adtool API listening on http://{address[0]}:{address[1]} ({connections} DC connections)")
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+def main(argv):
+    host = cli.pop_option("--host", DEFAULT_HOST, argv)
+    port = int(cli.pop_option("--port", DEFAULT_PORT, argv))
+    connections = int(cli.pop_option("--connections", aio.DEFAULT_CONNECTIONS, argv))
+    max_queue = int(cli.pop_option("--max-queue", DEFAULT_MAX_QUEUE, argv))
+    coalesce_ms = float(cli.pop_option("--coalesce-ms", 0, argv))
+
+    if argv:
+        print("Usage: adtool api [--host 127.0.0.1] [--port 8389] [--connections 4] [--max-queue 200] [--coalesce-ms 50]")
+        return
+
+    try:
+        asyncio.run(serve(host, port, connections, max_queue, coalesce_window=coalesce_ms / 1000.0 or None))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,124 @@
+import logging
+
+from pyasn1.codec.ber import decoder
+from pyasn1.type.namedtype import NamedTypes, NamedType
+from pyasn1.type.univ import Sequence, OctetString, Enumerated
+from ldap3 import BASE
+from ldap3.core.results import RESULT_SUCCESS, RESULT_NO_SUCH_OBJECT, RESULT_UNAVAILABLE_CRITICAL_EXTENSION
+from ldap3.protocol.controls import build_control
+
+logger = logging.getLogger(__name__)
+
+# ---- Attribute Scoped Query group listing ----
+#
+# Listing a group by memberOf searches the whole domain for objects whose
+# memberOf names the group. With the AD Attribute Scoped Query control the
+# search is a base search of the group itself: the DC follows every DN in
+# its member attribute and returns the requested attributes of each member,
+# a page at a time, so the members' details come back in one paged stream
+# instead of a domain-wide search or one lookup per member.
+#
+#   adtool list-users-in-group Helpdesk --listing asq --details
+#
+# DCs (or stand-ins) without the control answer unavailableCriticalExtension
+# and the listing falls back to memberOf.
+
+ASQ_OID = "1.2.840.113556.1.4.1504"
+PAGED_RESULTS_OID = "1.2.840.113556.1.4.319"
+PAGE_SIZE = 500
+ACCOUNTDISABLE = 2
+
+LISTINGS = ["memberof", "asq"]
+DETAIL_ATTRIBUTES = ["sAMAccountName", "displayName", "mail", "userAccountControl"]
+
+
+
+class ASQRequestValue(Sequence):
+    # ASQRequestValue ::= SEQUENCE { sourceAttribute OCTET STRING }
+    componentType = NamedTypes(NamedType("sourceAttribute", OctetString()))
+
+
+class ASQResponseValue(Sequence):
+    # ASQResponseValue ::= SEQUENCE { searchResult ENUMERATED }
+    componentType = NamedTypes(NamedType("searchResult", Enumerated()))
+
+
+class ASQError(Exception):
+
+    def __init__(self, message, result=None):
+        Exception.__init__(self, message)
+        self.result = result
+
+    # The DC does not know the control at all
+    @property
+    def unsupported(self):
+        return bool(self.result) and self.result.get("result") == RESULT_UNAVAILABLE_CRITICAL_EXTENSION
+
+    # The group does not exist
+    @property
+    def not_found(self):
+        return bool(self.result) and self.result.get("result") == RESULT_NO_SUCH_OBJECT
+
+
+def request_control(source_attribute="member"):
+    value = ASQRequestValue()
+    value["sourceAttribute"] = source_attribute
+    return build_control(ASQ_OID, True, value)
+
+def response_control(search_result=RESULT_SUCCESS):
+    value = ASQResponseValue()
+    value["searchResult"] = search_result
+    return build_control(ASQ_OID, False, value)
+
+# searchResult of the ASQ response control, or None if there was none
+def search_result(result):
+    control = (result.get("controls") or {}).get(ASQ_OID)
+    if control is None or not control.get("value"):
+        return None
+    value, _ = decoder.decode(control["value"], asn1Spec=ASQResponseValue())
+    return int(value["searchResult"])
+
+# One page of members; returns (attribute dicts, cookie for the next page)
+def page(conn, group_dn, attributes, cookie=None, source_attribute="member"):
+    conn.search(
+        group_dn,
+        "(objectClass=*)",
+        BASE,
+        attributes=attributes,
+        controls=[request_control(source_attribute)],
+        paged_size=PAGE_SIZE,
+        paged_cookie=cookie
+    )
+    if conn.result["result"] != RESULT_SUCCESS:
+        raise ASQError(f"ASQ listing of {group_dn} failed: {conn.result.get('description')}", conn.result)
+    code = search_result(conn.result)
+    if code not in (None, RESULT_SUCCESS):
+        raise ASQError(f"ASQ listing of {group_dn} failed with searchResult {code}", conn.result)
+    members = [entry["attributes"] for entry in conn.response if entry.get("type") == "searchResEntry"]
+    control = conn.result.get("controls", {}).get(PAGED_RESULTS_OID, {})
+    return members, control.get("value", {}).get("cookie") or None
+
+# Attribute dicts of every member of the group, a page at a time
+def members(conn, group_dn, attributes, source_attribute="member"):
+    cookie = None
+    while True:
+        entries, cookie = page(conn, group_dn, attributes, cookie, source_attribute)
+        for entry in entries:
+            yield entry
+        if not cookie:
+            return
+
+# Single value of an attribute, whether or not the schema made it a list
+def single(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+# "name  display name  mail  enabled" line for a member
+def describe(attributes):
+    name = single(attributes.get("sAMAccountName")) or ""
+    display = single(attributes.get("displayName")) or ""
+    mail = single(attributes.get("mail")) or ""
+    uac = single(attributes.get("userAccountControl"))
+    state = "" if uac is None else ("disabled" if int(uac) & ACCOUNTDISABLE else "enabled")
+    return f"{name:<24} {display:<30} {mail:<36} {state}".rstrip()
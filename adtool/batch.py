@@ -0,0 +1,302 @@
+import io
+import os
+import sys
+import json
+import time
+import shlex
+import logging
+from contextlib import redirect_stdout
+
+from ldap3 import MODIFY_ADD, MODIFY_DELETE
+
+from adtool import cli, usage, journal, retry, lazycommit
+from adtool.cache import ResolutionCache
+from adtool.coalesce import MembershipCoalescer
+
+logger = logging.getLogger(__name__)
+
+# ---- Batch runner ----
+#
+#   adtool batch commands.txt
+#   generate-changes | adtool batch - --ndjson
+#
+# Runs many adtool commands over one bound connection with a shared DN
+# cache, instead of one process, bind and schema download per command.
+# Input is one command per line, either as on the command line
+#
+#   add-user-to-group John.Doe Helpdesk
+#   create-user Jane.Roe Str0ng-Passw0rd!
+#
+# or as NDJSON
+#
+#   {"command": "add-user-to-group", "args": ["John.Doe", "Helpdesk"]}
+#   {"command": "create-user", "args": ["Jane.Roe"], "password": "Str0ng-Passw0rd!"}
+#
+# Blank lines and lines starting with # are skipped. Results are printed as
+# each line finishes ("12: John.Doe added to Helpdesk."), or as one JSON
+# object per line with --ndjson.
+#
+# Membership changes between other commands are buffered per group and
+# sent as one modify per group (see coalesce.py): an add and a delete of the
+# same member cancel out, and if AD rejects the combined modify each change
+# is retried on its own to report which line was the problem. Any other
+# command first flushes the buffered changes, so it sees them applied.
+#
+# Each run is a job with a journal of finished lines (see journal.py); the
+# job ID is printed at the start. If a run dies part way through,
+#
+#   adtool batch commands.txt --resume 20261019-0712-3f2a9c
+#
+# skips every line that already succeeded and runs only the rest.
+#
+# --lazy-commit sends the writes with the AD lazy commit control and reads
+# every written object back at the end (see lazycommit.py). Lines whose
+# objects do not read back as written are recorded in the journal as failed
+# again, so --resume runs them once more.
+
+MEMBERSHIP_COMMANDS = {
+    "add-user-to-group": MODIFY_ADD,
+    "delete-user-from-group": MODIFY_DELETE,
+}
+
+# Most membership lines buffered before they are sent
+MAX_COALESCE = 1000
+
+
+
+# (command, args, password) from one input line, or None for blank/comment lines
+def parse_line(text):
+    text = text.strip()
+    if not text or text.startswith("#"):
+        return None
+    if text.startswith("{"):
+        document = json.loads(text)
+        return document["command"], [str(a) for a in document.get("args", [])], document.get("password")
+    words = shlex.split(text)
+    return words[0], words[1:], None
+
+
+class BatchRunner(object):
+
+    def __init__(self, conn, ndjson=False, out=None, journal=None, done=(), lazy=False):
+        self.conn = conn
+        self.ndjson = ndjson
+        self.out = out or sys.stdout
+        self.journal = journal
+        self.done = done     # (line, hash) that succeeded in an earlier run of the job
+        self.hashes = {}     # line -> hash of its text, until it is journaled
+        self.pending = []    # queued membership lines: (number, command, args, future or error)
+        self.written = {} if lazy else None   # lower-case DN -> {(line, hash)} that wrote it
+        self.coalescer = MembershipCoalescer(self.modify_group, window=None, max_changes=MAX_COALESCE)
+        self.lines = 0
+        self.failed = 0
+        self.skipped = 0
+
+    # ---- Results ----
+
+    def report(self, number, command, args, output, ok):
+        output = output.strip()
+        self.lines += 1
+        if not ok:
+            self.failed += 1
+        if self.journal is not None and number in self.hashes:
+            self.journal.record(number, self.hashes.pop(number), ok)
+
+        if self.ndjson:
+            self.out.write(json.dumps({"line": number, "command": command, "args": args, "ok": ok, "output": output}) + "\n")
+        else:
+            for text in output.splitlines() or [""]:
+                self.out.write(f"{number}: {text}\n")
+        self.out.flush()
+
+    # ---- Running lines ----
+
+    def run(self, lines):
+        for number, text in enumerate(lines, 1):
+            digest = journal.line_hash(text)
+            if (number, digest) in self.done:
+                self.skipped += 1
+                continue
+            self.hashes[number] = digest
+            try:
+                parsed = parse_line(text)
+            except (ValueError, KeyError) as e:
+                self.flush()
+                self.report(number, None, [], f"Cannot parse line: {e}", ok=False)
+                continue
+            if parsed is None:
+                del self.hashes[number]
+                continue
+
+            command, args, password = parsed
+            if command in MEMBERSHIP_COMMANDS and len(args) >= 2:
+                self.queue_membership(number, command, args[:2])
+                if len(self.pending) >= MAX_COALESCE:
+                    self.flush()
+                continue
+
+            self.flush()
+            self.report(*self.execute(number, command, args, password))
+        self.flush()
+
+    # Run one command; returns (number, command, args, output, ok) for report()
+    def execute(self, number, command, args, password=None):
+        if command not in cli.COMMANDS:
+            return number, command, args, "Unknown command.", False
+        func, arg_names = cli.COMMANDS[command]
+        if len(args) < len(arg_names):
+            return number, command, args, f"Usage: {command} {' '.join(arg_names)}", False
+
+        call_args = args[:len(arg_names)]
+        if command == "create-user":
+            password = password or (args[1] if len(args) > 1 else None)
+            if not password:
+                return number, command, call_args, "create-user needs a password in batch mode.", False
+            call_args.append(password)
+
+        output = io.StringIO()
+        start = len(self.conn.lazy_log) if self.written is not None else 0
+        with redirect_stdout(output):
+            ok = func(self.conn, *call_args) is True
+        if self.written is not None:
+            for dn in self.conn.lazy_log[start:]:
+                self.wrote(dn, number)
+        return number, command, args[:len(arg_names)], output.getvalue(), ok
+
+    # Queue a membership change for its group's coalesced modify
+    def queue_membership(self, number, command, args):
+        username, group_name = args
+        group_dn = cli.find_dn(self.conn, group_name)
+        if group_dn is None:
+            self.pending.append((number, command, args, "Group not found."))
+            return
+        user_dn = cli.find_dn(self.conn, username)
+        if user_dn is None:
+            self.pending.append((number, command, args, "User not found."))
+            return
+        future = self.coalescer.submit(group_dn, user_dn, MEMBERSHIP_COMMANDS[command])
+        self.pending.append((number, command, args, future))
+        if self.written is not None:
+            self.wrote(group_dn, number)
+
+    def wrote(self, dn, number):
+        if number in self.hashes:
+            self.written.setdefault(dn.lower(), set()).add((number, self.hashes[number]))
+
+    def modify_group(self, group_dn, changes):
+        self.conn.modify(group_dn, {"member": changes})
+        return self.conn.result
+
+    # Record the lines that wrote these DNs as failed; returns how many
+    def unverified(self, dns):
+        lines = set()
+        for dn in dns:
+            lines |= self.written.get(dn.lower(), set())
+        if self.journal is not None:
+            for number, digest in sorted(lines):
+                self.journal.record(number, digest, False)
+        return len(lines)
+
+    # Send the queued membership changes and report their lines in order
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        self.coalescer.flush()
+
+        for number, command, args, outcome in pending:
+            if isinstance(outcome, str):
+                self.report(number, command, args, outcome, ok=False)
+                continue
+
+            username, group_name = args
+            result = outcome.result()
+            if result["result"] != 0:
+                cli.forget_dns(username, group_name)
+                failure = "Failed to add user to group." if command == "add-user-to-group" else "Failed to remove from group."
+                self.report(number, command, args, f"{failure}\n{result}", ok=False)
+                continue
+
+            if command == "add-user-to-group":
+                output = f"{username} added to {group_name}."
+            else:
+                output = f"{username} removed from {group_name}."
+            if result.get("cancelled"):
+                output += " (cancelled out by an opposing change, nothing sent)"
+            self.report(number, command, args, output, ok=True)
+
+
+def main(argv):
+    ndjson = cli.pop_flag("--ndjson", argv)
+    show_usage = cli.pop_flag("--usage", argv)
+    job_id = cli.pop_option("--resume", argv=argv)
+    lazy = cli.pop_flag("--lazy-commit", argv)
+
+    done = set()
+    if job_id is not None:
+        try:
+            header, done = journal.load(job_id)
+        except OSError:
+            print(f"No journal for job {job_id} in {journal.JOB_DIR}")
+            sys.exit(1)
+        # the job's own input file unless another one is given
+        if not argv and header and header.get("source") not in (None, "-"):
+            argv.append(header["source"])
+
+    if len(argv) != 1:
+        print("Usage: adtool batch FILE|- [--ndjson] [--usage] [--resume JOB_ID] [--lazy-commit]")
+        return
+
+    source = argv[0]
+    try:
+        stream = sys.stdin if source == "-" else open(source)
+    except OSError as e:
+        print(f"Cannot read {source}: {e.strerror}")
+        sys.exit(1)
+
+    status = sys.stderr if ndjson else sys.stdout
+    if job_id is None:
+        job_id = journal.new_job_id()
+        print(f"Job {job_id} (resume with --resume {job_id})", file=status)
+    else:
+        print(f"Resuming job {job_id}: {len(done)} lines already done", file=status)
+    job = journal.Journal(job_id, source=source if source == "-" else os.path.abspath(source))
+
+    cli.dn_cache = ResolutionCache()
+    conn = cli.connect()
+    if lazy:
+        lazycommit.attach(conn)
+    before = usage.snapshot(conn)
+    started = time.perf_counter()
+    runner = BatchRunner(conn, ndjson, journal=job, done=done, lazy=lazy)
+    mismatches = []
+    try:
+        runner.run(stream)
+        if lazy:
+            mismatches = lazycommit.verify(conn)
+            redo = runner.unverified(dn for dn, _ in mismatches)
+            print(f"lazy commit: {len(conn.lazy_writes)} objects read back, {len(mismatches)} not as written", file=status)
+            for dn, problem in mismatches:
+                print(f"  {dn}: {problem}", file=status)
+            if redo:
+                print(f"  {redo} lines recorded as failed, --resume {job_id} runs them again", file=status)
+    finally:
+        job.close()
+        if stream is not sys.stdin:
+            stream.close()
+
+    stats = runner.coalescer.stats()
+    summary = (
+        f"batch: {runner.lines} lines, {runner.failed} failed, {runner.skipped} skipped as done, "
+        f"{stats['submitted']} membership changes in {stats['modifies']} modifies "
+        f"({stats['cancelled']} cancelled out), {retry.retries} retries, {time.perf_counter() - started:.1f}s"
+    )
+    logger.info(f"job {job_id}: {summary}")
+    totals = usage.usage_since(conn, before)
+    print(summary, file=status)
+    if show_usage and totals is not None:
+        print(usage.format_usage("batch", totals), file=status)
+    conn.unbind()
+
+    if runner.failed or mismatches:
+        sys.exit(1)
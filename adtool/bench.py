@@ -0,0 +1,279 @@
+import sys
+import io
+import json
+import time
+import random
+import platform
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import ldap3
+from ldap3 import Server, Connection, MOCK_SYNC, OFFLINE_AD_2012_R2
+
+from adtool import cli, usage, fakead
+
+# ---- Offline benchmark harness ----
+#
+# Builds a synthetic AD-like directory in ldap3's MOCK_SYNC strategy and runs
+# every adtool command against it. No domain controller or network is needed.
+# --backend fakead runs the same workload on the AD-semantics fake directory
+# with optional per-operation latency.
+#
+#   python -m adtool.bench --scales 1000,10000,100000 --out bench.json
+#   python -m adtool.bench --backend fakead --latency-ms 5 --out bench-5ms.json
+
+DEFAULT_SCALES = "1000,10000"
+DEFAULT_ITERATIONS = 100
+USERS_PER_GROUP = 20
+BENCH_PASSWORD = "Bench-Passw0rd!"
+ADMIN_DN = "CN=Administrator,CN=Users," + cli.BASE_DN
+
+# Number of calls per command measured under tracemalloc for peak memory
+MEMORY_SAMPLES = 10
+
+
+
+def user_name(i):
+    return f"User{i:06d}.Bench"
+
+def group_name(i):
+    return f"Group{i:05d}"
+
+def user_dn(name):
+    first, last = name.split(".")
+    return f"CN={first} {last},{cli.USERS_DN}"
+
+def group_dn(name):
+    return f"CN={name},{cli.USERS_DN}"
+
+
+# Open a bound connection configured like cli.connect(). The "mock" backend is
+# plain MOCK_SYNC; "fakead" adds AD semantics and per-operation latency.
+
+def mock_connect(backend="mock", latency=None):
+    if backend == "fakead":
+        directory = fakead.FakeDirectory(latency=latency)
+        directory.add_user("Administrator", password=BENCH_PASSWORD)
+        conn = directory.connect(
+            user=f"{directory.netbios}\\Administrator",
+            password=BENCH_PASSWORD,
+            collect_usage=True
+        )
+        conn.bind()
+        return conn
+
+    server = Server("bench-dc", get_info=OFFLINE_AD_2012_R2)
+    conn = Connection(
+        server,
+        user=ADMIN_DN,
+        password=BENCH_PASSWORD,
+        client_strategy=MOCK_SYNC,
+        collect_usage=True
+    )
+    conn.strategy.add_entry(ADMIN_DN, {
+        "objectClass": ["top", "person", "organizationalPerson", "user"],
+        "sAMAccountName": "Administrator",
+        "userPassword": BENCH_PASSWORD,
+    })
+    conn.bind()
+    return conn
+
+# Pick the groups each user belongs to. Group popularity follows a Zipf-like
+# curve so a few groups are huge and most are small, as in real domains.
+def membership_plan(users, groups, rng):
+    weights = [1.0 / (rank + 1) for rank in range(groups)]
+    plan = {}
+    for i in range(users):
+        count = min(groups, 1 + int(rng.expovariate(0.5)))
+        plan[i] = set(rng.choices(range(groups), weights=weights, k=count))
+    return plan
+
+# Fill a mock connection with users, groups and memberships
+def build_directory(conn, users, groups, seed=0):
+    rng = random.Random(seed)
+    plan = membership_plan(users, groups, rng)
+
+    members = {g: [] for g in range(groups)}
+    for i, group_ids in plan.items():
+        for g in group_ids:
+            members[g].append(user_dn(user_name(i)))
+
+    for i in range(users):
+        name = user_name(i)
+        first, last = name.split(".")
+        dn = user_dn(name)
+        conn.strategy.add_entry(dn, {
+            "objectClass": ["top", "person", "organizationalPerson", "user"],
+            "distinguishedName": dn,
+            "sAMAccountName": name,
+            "userPrincipalName": f"{name}@lab.local",
+            "givenName": first,
+            "sn": last,
+            "displayName": f"{first} {last}",
+            "userAccountControl": 514 if i % 10 == 0 else 512,
+            "memberOf": [group_dn(group_name(g)) for g in sorted(plan[i])],
+        })
+
+    for g in range(groups):
+        name = group_name(g)
+        dn = group_dn(name)
+        attributes = {
+            "objectClass": ["top", "group"],
+            "distinguishedName": dn,
+            "sAMAccountName": name,
+        }
+        if members[g]:
+            attributes["member"] = members[g]
+        conn.strategy.add_entry(dn, attributes)
+
+    return sum(len(m) for m in members.values())
+
+
+# ---- Workloads ----
+
+# Argument lists for each command, one per iteration
+def command_arguments(command, users, groups, iterations, rng):
+    if command == "create-user":
+        return [[f"New{i:06d}.Bench", BENCH_PASSWORD] for i in range(iterations)]
+    if command == "create-group":
+        return [[f"NewGroup{i:05d}"] for i in range(iterations)]
+    if command in ("add-user-to-group", "delete-user-from-group"):
+        # same pairs for both so every delete undoes an add
+        pairs = random.Random(users).sample(range(users * groups), iterations)
+        return [[user_name(p // groups), group_name(p % groups)] for p in pairs]
+    if command == "list-users-in-group":
+        return [[group_name(rng.randrange(groups))] for i in range(iterations)]
+    return [[user_name(rng.randrange(users))] for i in range(iterations)]
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+# Run one command repeatedly and summarise latency, throughput, cost and memory
+def bench_command(conn, command, arg_lists):
+    func, arg_names = cli.COMMANDS[command]
+    latencies = []
+    max_operations = 0
+
+    sink = io.StringIO()
+    with redirect_stdout(sink):
+        started = time.perf_counter()
+        for args in arg_lists:
+            before = usage.snapshot(conn)
+            func(conn, *args)
+            totals = usage.usage_since(conn, before)
+            latencies.append(totals["elapsed"])
+            max_operations = max(max_operations, totals["operations"])
+            sink.seek(0)
+            sink.truncate()
+        total = time.perf_counter() - started
+
+    return {
+        "calls": len(arg_lists),
+        "throughput_per_sec": len(arg_lists) / total if total else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p90": percentile(latencies, 90) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": max(latencies) * 1000,
+        },
+        "max_operations": max_operations,
+        "budget": usage.ROUND_TRIP_BUDGETS.get(command),
+        "within_budget": usage.over_budget(command, {"operations": max_operations}) is None,
+    }
+
+# Peak Python memory while running a few calls of a command
+def measure_memory(conn, command, arg_lists):
+    func, arg_names = cli.COMMANDS[command]
+    tracemalloc.start()
+    try:
+        with redirect_stdout(io.StringIO()):
+            for args in arg_lists:
+                func(conn, *args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak // 1024
+
+# Build a directory of the given size and benchmark every command against it
+def bench_scale(users, iterations, seed=0, backend="mock", latency=None):
+    groups = max(1, users // USERS_PER_GROUP)
+    rng = random.Random(seed)
+
+    conn = mock_connect(backend, latency)
+    started = time.perf_counter()
+    memberships = build_directory(conn, users, groups, seed)
+    if backend == "fakead":
+        conn.server.fake_directory.set_missing_passwords(BENCH_PASSWORD)
+    build_seconds = time.perf_counter() - started
+    print(f"Built {users} users, {groups} groups, {memberships} memberships in {build_seconds:.1f}s")
+
+    results = {}
+    for command in cli.COMMANDS:
+        arg_lists = command_arguments(command, users, groups, iterations + MEMORY_SAMPLES, rng)
+        result = bench_command(conn, command, arg_lists[:iterations])
+        result["peak_memory_kb"] = measure_memory(conn, command, arg_lists[iterations:])
+        results[command] = result
+        print(
+            f"  {command:<24} {result['throughput_per_sec']:>9.1f} ops/s  "
+            f"p50 {result['latency_ms']['p50']:.2f} ms  "
+            f"p99 {result['latency_ms']['p99']:.2f} ms  "
+            f"{result['max_operations']} LDAP ops  "
+            f"{result['peak_memory_kb']} KiB peak"
+        )
+
+    conn.unbind()
+    return {
+        "users": users,
+        "groups": groups,
+        "memberships": memberships,
+        "build_seconds": build_seconds,
+        "commands": results,
+    }
+
+def main():
+    argv = sys.argv[1:]
+    scales = cli.pop_option("--scales", DEFAULT_SCALES, argv)
+    iterations = int(cli.pop_option("--iterations", DEFAULT_ITERATIONS, argv))
+    seed = int(cli.pop_option("--seed", 0, argv))
+    out = cli.pop_option("--out", None, argv)
+    backend = cli.pop_option("--backend", "mock", argv)
+    latency = fakead.parse_latency(cli.pop_option("--latency-ms", None, argv))
+
+    if argv or backend not in ("mock", "fakead"):
+        print("Usage: python -m adtool.bench [--scales 1000,10000] [--iterations N] [--seed N] [--out FILE]")
+        print("                              [--backend mock|fakead] [--latency-ms 5|search=2,modify=10]")
+        sys.exit()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "ldap3": ldap3.__version__,
+        "iterations": iterations,
+        "backend": backend,
+        "latency_ms": {name: value * 1000 for name, value in latency.items()},
+        "scales": [],
+    }
+
+    for users in [int(s) for s in scales.split(",")]:
+        report["scales"].append(bench_scale(users, iterations, seed, backend, latency))
+
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {out}")
+
+    over = [
+        f"{command} at {scale['users']} users"
+        for scale in report["scales"]
+        for command, result in scale["commands"].items()
+        if not result["within_budget"]
+    ]
+    if over:
+        print("Over round-trip budget: " + ", ".join(over))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import time
+import threading
+from collections import OrderedDict
+
+from adtool import tracing
+
+# ---- Name resolution cache ----
+#
+# Maps sAMAccountName to distinguishedName for long-running modes (api,
+# shell, batch) so repeated commands on the same users and groups skip the
+# lookup search. Entries expire after a TTL and the least recently used
+# names are dropped past max_entries. Only DNs are cached; attributes that
+# change (userAccountControl, members) are always read from the DC.
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 50000
+
+
+
+class ResolutionCache(object):
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # lower-case name -> (dn, expires)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        key = name.lower()
+        with tracing.span("cache lookup", cat="cache", key=name):
+            with self.lock:
+                item = self.entries.get(key)
+                if item is None or item[1] < time.monotonic():
+                    if item is not None:
+                        del self.entries[key]
+                    self.misses += 1
+                    return None
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return item[0]
+
+    def put(self, name, dn):
+        with self.lock:
+            self.entries[name.lower()] = (dn, time.monotonic() + self.ttl)
+            self.entries.move_to_end(name.lower())
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def evict(self, name):
+        with self.lock:
+            self.entries.pop(name.lower(), None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # Cached names, for tab completion
+    def names(self):
+        with self.lock:
+            return list(self.entries)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -1,9 +1,13 @@
 import sys
 import json
-from ldap3 import Server, Connection, ALL, MODIFY_ADD, MODIFY_DELETE
+import getpass
+import importlib
+from ldap3 import Connection, MODIFY_ADD, MODIFY_DELETE
 import logging
 from pathlib import Path
 
+from adtool import usage, replay, profiling, tracing, retry, serverpool, router, referrals, tlssession, asq, vlv, explain
+
 # ---- Logging Setup ----
 LOG_DIR = Path.home() / "adtool_logs"
 LOG_DIR.mkdir(exist_ok=True)
@@ -20,43 +24,107 @@ logger = logging.getLogger()
 
 
 # ---- Load credentials ----
-with open("credentials.json") as f:
-    creds = json.load(f)
+CREDENTIALS_FILE = "credentials.json"
 
-DC_IP = creds["dc_ip"]
-USERNAME = creds["username"]
-PASSWORD = creds["password"]
+def load_credentials():
+    with open(CREDENTIALS_FILE) as f:
+        return json.load(f)
 
 BASE_DN = "DC=lab,DC=local"
 USERS_DN = "CN=Users," + BASE_DN
 
 
 
-# Connect to AD and return the connection object
+# Connect to AD and return the connection object.
+# dc_ip may list several DCs, or "domain" finds them in DNS; the fastest
+# healthy one is used, failing over to the others (see serverpool.py and
+# locator.py). Transient DC errors are retried with backoff (see retry.py).
+# With read_from, lookups and listings go to a GC or replica (see router.py).
+# Referrals are followed per the referral policy (see referrals.py).
+# Each before_bind hook is called with the connection before it binds.
 
-def connect():
-    server = Server(DC_IP, get_info=ALL)
-    conn = Connection(server, user=USERNAME, password=PASSWORD)
+def connect(before_bind=()):
+    creds = load_credentials()
+    server = serverpool.server_for(creds)
+    conn = Connection(
+        server,
+        user=creds["username"],
+        password=creds["password"],
+        collect_usage=True
+    )
+    tlssession.attach(conn, creds)
+    retry.attach(conn)
+    referrals.apply(conn, referral_policy or creds.get("referrals"))
+    for hook in before_bind:
+        hook(conn)
     if not conn.bind():
         print("Bind failed.")
         print(conn.result)
         sys.exit()
+    tlssession.remember(conn)
+    serverpool.after_bind(conn, creds)
+    router.attach(conn, creds, before_bind)
     return conn
 
 
 
 
 
+# Cache of sAMAccountName -> DN, set by long-running modes (shell, batch)
+dn_cache = None
+
+# Referral policy from --referrals, overriding credentials.json
+referral_policy = None
+
+# How list-users-in-group finds members (--listing) and whether it shows
+# their display name, mail and state (--details)
+group_listing = "memberof"
+list_details = False
+
+# Order and window of list-users-in-group (--sort, --offset, --limit)
+list_sort = None
+list_offset = 0
+list_limit = None
+
+# Look up the DN of a user or group by sAMAccountName, or None if not found
+def find_dn(conn, name):
+    if dn_cache is not None:
+        dn = dn_cache.get(name)
+        if dn is not None:
+            return dn
+
+    reader = router.reader(conn)
+    reader.search(
+        BASE_DN,
+        f"(sAMAccountName={name})",
+        attributes=["distinguishedName"]
+    )
+    if not reader.entries:
+        return None
+
+    dn = reader.entries[0].distinguishedName.value
+    if dn_cache is not None:
+        dn_cache.put(name, dn)
+    return dn
+
+# Drop cached DNs after a failed write, in case they are stale
+def forget_dns(*names):
+    if dn_cache is not None:
+        for name in names:
+            dn_cache.evict(name)
+
+# Prompt for a password without echoing it or putting it in the shell's
+# readline history; piped input (replay, benchmarks) is read as a line
+def read_password(prompt):
+    if sys.stdin.isatty():
+        return getpass.getpass(prompt)
+    return input(prompt)
+
 # Create a new user with the given username (format: First.Last)
 
-def create_user(conn, username):
+def create_user(conn, username, password=None):
 
     try:
-        # ensure we have the right number of arguments
-        if len(sys.argv) < 3:
-            print("Usage: python adtool.py create-user First.Last")
-            sys.exit()
-
         first, last = username.split(".")
         display_name = f"{first} {last}"
         user_dn = f"CN={display_name},{USERS_DN}"
@@ -69,7 +137,7 @@ def create_user(conn, username):
 
         if conn.entries:
             print("User already exists.")
-            return
+            return False
 
         conn.add(
             user_dn,
@@ -86,76 +154,67 @@ def create_user(conn, username):
         if conn.result["result"] != 0:
             print("User creation failed.")
             print(conn.result)
-            return
+            return False
 
         # Set user password
-        newPassword = input(f"Enter password for {username} (must meet domain complexity): ")
-        conn.extend.microsoft.modify_password(user_dn, newPassword)
+        if password is None:
+            password = read_password(f"Enter password for {username} (must meet domain complexity): ")
+        conn.extend.microsoft.modify_password(user_dn, password)
+        if conn.result["result"] != 0:
+            print(f"User {username} created but setting the password failed; the account is disabled.")
+            print(conn.result)
+            return False
+
         conn.modify(user_dn, {"userAccountControl": [("MODIFY_REPLACE", [512])]})
+        if conn.result["result"] != 0:
+            print(f"User {username} created but enabling it failed.")
+            print(conn.result)
+            return False
 
         logger.info(f"User created and enabled: {username}")
         print(f"User {username} created and enabled.")
+        return True
 
     except Exception as e:
         logger.exception(f"Unexpected error in create_user for {username}")
         print("Unexpected error occurred. Check log file.")
+        return False
 
 # Create a new group with the given name
 def create_group(conn, group_name):
 
     try:
-        # ensure we have the right number of arguments
-        if len(sys.argv) < 3:
-            print("Usage: python adtool.py create-group GroupName")
-            sys.exit()
-
         group_dn = f"CN={group_name},{USERS_DN}"
         conn.add(group_dn, ["top", "group"], {"sAMAccountName": group_name})
 
         if conn.result["result"] == 0:
             print(f"Group {group_name} created successfully.")
+            return True
         else:
             print("Group creation failed.")
             print(conn.result)
+            return False
 
     except Exception as e:
         logger.exception(f"Unexpected error in create_group for {group_name}")
         print("Unexpected error occurred. Check log file.")
+        return False
 
 # Add a user to a group
 def add_user_to_group(conn, username, group_name):
 
     try:
-        # ensure we have the right number of arguments
-        if len(sys.argv) < 4:
-            print("Usage: python adtool.py add-user-to-group First.Last GroupName")
-            sys.exit()
-
         # Get user DN
-        conn.search(
-            BASE_DN,
-            f"(sAMAccountName={username})",
-            attributes=["distinguishedName"]
-        )
-
-        if not conn.entries:
+        user_dn = find_dn(conn, username)
+        if user_dn is None:
             print("User not found.")
-            return
-
-        user_dn = conn.entries[0].distinguishedName.value
+            return False
 
         # Get group DN
-        conn.search(
-            BASE_DN,
-            f"(sAMAccountName={group_name})",
-            attributes=["distinguishedName"]
-        )
-
-        if not conn.entries:
+        group_dn = find_dn(conn, group_name)
+        if group_dn is None:
             print("Group not found.")
-            return
-
-        group_dn = conn.entries[0].distinguishedName.value
+            return False
 
         # Add membership
         conn.modify(
@@ -165,48 +224,33 @@ def add_user_to_group(conn, username, group_name):
 
         if conn.result["result"] == 0:
             print(f"{username} added to {group_name}.")
+            return True
         else:
             print("Failed to add user to group.")
             print(conn.result)
+            forget_dns(username, group_name)
+            return False
 
     except Exception as e:
         logger.exception(f"Unexpected error in add_user_to_group for {username} in group {group_name}")
         print("Unexpected error occurred. Check log file.")
+        return False
 
 # Remove a user from a group
 def delete_user_from_group(conn, username, group_name):
 
     try:
-        # ensure we have the right number of arguments
-        if len(sys.argv) < 4:
-            print("Usage: python adtool.py delete-user-from-group First.Last GroupName")
-            sys.exit()
-
         # Get user DN
-        conn.search(
-            BASE_DN,
-            f"(sAMAccountName={username})",
-            attributes=["distinguishedName"]
-        )
-
-        if not conn.entries:
+        user_dn = find_dn(conn, username)
+        if user_dn is None:
             print("User not found.")
-            return
-
-        user_dn = conn.entries[0].distinguishedName.value
+            return False
 
         # Get group DN
-        conn.search(
-            BASE_DN,
-            f"(sAMAccountName={group_name})",
-            attributes=["distinguishedName"]
-        )
-
-        if not conn.entries:
+        group_dn = find_dn(conn, group_name)
+        if group_dn is None:
             print("Group not found.")
-            return
-
-        group_dn = conn.entries[0].distinguishedName.value
+            return False
 
         # Remove membership
         conn.modify(
@@ -216,44 +260,66 @@ def delete_user_from_group(conn, username, group_name):
 
         if conn.result["result"] == 0:
             print(f"{username} removed from {group_name}.")
+            return True
         else:
             print("Failed to remove from group.")
             print(conn.result)
+            forget_dns(username, group_name)
+            return False
     except Exception as e:
         logger.exception(f"Unexpected error in delete_user_from_group for {username} from group {group_name}")
         print("Unexpected error occurred. Check log file.")
+        return False
 
 # List all users in a group
 def list_users_in_group(conn, group_name):
 
     try:
-        # ensure we have the right number of arguments
-        if len(sys.argv) < 3:
-            print("Usage: python adtool.py list-users-in-group GroupName")
-            sys.exit()
+        reader = router.reader(conn)
+        attributes = asq.DETAIL_ATTRIBUTES if list_details else ["sAMAccountName"]
 
-        conn.search(
+        print("\nUsers:")
+        if list_sort is not None or list_offset or list_limit is not None:
+            sort = vlv.parse_sort(list_sort or vlv.DEFAULT_SORT)
+            entries, total = vlv.window(reader, BASE_DN, f"(memberOf=CN={group_name},{USERS_DN})", attributes,
+                                        sort, list_offset, list_limit)
+            for entry in entries:
+                print(asq.describe(entry["attributes"]) if list_details else asq.single(entry["attributes"]["sAMAccountName"]))
+            if entries:
+                print(f"({list_offset + 1}-{list_offset + len(entries)} of {total})")
+            return True
+
+        if group_listing == "asq":
+            try:
+                for member in asq.members(reader, f"CN={group_name},{USERS_DN}", attributes):
+                    print(asq.describe(member) if list_details else asq.single(member["sAMAccountName"]))
+                return True
+            except asq.ASQError as e:
+                if e.not_found:
+                    print("Group not found.")
+                    return False
+                if not e.unsupported:
+                    raise
+                logger.warning(f"{reader.server.host} does not support ASQ, listing {group_name} by memberOf")
+
+        reader.search(
             BASE_DN,
             f"(memberOf=CN={group_name},{USERS_DN})",
-            attributes=["sAMAccountName"]
+            attributes=attributes
         )
 
-        print("\nUsers:")
-        for entry in conn.entries:
-            print(entry.sAMAccountName)
+        for entry in reader.entries:
+            print(asq.describe(entry.entry_attributes_as_dict) if list_details else entry.sAMAccountName)
+        return True
 
     except Exception as e:
         logger.exception(f"Unexpected error in list_users_in_group for group {group_name}")
         print("Unexpected error occurred. Check log file.")
+        return False
 
 # enable user
 def enable_user(conn, username):
     try:
-        # ensure we have the right number of arguments
-        if len(sys.argv) < 3:
-            print("Usage: python adtool.py enable-user First.Last")
-            sys.exit()
-
         ACCOUNTDISABLE = 2
 
         logger.info(f"Attempting to enable user: {username}")
@@ -267,7 +333,7 @@ def enable_user(conn, username):
         if not conn.entries:
             logger.warning(f"User not found: {username}")
             print("User not found.")
-            return
+            return False
 
         user_dn = conn.entries[0].distinguishedName.value
         current_uac = int(conn.entries[0].userAccountControl.value)
@@ -282,23 +348,20 @@ def enable_user(conn, username):
         if conn.result["result"] == 0:
             logger.info(f"User enabled: {username}")
             print(f"{username} enabled.")
+            return True
         else:
             logger.error(f"Failed to enable user: {conn.result}")
             print("Failed to enable user.")
+            return False
 
     except Exception:
         logger.exception(f"Unexpected error in enable_user for {username}")
         print("Unexpected error occurred. Check log file.")
+        return False
 
 # disable user
 def disable_user(conn, username):
     try:
-        # Argument length check
-        if len(sys.argv) < 3:
-            print("Usage: adtool disable-user First.Last")
-            logger.warning("disable-user called with insufficient arguments")
-            sys.exit()
-
         ACCOUNTDISABLE = 2
 
         logger.info(f"Attempting to disable user: {username}")
@@ -313,7 +376,7 @@ def disable_user(conn, username):
         if not conn.entries:
             logger.warning(f"User not found: {username}")
             print("User not found.")
-            return
+            return False
 
         user_dn = conn.entries[0].distinguishedName.value
         current_uac = int(conn.entries[0].userAccountControl.value)
@@ -329,76 +392,263 @@ def disable_user(conn, username):
         if conn.result["result"] == 0:
             logger.info(f"User disabled successfully: {username}")
             print(f"{username} disabled.")
+            return True
         else:
             logger.error(f"Failed to disable user: {conn.result}")
             print("Failed to disable user.")
+            return False
 
     except Exception:
         logger.exception(f"Unexpected error in disable_user for {username}")
         print("Unexpected error occurred. Check log file.")
+        return False
+
+# ---- CLI Options ----
+
+# Remove a --flag from the command line, returning True if it was given
+def pop_flag(flag, argv=None):
+    if argv is None:
+        argv = sys.argv
+    if flag in argv:
+        argv.remove(flag)
+        return True
+    return False
+
+# Remove an --option VALUE pair from the command line, returning VALUE or the default
+def pop_option(option, default=None, argv=None):
+    if argv is None:
+        argv = sys.argv
+    if option not in argv:
+        return default
+
+    index = argv.index(option)
+    if index + 1 >= len(argv):
+        print(f"Missing value for {option}")
+        sys.exit()
+    value = argv[index + 1]
+    del argv[index:index + 2]
+    return value
+
+# Log (and optionally print) the LDAP cost of the command that just ran
+def report_usage(conn, command, before, show):
+    totals = usage.usage_since(conn, before)
+    if totals is None:
+        return
+
+    summary = usage.format_usage(command, totals)
+    logger.info(f"Usage {summary}")
+    if show:
+        print(summary)
+
+    if totals["referrals_connections"]:
+        logger.warning(f"{command} opened {totals['referrals_connections']} connections to follow referrals")
+
+    budget = usage.over_budget(command, totals)
+    if budget is not None:
+        logger.warning(f"{command} used {totals['operations']} operations, budget is {budget}")
+        if show:
+            print(f"Warning: {command} is over its budget of {budget} operations.")
 
 # ---- CLI Logic ----
+
+# Command name -> (function, arguments it takes). Each function prints its
+# outcome and returns True if it did what was asked, False if not.
+COMMANDS = {
+    "create-user": (create_user, ["First.Last"]),
+    "add-user-to-group": (add_user_to_group, ["First.Last", "GroupName"]),
+    "create-group": (create_group, ["GroupName"]),
+    "delete-user-from-group": (delete_user_from_group, ["First.Last", "GroupName"]),
+    "list-users-in-group": (list_users_in_group, ["GroupName"]),
+    "enable-user": (enable_user, ["First.Last"]),
+    "disable-user": (disable_user, ["First.Last"]),
+}
+
+# Long-running modes, each in its own module with a main(argv)
+TOOLS = {
+    "api": "serve the commands as a local HTTP/JSON API",
+    "shell": "interactive prompt that keeps one connection open",
+    "batch": "run a file of commands (or NDJSON) over one connection",
+    "dcs": "probe the configured DCs and show which one is used",
+    "verify-credentials": "check a file of account passwords with fast binds",
+    "delete-ou": "delete an OU and everything under it (tree delete or parallel)",
+}
+
+def print_commands():
+    for name, (func, arg_names) in COMMANDS.items():
+        print(f"  {name} {' '.join(arg_names)}")
+
+def print_tools():
+    for name, description in TOOLS.items():
+        print(f"  {name:<22} {description}")
+
+def run_tool(name, args):
+    module = importlib.import_module(f"adtool.{name.replace('-', '_')}")
+    module.main(args)
+
+# Make sure a command exists and has enough arguments, printing usage if not
+def check_arguments(command, args):
+    if command not in COMMANDS:
+        print("Unknown command. Please pick from the commands below:")
+        print_commands()
+        return False
+
+    func, arg_names = COMMANDS[command]
+    if len(args) < len(arg_names):
+        print(f"Usage: adtool {command} {' '.join(arg_names)}")
+        logger.warning(f"{command} called with insufficient arguments")
+        return False
+    return True
+
+# Run a command on an open connection.
+# Returns False if the command is unknown or has the wrong number of arguments.
+def run_command(conn, command, args):
+    if not check_arguments(command, args):
+        return False
+
+    func, arg_names = COMMANDS[command]
+    func(conn, *args[:len(arg_names)])
+    return True
+
 def main():
+    global referral_policy, group_listing, list_details, list_sort, list_offset, list_limit
 
+    conn = None
+    profiler = None
+    tracer = None
+    explainer = None
     try:
+        # tools parse their own options
+        if len(sys.argv) > 1 and sys.argv[1] in TOOLS:
+            run_tool(sys.argv[1], sys.argv[2:])
+            return
+
+        show_usage = pop_flag("--usage")
+        profile_mode = pop_option("--profile")
+        profile_out = pop_option("--profile-out")
+        profile_top = int(pop_option("--profile-top", 0))
+        trace_file = pop_option("--trace")
+        explain_searches = pop_flag("--explain")
+        referral_option = pop_option("--referrals")
+        listing_option = pop_option("--listing", "memberof")
+        details = pop_flag("--details")
+        sort_option = pop_option("--sort")
+        offset_option = pop_option("--offset", "0")
+        limit_option = pop_option("--limit")
+        capture_file = pop_option("--capture")
+        replay_file = pop_option("--replay")
+        latency_scale = float(pop_option("--latency-scale", 1.0))
+
         if len(sys.argv) < 2:
             print("Usage: adtool <command>")
             print("Please pick from the commands below:")
             print()
-            print("  create-user First.Last")
-            print("  add-user-to-group First.Last GroupName")
-            print("  create-group GroupName")
-            print("  delete-user-from-group First.Last GroupName")
-            print("  list-users-in-group GroupName")
-            print("  enable-user First.Last")
-            print("  disable-user First.Last")
+            print_commands()
+            print()
+            print("Tools:")
+            print_tools()
+            print()
+            print("Options:")
+            print("  --usage                print LDAP operations, bytes and time used by the command")
+            print("  --capture FILE         record the LDAP session (passwords redacted) to FILE")
+            print("  --replay FILE          answer from a captured session instead of the DC")
+            print("  --latency-scale N      with --replay, multiply recorded latencies by N (0 = none)")
+            print("  --profile cpu|mem      profile the command with cProfile or tracemalloc")
+            print("  --profile-out FILE     where --profile cpu writes its pstats dump")
+            print("  --profile-top N        number of functions / allocation sites to print")
+            print("  --trace FILE           write a Chrome trace (Perfetto) of every LDAP operation")
+            print("  --explain              print entries visited/returned, index and DC time of each search")
+            print("  --referrals POLICY     never, follow[:N] or pooled[:N] (default follow)")
+            print("  --listing memberof|asq how list-users-in-group finds members (asq: one paged search of the group)")
+            print("  --details              list-users-in-group also shows display name, mail and enabled state")
+            print("  --sort [-]ATTR         list-users-in-group sorted by ATTR (server-side sort when available)")
+            print("  --offset N --limit N   list-users-in-group shows only that window (VLV when available)")
             sys.exit()
         
 
         command = sys.argv[1]
+        args = sys.argv[2:]
 
-        conn = connect()
-
-        if command == "create-user":
-            username = sys.argv[2]
-            create_user(conn, username)
-
-        elif command == "add-user-to-group":
-            username = sys.argv[2]
-            group = sys.argv[3]
-            add_user_to_group(conn, username, group)
-
-        elif command == "create-group":
-            group_name = sys.argv[2]
-            create_group(conn, group_name)
-
-        elif command == "delete-user-from-group":
-            username = sys.argv[2]
-            group = sys.argv[3]
-            delete_user_from_group(conn, username, group)
-
-        elif command == "list-users-in-group":
-            group_name = sys.argv[2]
-            list_users_in_group(conn, group_name)
-
-        elif command == "enable-user":
-            username = sys.argv[2]
-            enable_user(conn, username)
+        if not check_arguments(command, args):
+            sys.exit()
 
-        elif command == "disable-user":
-            username = sys.argv[2]
-            disable_user(conn, username)
+        if profile_mode and profile_mode not in profiling.PROFILE_MODES:
+            print(f"Unknown profile mode. Use --profile {'|'.join(profiling.PROFILE_MODES)}")
+            sys.exit()
 
+        if referral_option is not None:
+            try:
+                referrals.parse_policy(referral_option)
+            except ValueError as e:
+                print(e)
+                sys.exit()
+            referral_policy = referral_option
+
+        if listing_option not in asq.LISTINGS:
+            print(f"Unknown listing. Use --listing {'|'.join(asq.LISTINGS)}")
+            sys.exit()
+        group_listing = listing_option
+        list_details = details
+
+        try:
+            if sort_option is not None:
+                vlv.parse_sort(sort_option)
+            list_offset = int(offset_option)
+            list_limit = int(limit_option) if limit_option is not None else None
+            if list_offset < 0 or (list_limit is not None and list_limit < 1):
+                raise ValueError("--offset must be 0 or more and --limit 1 or more")
+        except ValueError as e:
+            print(e)
+            sys.exit()
+        list_sort = sort_option
+
+        hooks = []
+        recorder = None
+        if capture_file:
+            recorder = replay.Recorder()
+            hooks.append(recorder.attach)
+        if trace_file:
+            tracer = tracing.Tracer()
+            hooks.append(tracer.attach)
+            tracer.start()
+        if profile_mode:
+            profiler = profiling.create(profile_mode, command, profile_out, profile_top)
+            hooks.append(profiler.attach)
+            profiler.start()
+        if explain_searches:
+            explainer = explain.Explainer()
+            hooks.append(explainer.attach)
+
+        if replay_file:
+            conn = replay.Replay(replay_file, latency_scale).connect(before_bind=hooks)
         else:
-            print("Unknown command. Please pick from the commands below:")
-            print("  python adtool.py create-user First.Last")
-            print("  python adtool.py add-user-to-group First.Last GroupName")
-            print("  python adtool.py create-group GroupName")
-            print("  python adtool.py delete-user-from-group First.Last GroupName")
-            print("  python adtool.py list-users-in-group GroupName")
-            print("  python adtool.py enable-user First.Last")
-            print("  python adtool.py disable-user First.Last")
-
+            conn = connect(before_bind=hooks)
+        if profiler:
+            profiler.enter("resolve")
+        before = usage.snapshot(conn)
+
+        if recorder:
+            recorder.start_command(command, args)
+        if explainer:
+            explainer.start()
+        with tracing.span(command, cat="command", args=args):
+            run_command(conn, command, args)
+        if explainer:
+            explainer.stop()
+            explainer.report()
+
+        if profiler:
+            profiler.stop()
+            profiler.report()
+        if tracer:
+            tracer.stop()
+            tracer.save(trace_file)
+            print(f"Trace written to {trace_file}")
+
+        report_usage(conn, command, before, show_usage)
+
+        if recorder:
+            recorder.save(capture_file, server=conn.server.host)
+            print(f"LDAP session captured to {capture_file}")
         
         conn.unbind()
         logging.shutdown()
@@ -407,6 +657,10 @@ def main():
         print("Fatal error occurred. Check log file.")
 
     finally:
+        if profiler:
+            profiler.stop()
+        if tracer:
+            tracer.stop()
         if conn:
             try:
                 conn.unbind()
@@ -0,0 +1,196 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from ldap3 import MODIFY_ADD, MODIFY_DELETE
+
+logger = logging.getLogger(__name__)
+
+# ---- Write coalescing for group membership ----
+#
+# Buffers member adds and deletes per group and sends each group's changes
+# as one multi-value modify, either when the group's oldest change is
+# `window` seconds old or when it has `max_changes` pending changes.
+#
+#   - an add and a delete of the same member cancel out: neither is sent and
+#     both requests complete as successful with "cancelled": True
+#   - repeated identical requests are sent once; the first gets the result
+#     of the modify and the repeats get what AD answers a repeat (already a
+#     member, or not a member), as they would one after the other
+#   - AD applies a modify all-or-nothing; if the combined modify fails, each
+#     change is retried on its own so every request gets its own result
+#
+# submit() returns a concurrent.futures.Future per request that completes
+# with the LDAP result dict of the modify that carried it.
+#
+# With a window the coalescer flushes from its own thread, so `modify` must
+# be safe to call from there (give it a connection of its own). With
+# window=None nothing is sent until flush() is called or a group reaches
+# max_changes, and modify runs in the caller's thread.
+
+DEFAULT_WINDOW = 0.05
+DEFAULT_MAX_CHANGES = 500
+
+CANCELLED_RESULT = {"result": 0, "description": "success", "message": "", "cancelled": True}
+
+# What AD answers a member add or delete that is already done
+REPEATED_RESULTS = {
+    MODIFY_ADD: {"result": 68, "description": "entryAlreadyExists", "dn": "", "referrals": None, "type": "modifyResponse",
+                 "message": "00000562: UpdErr: DSID-031A11E2, problem 6005 (ENTRY_EXISTS), data 0"},
+    MODIFY_DELETE: {"result": 53, "description": "unwillingToPerform", "dn": "", "referrals": None, "type": "modifyResponse",
+                    "message": "00000561: SvcErr: DSID-031A120C, problem 5003 (WILL_NOT_PERFORM), data 0"},
+}
+
+
+
+class PendingGroup(object):
+
+    def __init__(self, dn):
+        self.dn = dn
+        self.started = time.monotonic()
+        self.changes = OrderedDict()   # lower-case member DN -> [operation, member DN, futures, repeats]
+
+
+class MembershipCoalescer(object):
+
+    # modify(group_dn, changes) sends {"member": changes} and returns the LDAP result dict
+    def __init__(self, modify, window=DEFAULT_WINDOW, max_changes=DEFAULT_MAX_CHANGES):
+        self.modify = modify
+        self.window = window
+        self.max_changes = max_changes
+        self.groups = OrderedDict()    # lower-case group DN -> PendingGroup
+        self.due = set()               # groups at max_changes, for the flush thread
+        self.lock = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.closed = False
+
+        self.submitted = 0
+        self.cancelled = 0
+        self.modifies = 0
+
+        self.thread = None
+        if window:
+            self.thread = threading.Thread(target=self._flush_loop, name="adtool-coalesce", daemon=True)
+            self.thread.start()
+
+    def submit(self, group_dn, member_dn, operation):
+        future = Future()
+        key = group_dn.lower()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("coalescer is closed")
+            self.submitted += 1
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = PendingGroup(group_dn)
+                self.lock.notify()
+
+            member_key = member_dn.lower()
+            current = group.changes.get(member_key)
+            if current is None:
+                group.changes[member_key] = [operation, member_dn, [future], []]
+            elif current[0] == operation:
+                current[3].append(future)
+            else:
+                # add then delete (or delete then add): nothing to send
+                del group.changes[member_key]
+                self.cancelled += len(current[2]) + 1
+                for waiting in current[2] + [future]:
+                    waiting.set_result(dict(CANCELLED_RESULT))
+                for waiting in current[3]:
+                    waiting.set_result(dict(REPEATED_RESULTS[current[0]]))
+                if not group.changes:
+                    del self.groups[key]
+
+            full = key in self.groups and len(group.changes) >= self.max_changes
+            if full and self.thread is not None:
+                self.due.add(key)
+                self.lock.notify()
+
+        if full and self.thread is None:
+            self.flush_group(key)
+        return future
+
+    # Send everything that is buffered
+    def flush(self):
+        with self.lock:
+            keys = list(self.groups)
+        for key in keys:
+            self.flush_group(key)
+
+    def flush_group(self, key):
+        with self.flush_lock:
+            with self.lock:
+                group = self.groups.pop(key, None)
+                self.due.discard(key)
+            if group is None or not group.changes:
+                return
+            self._send(group)
+
+    def _send(self, group):
+        changes = list(group.changes.values())
+        adds = [dn for operation, dn, futures, repeats in changes if operation == MODIFY_ADD]
+        deletes = [dn for operation, dn, futures, repeats in changes if operation == MODIFY_DELETE]
+        request = []
+        if adds:
+            request.append((MODIFY_ADD, adds))
+        if deletes:
+            request.append((MODIFY_DELETE, deletes))
+
+        try:
+            self.modifies += 1
+            result = self.modify(group.dn, request)
+            if result["result"] == 0 or len(changes) == 1:
+                for change in changes:
+                    self._resolve(change, result)
+                return
+
+            logger.info(f"Coalesced modify of {group.dn} failed ({result['description']}), sending {len(changes)} changes one by one")
+            for change in changes:
+                self.modifies += 1
+                self._resolve(change, self.modify(group.dn, [(change[0], [change[1]])]))
+        except Exception as e:
+            logger.exception(f"Coalesced modify of {group.dn} failed")
+            for operation, dn, futures, repeats in changes:
+                for future in futures + repeats:
+                    if not future.done():
+                        future.set_exception(e)
+
+    # Complete one member's requests from the result of the modify that carried it
+    @staticmethod
+    def _resolve(change, result):
+        operation, dn, futures, repeats = change
+        for future in futures:
+            future.set_result(result)
+        repeated = dict(REPEATED_RESULTS[operation]) if result["result"] == 0 else result
+        for future in repeats:
+            future.set_result(repeated)
+
+    def _flush_loop(self):
+        while True:
+            with self.lock:
+                while not self.closed:
+                    now = time.monotonic()
+                    ready = set(self.due) | {key for key, group in self.groups.items() if now - group.started >= self.window}
+                    if ready:
+                        break
+                    oldest = min((group.started for group in self.groups.values()), default=None)
+                    self.lock.wait(None if oldest is None else oldest + self.window - now)
+                if self.closed:
+                    return
+            for key in ready:
+                self.flush_group(key)
+
+    # Flush what is left and stop the flush thread
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def stats(self):
+        return {"submitted": self.submitted, "cancelled": self.cancelled, "modifies": self.modifies}
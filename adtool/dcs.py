@@ -0,0 +1,48 @@
+import sys
+import time
+
+from adtool import cli, serverpool, locator
+
+# ---- DC probe ----
+#
+#   adtool dcs
+#   adtool dcs --refresh
+#
+# Shows the configured (or located) DCs in the order connections try them, with the bind
+# and search RTTs from the last probe. --refresh probes again now instead of
+# using the cached order.
+
+
+
+def main(argv):
+    refresh = cli.pop_flag("--refresh", argv)
+    if argv:
+        print("Usage: adtool dcs [--refresh]")
+        return
+
+    creds = cli.load_credentials()
+    if "dc_ip" not in creds:
+        site = locator.cached_site(creds, locator.load_cache())
+        print(f"DCs for {creds['domain']} from DNS, site {site or 'unknown'}")
+    dcs = serverpool.dc_list(creds)
+    if len(dcs) == 1:
+        print(f"Only one DC: {dcs[0]}")
+        return
+
+    order = serverpool.ordered_dcs(creds, refresh=refresh)
+    cached = serverpool.load_cache(dcs)
+    probes = {p["dc"]: p for p in cached["probes"]} if cached else {}
+
+    print(f"{'DC':<30} {'bind ms':>9} {'search ms':>10}  status")
+    for dc in order:
+        p = probes.get(dc)
+        if p is None:
+            print(f"{dc:<30} {'':>9} {'':>10}  not probed")
+        elif p["ok"]:
+            print(f"{dc:<30} {p['bind_ms']:>9.1f} {p['search_ms']:>10.1f}  ok")
+        else:
+            print(f"{dc:<30} {'':>9} {'':>10}  {p['error']}")
+    if cached:
+        print(f"Probed {int(time.time() - cached['probed'])}s ago; cached in {serverpool.CACHE_FILE}")
+    if not any(p.get("ok") for p in probes.values()):
+        sys.exit(1)
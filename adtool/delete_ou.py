@@ -0,0 +1,287 @@
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from ldap3 import BASE, SUBTREE
+from ldap3.core.results import (
+    RESULT_SUCCESS, RESULT_NO_SUCH_OBJECT, RESULT_ADMIN_LIMIT_EXCEEDED, RESULT_UNAVAILABLE_CRITICAL_EXTENSION,
+    RESULT_INSUFFICIENT_ACCESS_RIGHTS, RESULT_UNWILLING_TO_PERFORM
+)
+from ldap3.protocol.controls import build_control
+from ldap3.utils.dn import to_dn
+
+from adtool import cli, vlv
+
+logger = logging.getLogger(__name__)
+
+# ---- Delete an OU and everything under it ----
+#
+#   adtool delete-ou TestOU --dry-run
+#   adtool delete-ou TestOU
+#   adtool delete-ou "OU=Lab,OU=Test,DC=lab,DC=local" --no-tree-delete --workers 8
+#
+# The OU is first deleted with the AD tree delete control: one request,
+# and the DC removes the whole subtree itself. A DC that deletes a large
+# tree in steps answers adminLimitExceeded when it stopped part way, and
+# the request is repeated until the tree is gone.
+#
+# Where tree delete is refused (the control is unavailable, the account
+# lacks the right, or the DC will not do it) the subtree is read with one
+# paged search and deleted bottom-up in parallel: it is cut into subtrees
+# of at most about total / (workers * PARTITIONS_PER_WORKER) objects, each
+# deleted children-first by one of the worker connections, and the
+# containers above them are deleted last, deepest first. Progress is
+# printed every PROGRESS_SECONDS.
+#
+# --dry-run counts the objects under the OU by class from that same paged
+# search and says how they would be deleted, without deleting anything.
+
+TREE_DELETE_OID = "1.2.840.113556.1.4.805"
+DEFAULT_WORKERS = 4
+PARTITIONS_PER_WORKER = 4
+PROGRESS_SECONDS = 1.0
+
+# Tree delete rounds before giving up on a DC that keeps stopping part way
+MAX_TREE_DELETE_ROUNDS = 100
+
+# Classes objects are counted under, most specific first (computers are users too)
+OBJECT_CLASSES = ["computer", "user", "group", "contact", "organizationalUnit", "container"]
+
+# Results that mean "tree delete is not available here", not a failed delete
+TREE_DELETE_REFUSED = {RESULT_UNAVAILABLE_CRITICAL_EXTENSION, RESULT_INSUFFICIENT_ACCESS_RIGHTS,
+                       RESULT_UNWILLING_TO_PERFORM}
+
+
+
+# "TestOU" -> "OU=TestOU,DC=lab,DC=local"; full DNs are used as given
+def ou_dn(name):
+    if "=" in name:
+        return name
+    return f"OU={name},{cli.BASE_DN}"
+
+def parent_of(dn):
+    return ",".join(to_dn(dn)[1:])
+
+def depth(dn):
+    return len(to_dn(dn))
+
+def tree_delete_supported(conn):
+    info = conn.server.info
+    if info is None or not info.supported_controls:
+        return None
+    return any(control[0] == TREE_DELETE_OID for control in info.supported_controls)
+
+# Delete a subtree with the tree delete control. Returns True when it is
+# gone, False when tree delete was refused.
+def tree_delete(conn, dn):
+    for attempt in range(MAX_TREE_DELETE_ROUNDS):
+        conn.delete(dn, controls=[build_control(TREE_DELETE_OID, True, None)])
+        code = conn.result["result"]
+        if code == RESULT_SUCCESS:
+            return True
+        if code in TREE_DELETE_REFUSED:
+            logger.warning(f"Tree delete of {dn} refused: {conn.result.get('description')} {conn.result.get('message')}")
+            return False
+        if code != RESULT_ADMIN_LIMIT_EXCEEDED:
+            raise RuntimeError(f"Tree delete of {dn} failed: {conn.result.get('description')} {conn.result.get('message')}")
+        logger.info(f"Tree delete of {dn} stopped part way (round {attempt + 1}), repeating")
+    raise RuntimeError(f"Tree delete of {dn} not finished after {MAX_TREE_DELETE_ROUNDS} rounds")
+
+def object_class(classes):
+    lowered = [c.lower() for c in classes]
+    for name in OBJECT_CLASSES:
+        if name.lower() in lowered:
+            return name
+    return classes[-1] if classes else "unknown"
+
+# [(DN, object class)] of the OU and everything under it, from one paged search
+def enumerate_objects(conn, dn):
+    objects = []
+    for entry in vlv.paged(conn, dn, "(objectClass=*)", ["objectClass"], SUBTREE):
+        objects.append((entry["dn"], object_class(entry["attributes"].get("objectClass") or [])))
+    return objects
+
+# Cut the tree under root into subtrees of at most limit objects; small
+# subtrees of the same container (e.g. its leaves) are grouped together.
+# Returns ([DNs of each subtree, deepest first], [containers to delete after them, deepest first]).
+def partition(root, dns, limit):
+    children = {}
+    for dn in dns:
+        if dn.lower() != root.lower():
+            children.setdefault(parent_of(dn).lower(), []).append(dn)
+
+    sizes = {}
+
+    def size(dn):
+        if dn.lower() not in sizes:
+            sizes[dn.lower()] = 1 + sum(size(child) for child in children.get(dn.lower(), []))
+        return sizes[dn.lower()]
+
+    def members(dn):
+        found = [dn]
+        for child in children.get(dn.lower(), []):
+            found.extend(members(child))
+        return found
+
+    subtrees = []
+    containers = []
+
+    def add(group):
+        if group:
+            subtrees.append(sorted(group, key=depth, reverse=True))
+
+    def split(dn):
+        containers.append(dn)
+        group = []
+        for child in children.get(dn.lower(), []):
+            if size(child) > limit:
+                split(child)
+                continue
+            if len(group) + size(child) > limit:
+                add(group)
+                group = []
+            group.extend(members(child))
+        add(group)
+
+    split(root)
+    containers.sort(key=depth, reverse=True)
+    return subtrees, containers
+
+
+class ParallelDelete(object):
+
+    def __init__(self, total, workers=DEFAULT_WORKERS):
+        self.total = total
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="delete-ou")
+        self.lock = threading.Lock()
+        self.connections = []
+        self.deleted = 0
+        self.failed = []
+        self.started = time.perf_counter()
+        self.reported = self.started
+
+    # This thread's connection
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = cli.connect()
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def delete(self, conn, dn):
+        conn.delete(dn)
+        with self.lock:
+            if conn.result["result"] == RESULT_SUCCESS:
+                self.deleted += 1
+            else:
+                self.failed.append((dn, f"{conn.result.get('description')} {conn.result.get('message')}".strip()))
+            self.progress()
+
+    # Children first, on this thread's connection
+    def delete_subtree(self, dns):
+        conn = self.connection()
+        for dn in dns:
+            self.delete(conn, dn)
+
+    def progress(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.reported < PROGRESS_SECONDS:
+            return
+        self.reported = now
+        elapsed = now - self.started
+        print(f"  {self.deleted + len(self.failed)}/{self.total} done, {self.deleted} deleted, "
+              f"{len(self.failed)} failed ({self.deleted / elapsed if elapsed else 0:.0f}/s)")
+
+    def run(self, conn, subtrees, containers):
+        list(self.executor.map(self.delete_subtree, sorted(subtrees, key=len, reverse=True)))
+        for dn in containers:
+            self.delete(conn, dn)
+        self.progress(force=True)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for conn in self.connections:
+            try:
+                conn.unbind()
+            except Exception:
+                pass
+
+
+def main(argv):
+    dry_run = cli.pop_flag("--dry-run", argv)
+    no_tree_delete = cli.pop_flag("--no-tree-delete", argv)
+    confirmed = cli.pop_flag("--yes", argv)
+    workers = int(cli.pop_option("--workers", DEFAULT_WORKERS, argv))
+
+    if len(argv) != 1 or workers < 1:
+        print("Usage: adtool delete-ou OU [--dry-run] [--yes] [--no-tree-delete] [--workers N]")
+        return
+
+    dn = ou_dn(argv[0])
+    conn = cli.connect()
+    try:
+        conn.search(dn, "(objectClass=*)", BASE, attributes=["objectClass"])
+        if conn.result["result"] == RESULT_NO_SUCH_OBJECT or not conn.response:
+            print("OU not found.")
+            sys.exit(1)
+
+        use_tree_delete = not no_tree_delete and tree_delete_supported(conn) is not False
+        if dry_run:
+            objects = enumerate_objects(conn, dn)
+            print(f"{dn}: {len(objects)} objects")
+            for object_class, count in Counter(c for _, c in objects).most_common():
+                print(f"  {object_class:<24} {count}")
+            subtrees, containers = partition(dn, [d for d, _ in objects], max(1, len(objects) // (workers * PARTITIONS_PER_WORKER)))
+            parallel = f"parallel bottom-up delete of {len(subtrees)} subtrees on {workers} connections, then {len(containers)} containers"
+            print(f"Would use tree delete, or if refused a {parallel}." if use_tree_delete else f"Would use a {parallel}.")
+            return
+
+        if not confirmed:
+            try:
+                answer = input(f"Delete {dn} and everything under it? [y/N] ")
+            except EOFError:
+                answer = ""
+            if answer.strip().lower() not in ("y", "yes"):
+                print("Nothing deleted.")
+                return
+
+        logger.info(f"Deleting {dn} and everything under it")
+        started = time.perf_counter()
+        if use_tree_delete:
+            if tree_delete(conn, dn):
+                print(f"Deleted {dn} with tree delete in {time.perf_counter() - started:.1f} s.")
+                logger.info(f"Deleted {dn} with tree delete")
+                return
+            print(f"Tree delete refused ({conn.result.get('description')}), deleting bottom-up instead.")
+
+        objects = enumerate_objects(conn, dn)
+        limit = max(1, len(objects) // (workers * PARTITIONS_PER_WORKER))
+        subtrees, containers = partition(dn, [d for d, _ in objects], limit)
+        print(f"Deleting {len(objects)} objects bottom-up: {len(subtrees)} subtrees on {workers} connections, "
+              f"then {len(containers)} containers")
+        deleter = ParallelDelete(len(objects), workers)
+        try:
+            deleter.run(conn, subtrees, containers)
+        finally:
+            deleter.close()
+
+        elapsed = time.perf_counter() - started
+        summary = (f"delete-ou: {deleter.deleted} deleted, {len(deleter.failed)} failed in {elapsed:.1f} s "
+                   f"({deleter.deleted / elapsed if elapsed else 0:.0f}/s on {workers} connections)")
+        logger.info(summary)
+        print(summary)
+        for failed_dn, problem in deleter.failed:
+            logger.error(f"delete-ou: {failed_dn}: {problem}")
+        for failed_dn, problem in deleter.failed[:20]:
+            print(f"  {failed_dn}: {problem}")
+        if len(deleter.failed) > 20:
+            print(f"  ... and {len(deleter.failed) - 20} more (see {cli.LOG_FILE})")
+        if deleter.failed:
+            sys.exit(1)
+    finally:
+        conn.unbind()
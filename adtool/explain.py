@@ -0,0 +1,253 @@
+import sys
+import time
+import logging
+
+from pyasn1.codec.ber import decoder
+from pyasn1.error import PyAsn1Error
+from pyasn1.type import tag
+from pyasn1.type.namedtype import NamedTypes, NamedType
+from pyasn1.type.univ import Sequence, SequenceOf, Choice, OctetString, Integer
+from ldap3.protocol.controls import build_control
+
+logger = logging.getLogger(__name__)
+
+# ---- Search statistics (--explain) ----
+#
+#   adtool --explain list-users-in-group AllStaff
+#   python -m adtool.explain run.jsonl.gz
+#
+# With --explain every search the command sends carries the AD
+# LDAP_SERVER_GET_STATS_OID control, and the DC answers with what the search
+# cost it: entries visited and returned, the index its query optimiser
+# picked and the time spent on the DC. A filter answered from an index
+# visits about as many entries as it returns; one that is not indexed walks
+# the whole subtree (Ancestors_index or DNT_index) and visits everything
+# under the base. The statistics of each search are printed after the
+# command, and logged.
+#
+# --capture records the statistics with the responses, and running this
+# module on a capture file decodes them again, so the decoding can be
+# checked against responses recorded from a real DC.
+#
+# The control is not critical: DCs that do not send statistics (older ones,
+# or when the account may not see them) are reported as such.
+
+STATS_OID = "1.2.840.113556.1.4.970"
+
+# Request flags: run the search normally, and answer in the
+# name/value format of Windows Server 2003 and later
+SO_NORMAL = 0
+SO_EXTENDED_FMT = 8
+
+# Statistic numbers of the older tag/value response format
+STATISTIC_TAGS = {
+    1: "threadCount",
+    2: "coreTime",
+    3: "callTime",
+    4: "searchSubOperations",
+    5: "entriesReturned",
+    6: "entriesVisited",
+    7: "filter",
+    8: "index",
+    9: "pagesReferenced",
+    10: "pagesRead",
+    11: "pagesPreread",
+    12: "pagesDirtied",
+    13: "pagesRedirtied",
+    14: "logRecordCount",
+    15: "logRecordBytes",
+}
+
+# Indexes that mean the DC walked the subtree instead of using an attribute index
+SCAN_INDEXES = ("ancestors_index", "dnt_index")
+
+
+
+class StatsRequestValue(Sequence):
+    # StatsRequestValue ::= SEQUENCE { flags INTEGER }
+    componentType = NamedTypes(NamedType("flags", Integer()))
+
+
+class StatisticValue(Choice):
+    componentType = NamedTypes(
+        NamedType("intStatistic", Integer().subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 0))),
+        NamedType("stringStatistic", OctetString().subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 1)))
+    )
+
+
+class Statistic(Sequence):
+    componentType = NamedTypes(
+        NamedType("statisticName", OctetString()),
+        NamedType("statisticValue", StatisticValue())
+    )
+
+
+class StatsResponseValue(SequenceOf):
+    # StatsResponseValueV4 ::= SEQUENCE OF SEQUENCE { statisticName OCTET STRING,
+    #     CHOICE { intStatistic [0] INTEGER, stringStatistic [1] OCTET STRING } }
+    componentType = Statistic()
+
+
+def request_control(flags=SO_EXTENDED_FMT):
+    value = StatsRequestValue()
+    value["flags"] = flags
+    return build_control(STATS_OID, False, value)
+
+# Response control for {name: int or str}, in the name/value format
+def response_control(statistics):
+    value = StatsResponseValue()
+    for name, number in statistics.items():
+        statistic = Statistic()
+        statistic["statisticName"] = name
+        if isinstance(number, int):
+            statistic["statisticValue"]["intStatistic"] = number
+        else:
+            statistic["statisticValue"]["stringStatistic"] = number
+        value.append(statistic)
+    return build_control(STATS_OID, False, value)
+
+def _plain(value):
+    if isinstance(value, Integer):
+        return int(value)
+    return bytes(value).decode("utf-8", "replace").rstrip("\x00")
+
+# {name: value} from the raw value of a statistics response control, in
+# either the name/value or the older tag/value format
+def decode(raw):
+    try:
+        value, rest = decoder.decode(raw, asn1Spec=StatsResponseValue())
+        if not rest:
+            return {str(s["statisticName"]): _plain(s["statisticValue"].getComponent()) for s in value}
+    except PyAsn1Error:
+        pass
+
+    value, _ = decoder.decode(raw)
+    if not isinstance(value, Sequence):
+        raise ValueError("Not a statistics response value")
+    items = [_plain(value.getComponentByPosition(i)) for i in range(len(value))]
+    if len(items) % 2 or not all(isinstance(t, int) for t in items[::2]):
+        raise ValueError("Not a statistics response value")
+    return {STATISTIC_TAGS.get(t, f"statistic{t}"): v for t, v in zip(items[::2], items[1::2])}
+
+# Decoded statistics of a search result, or None if the DC sent none
+def statistics(result):
+    control = ((result or {}).get("controls") or {}).get(STATS_OID)
+    if control is None or not control.get("value"):
+        return None
+    try:
+        return decode(control["value"])
+    except (PyAsn1Error, ValueError) as e:
+        logger.warning(f"Cannot decode search statistics: {e}")
+        return None
+
+def scanned(stats):
+    return str(stats.get("index", "")).lower().startswith(SCAN_INDEXES)
+
+# Report lines for one search
+def describe(base, search_filter, stats, elapsed=None):
+    lines = [f"  {search_filter} under {base}"]
+    if stats is None:
+        lines.append("      no statistics returned")
+        return lines
+
+    detail = f"      {stats.get('entriesReturned', '?')} returned / {stats.get('entriesVisited', '?')} visited"
+    if stats.get("index"):
+        detail += f", index {stats['index']}"
+        if scanned(stats) and stats.get("entriesVisited", 0) > stats.get("entriesReturned", 0):
+            detail += " (not indexed: subtree scan)"
+    if stats.get("callTime") is not None:
+        detail += f", {stats['callTime']} ms on the DC"
+    if elapsed is not None:
+        detail += f" ({elapsed * 1000:.1f} ms round trip)"
+    lines.append(detail)
+    if stats.get("filter") and stats["filter"] != search_filter:
+        lines.append(f"      as optimised: {stats['filter']}")
+    return lines
+
+
+class Explainer(object):
+
+    def __init__(self):
+        self.queries = []
+        self.recording = False
+
+    def start(self):
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    # Send searches with the statistics control while recording; call before bind()
+    def attach(self, conn):
+        search = conn.search
+
+        def explained_search(search_base, search_filter, *args, **kwargs):
+            if not self.recording:
+                return search(search_base, search_filter, *args, **kwargs)
+            kwargs["controls"] = list(kwargs.get("controls") or []) + [request_control()]
+            started = time.perf_counter()
+            value = search(search_base, search_filter, *args, **kwargs)
+            self.queries.append({
+                "base": search_base,
+                "filter": search_filter,
+                "stats": statistics(conn.result),
+                "elapsed": time.perf_counter() - started,
+            })
+            return value
+
+        conn.search = explained_search
+        return conn
+
+    def report(self):
+        if not self.queries:
+            print("No searches to explain.")
+            return
+        print("\nSearch statistics:")
+        for query in self.queries:
+            lines = describe(query["base"], query["filter"], query["stats"], query["elapsed"])
+            for line in lines:
+                print(line)
+            logger.info("Explain " + " ".join(line.strip() for line in lines))
+
+
+# ---- Command line: statistics recorded in a capture file ----
+
+def main():
+    from adtool import replay
+
+    if len(sys.argv) != 2:
+        print("Usage: python -m adtool.explain CAPTURE_FILE")
+        sys.exit()
+
+    try:
+        header, records = replay.load_capture(sys.argv[1])
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    explained = 0
+    for record in records:
+        if "command" in record:
+            print(f"{record['command']} {' '.join(record['args'])}:")
+            continue
+        if record.get("op") != "searchRequest":
+            continue
+        value = (record.get("result", {}).get("controls") or {}).get(STATS_OID)
+        if value is None:
+            continue
+        request = record["request"]
+        try:
+            stats = decode(replay.decode_value(value))
+        except (PyAsn1Error, ValueError) as e:
+            print(f"  {request.get('filter')} under {request.get('base')}")
+            print(f"      cannot decode statistics ({e})")
+            continue
+        for line in describe(request.get("base"), request.get("filter"), stats, record.get("elapsed")):
+            print(line)
+        explained += 1
+
+    if not explained:
+        print("The capture has no search statistics; capture with --explain.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1315 @@
+import re
+import ast
+import sys
+import json
+import time
+import random
+import ssl
+import struct
+import logging
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+from pyasn1.codec.ber import decoder, encoder
+from pyasn1.type.namedtype import NamedTypes, NamedType
+from ldap3 import Server, Connection, MOCK_SYNC, OFFLINE_AD_2012_R2, ALL_ATTRIBUTES
+from ldap3.core.results import (
+    RESULT_SUCCESS, RESULT_SIZE_LIMIT_EXCEEDED, RESULT_AUTH_METHOD_NOT_SUPPORTED,
+    RESULT_UNAVAILABLE_CRITICAL_EXTENSION, RESULT_CONSTRAINT_VIOLATION, RESULT_NO_SUCH_OBJECT,
+    RESULT_INVALID_CREDENTIALS, RESULT_UNWILLING_TO_PERFORM, RESULT_NOT_ALLOWED_ON_NON_LEAF,
+    RESULT_ENTRY_ALREADY_EXISTS, RESULT_OPERATIONS_ERROR, RESULT_PROTOCOL_ERROR, RESULT_OTHER, RESULT_REFERRAL
+)
+from ldap3.operation.add import add_request_to_dict
+from ldap3.operation.bind import bind_request_to_dict
+from ldap3.operation.delete import delete_request_to_dict
+from ldap3.operation.modify import modify_request_to_dict
+from ldap3.operation.search import search_request_to_dict, parse_filter
+from ldap3.protocol.convert import build_controls_list
+from ldap3.protocol.rfc2696 import paged_search_control, RealSearchControlValue
+from ldap3.protocol.rfc4511 import (
+    LDAPMessage, MessageID, ProtocolOp, LDAPDN, LDAPString, ResultCode, AttributeDescription,
+    AttributeValue, Vals, PartialAttribute, PartialAttributeList, SearchResultEntry,
+    SearchResultDone, BindResponse, AddResponse, ModifyResponse, DelResponse, CompareResponse,
+    ModifyDNResponse, ExtendedResponse, ResponseName, ResponseValue, Referral, URI, Filter, And, Or,
+    SearchRequest
+)
+from ldap3.protocol.schemas.ad2012R2 import ad_2012_r2_schema, ad_2012_r2_dsa_info
+from ldap3.strategy.base import BaseStrategy
+from ldap3.strategy.mockSync import MockSyncStrategy
+from ldap3.utils.conv import to_unicode, to_raw
+from ldap3.utils.dn import safe_dn
+
+from adtool import locator, asq, vlv, explain
+
+logger = logging.getLogger(__name__)
+
+# ---- Fake Active Directory ----
+#
+# An in-process directory that behaves like a domain controller where adtool
+# depends on it, built on ldap3's MOCK_SYNC strategy:
+#
+#   - member / memberOf back-links are kept in step on add, modify and delete
+#   - new users get userAccountControl 546 (disabled, no password) and
+#     disabled accounts cannot bind
+#   - unicodePwd is write-only, must be a quoted UTF-16-LE string and must
+#     meet complexity rules; accounts can bind with the password they were given
+#   - searches return at most MaxPageSize entries unless paged, and
+#     multi-valued attributes are split with ;range= like MaxValRange
+#   - sAMAccountName is unique and indexed
+#   - base searches with the ASQ control return the entries the base's
+#     member (or other DN-valued) attribute points to
+#   - the server-side sort and VLV (by offset) controls are honoured
+#   - fast bind mode can be requested before the first bind
+#   - non-leaf objects can only be deleted with the tree delete control,
+#     unless tree delete is turned off (--no-tree-delete)
+#   - searches with the statistics control are answered with entries
+#     visited and returned and the index used (sAMAccountName, memberOf)
+#   - every operation can be given an artificial round-trip latency
+#   - over TCP, operations under a referral DN are answered with a referral
+#
+# The same directory can be served over TCP so the real adtool CLI can bind
+# to it:
+#
+#   python -m adtool.fakead --port 3890 --users 10000 --latency-ms 5
+#
+# --dns-port also answers the DC locator SRV queries for the domain (and
+# --site) with this server, for testing "domain" in credentials.json:
+#
+#   python -m adtool.fakead --port 3890 --dns-port 5353 --site Branch1
+#
+# --test-ou seeds an OU of N users in sub-OUs, for trying out delete-ou:
+#
+#   python -m adtool.fakead --port 3890 --test-ou Decommission=30000
+#
+# --cert (a PEM file with the certificate and its key) turns on StartTLS on
+# the plain port, and --ldaps-port adds an LDAPS listener:
+#
+#   python -m adtool.fakead --port 3890 --ldaps-port 6360 --cert lab.pem
+
+ACCOUNTDISABLE = 0x2
+PASSWD_NOTREQD = 0x20
+NORMAL_ACCOUNT = 0x200
+
+# userAccountControl AD gives a user created without a password
+NEW_USER_UAC = NORMAL_ACCOUNT | PASSWD_NOTREQD | ACCOUNTDISABLE
+
+GLOBAL_SECURITY_GROUP = -2147483646
+
+# Default LDAP policy limits of a Windows Server domain controller
+MAX_PAGE_SIZE = 1000
+MAX_VALUE_RANGE = 1500
+
+PAGED_RESULTS_OID = "1.2.840.113556.1.4.319"
+STARTTLS_OID = "1.3.6.1.4.1.1466.20037"
+FAST_BIND_OID = "1.2.840.113556.1.4.1781"
+TREE_DELETE_OID = "1.2.840.113556.1.4.805"
+
+# Users per sub-OU of a --test-ou
+TEST_OU_SIZE = 500
+
+# Controls the fake accepts; critical controls not listed are refused
+SUPPORTED_CONTROLS = [PAGED_RESULTS_OID, asq.ASQ_OID, vlv.SORT_OID, vlv.VLV_OID]
+
+# Indexes reported in search statistics for the filters the fake indexes
+INDEX_NAMES = {"samaccountname": "idx_sAMAccountName:1:N", "memberof": "idx_memberOf:1:N"}
+
+DEFAULT_DOMAIN = "lab.local"
+DEFAULT_NETBIOS = "LAB"
+DEFAULT_ADMIN_PASSWORD = "Passw0rd!"
+DEFAULT_USER_PASSWORD = "User-Passw0rd!"
+
+# Request type -> latency key used in the latency settings
+OPERATION_NAMES = {
+    "bindRequest": "bind",
+    "searchRequest": "search",
+    "addRequest": "add",
+    "modifyRequest": "modify",
+    "delRequest": "delete",
+    "modDNRequest": "modify_dn",
+    "compareRequest": "compare",
+    "extendedReq": "extended",
+}
+
+# Diagnostic messages in the form AD sends them
+BAD_PASSWORD = "80090308: LdapErr: DSID-0C090439, comment: AcceptSecurityContext error, data 52e, v4563"
+ACCOUNT_DISABLED = "80090308: LdapErr: DSID-0C090439, comment: AcceptSecurityContext error, data 533, v4563"
+ENTRY_EXISTS = "00000524: UpdErr: DSID-031A11E2, problem 6005 (ENTRY_EXISTS), data 0"
+NO_OBJECT = "0000208D: NameErr: DSID-03100241, problem 2001 (NO_OBJECT), data 0"
+MEMBER_EXISTS = "00000562: UpdErr: DSID-031A11E2, problem 6005 (ENTRY_EXISTS), data 0"
+NOT_A_MEMBER = "00000561: SvcErr: DSID-031A120C, problem 5003 (WILL_NOT_PERFORM), data 0"
+WILL_NOT_PERFORM = "0000001F: SvcErr: DSID-031A12D2, problem 5003 (WILL_NOT_PERFORM), data 0"
+PASSWORD_POLICY = "0000052D: Constraint violation - check_password_restrictions: the password does not meet the complexity criteria"
+PASSWORD_REQUIRED = "0000052D: SvcErr: DSID-031A12D2, problem 5003 (WILL_NOT_PERFORM), data 0"
+NOT_AUTHORIZED = "000004DC: LdapErr: DSID-0C090A5C, comment: In order to perform this operation a successful bind must be completed on the connection., data 0, v4563"
+NON_LEAF = "00002015: UpdErr: DSID-031B0E3B, problem 6003 (CANT_ON_NON_LEAF), data 0"
+
+
+
+def _result(code=RESULT_SUCCESS, message=""):
+    return {"resultCode": code, "matchedDN": "", "diagnosticMessage": message, "referral": None}
+
+def _values(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+def _text(value):
+    return to_unicode(value) if isinstance(value, (bytes, bytearray)) else str(value)
+
+# (oid, criticality, raw value) for controls given as tuples or asn1 Control objects
+def control_list(controls):
+    if not controls:
+        return []
+    built = build_controls_list(list(controls))
+    decoded = []
+    for control in built:
+        value = control["controlValue"]
+        decoded.append((
+            str(control["controlType"]),
+            bool(control["criticality"]),
+            bytes(value) if value.hasValue() else None,
+        ))
+    return decoded
+
+# Raw bytes of an attribute in an add request, as sent on the wire
+def raw_add_values(request_message, attribute):
+    for item in request_message["attributes"]:
+        if str(item["type"]).lower() == attribute.lower():
+            return [bytes(value) for value in item["vals"]]
+    return []
+
+# (operation, raw bytes) for each change to an attribute in a modify request
+def raw_changes(request_message, attribute):
+    changes = []
+    for change in request_message["changes"]:
+        if str(change["modification"]["type"]).lower() == attribute.lower():
+            changes.append((int(change["operation"]), [bytes(value) for value in change["modification"]["vals"]]))
+    return changes
+
+# Decode a unicodePwd value: the password in double quotes, UTF-16-LE encoded
+def decode_unicode_pwd(value):
+    try:
+        text = bytes(value).decode("utf-16-le")
+    except (UnicodeDecodeError, TypeError):
+        return None
+    if len(text) < 2 or not (text.startswith('"') and text.endswith('"')):
+        return None
+    return text[1:-1]
+
+# Default domain complexity: 7+ characters from at least 3 character classes
+def meets_complexity(password, sam_account_name=""):
+    if len(password) < 7:
+        return False
+    if sam_account_name and len(sam_account_name) > 2 and sam_account_name.lower() in password.lower():
+        return False
+    classes = [
+        any(c.islower() for c in password),
+        any(c.isupper() for c in password),
+        any(c.isdigit() for c in password),
+        any(not c.isalnum() for c in password),
+    ]
+    return sum(classes) >= 3
+
+# Parse a latency setting like "5" or "search=2,modify=10,default=1" (milliseconds)
+def parse_latency(text):
+    latency = {}
+    if not text:
+        return latency
+    for part in text.split(","):
+        name, _, value = part.rpartition("=")
+        latency[name or "default"] = float(value) / 1000.0
+    return latency
+
+
+class FakeDirectory(object):
+
+    def __init__(self, latency=None, jitter=0.0, max_page_size=MAX_PAGE_SIZE,
+                 max_value_range=MAX_VALUE_RANGE, check_complexity=True,
+                 require_secure_password=False, domain=DEFAULT_DOMAIN, netbios=DEFAULT_NETBIOS,
+                 tree_delete=True):
+        self.server = Server("fake-ad", get_info=OFFLINE_AD_2012_R2)
+        self.server.fake_directory = self
+        self.lock = threading.RLock()
+
+        self.latency = latency or {}
+        self.jitter = jitter
+        self.max_page_size = max_page_size
+        self.max_value_range = max_value_range
+        self.check_complexity = check_complexity
+        self.require_secure_password = require_secure_password
+        self.tree_delete = tree_delete
+        self.domain = domain
+        self.netbios = netbios
+        self.base_dn = ",".join(f"DC={part}" for part in domain.split("."))
+
+        self.passwords = {}   # lower-case DN -> password
+        self.sam_index = {}   # lower-case sAMAccountName -> DN
+        self.upn_index = {}   # lower-case userPrincipalName -> DN
+        self.referrals = {}   # lower-case DN -> referral URL (TCP server only)
+
+        self._seeder = self.connect()
+        self._seeder.strategy.add_entry(self.base_dn, {"objectClass": ["top", "domain"]})
+        self._seeder.strategy.add_entry("CN=Users," + self.base_dn, {"objectClass": ["top", "container"]})
+
+    # A MOCK_SYNC connection to this directory using the AD strategy
+    def connect(self, user=None, password=None, **kwargs):
+        conn = Connection(self.server, user=user, password=password, client_strategy=MOCK_SYNC, **kwargs)
+        strategy = FakeADStrategy(conn)
+        conn.strategy = strategy
+        conn.send = strategy.send
+        conn.open = strategy.open
+        conn.get_response = strategy.get_response
+        conn.post_send_single_response = strategy.post_send_single_response
+        conn.post_send_search = strategy.post_send_search
+        return conn
+
+    # Sleep for the configured round trip of an operation
+    def inject_latency(self, message_type):
+        delay = self.latency.get(OPERATION_NAMES.get(message_type), self.latency.get("default", 0.0))
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def entry(self, dn):
+        return self.server.dit.get(safe_dn(dn))
+
+    # Find the DN of an account from a DN, DOMAIN\sAMAccountName or UPN
+    def resolve_account(self, name):
+        if "\\" in name:
+            domain, _, sam = name.partition("\\")
+            if domain.lower() != self.netbios.lower():
+                return None
+            return self.sam_index.get(sam.lower())
+        if "@" in name and "=" not in name:
+            return self.upn_index.get(name.lower())
+        dn = safe_dn(name)
+        return dn if dn in self.server.dit else None
+
+    # Root DSE and schema entries, read from ldap3's offline AD 2012 R2 data
+    # and rewritten for this domain, so clients using get_info=ALL can connect
+    def special_entry(self, base):
+        if not hasattr(self, "_special_entries"):
+            dsa_info = json.loads(ad_2012_r2_dsa_info)["raw"]
+            schema = json.loads(ad_2012_r2_schema)
+            self.schema_dn = self._rewrite(schema["schema_entry"])
+            self._special_entries = {
+                "": self._raw_entry("", dsa_info),
+                self.schema_dn.lower(): self._raw_entry(self.schema_dn, schema["raw"]),
+            }
+        return self._special_entries.get(base.lower())
+
+    def _rewrite(self, value):
+        return (value.replace("DC=AD2012,DC=LAB", self.base_dn)
+                .replace("AD2012.LAB", self.domain.upper())
+                .replace("WIN1", "FAKEDC").replace("win1", "fakedc"))
+
+    def _raw_entry(self, dn, raw):
+        attributes = []
+        for name, values in raw.items():
+            if isinstance(values, str):
+                values = ast.literal_eval(values) if values.startswith("[") else [values]
+            attributes.append({"type": name, "vals": [to_raw(self._rewrite(str(v))) for v in values]})
+        return {"object": dn, "attributes": attributes}
+
+    # ---- Seeding helpers ----
+
+    def add_user(self, name, password=None, enabled=True, container=None):
+        first, _, last = name.partition(".")
+        display_name = f"{first} {last}".strip()
+        dn = f"CN={display_name},{container or 'CN=Users,' + self.base_dn}"
+        uac = NORMAL_ACCOUNT if enabled else NORMAL_ACCOUNT | ACCOUNTDISABLE
+        attributes = {
+            "objectClass": ["top", "person", "organizationalPerson", "user"],
+            "sAMAccountName": name,
+            "userPrincipalName": f"{name}@{self.domain}",
+            "displayName": display_name,
+            "userAccountControl": uac,
+        }
+        if last:
+            attributes["givenName"] = first
+            attributes["sn"] = last
+        with self.lock:
+            self._seeder.strategy.add_entry(dn, attributes)
+            if password is not None:
+                self.passwords[dn.lower()] = password
+        return dn
+
+    def add_group(self, name, members=(), container=None):
+        dn = f"CN={name},{container or 'CN=Users,' + self.base_dn}"
+        with self.lock:
+            self._seeder.strategy.add_entry(dn, {
+                "objectClass": ["top", "group"],
+                "sAMAccountName": name,
+                "groupType": GLOBAL_SECURITY_GROUP,
+            })
+            for member in members:
+                self.link(dn, member)
+        return dn
+
+    def add_ou(self, name, container=None):
+        dn = f"OU={name},{container or self.base_dn}"
+        with self.lock:
+            self._seeder.strategy.add_entry(dn, {"objectClass": ["top", "organizationalUnit"], "ou": name})
+        return dn
+
+    # An OU of count users, TEST_OU_SIZE to a sub-OU
+    def add_test_ou(self, name, count):
+        dn = self.add_ou(name)
+        for part in range(0, count, TEST_OU_SIZE):
+            part_dn = self.add_ou(f"Part{part // TEST_OU_SIZE + 1:03d}", dn)
+            for i in range(part, min(count, part + TEST_OU_SIZE)):
+                self.add_user(f"{name}{i:06d}.Test", container=part_dn)
+        return dn
+
+    # Add a member to a group, keeping memberOf on the member in step
+    def link(self, group_dn, member_dn):
+        group = self.entry(group_dn)
+        member = self.entry(member_dn)
+        group.setdefault("member", []).append(to_raw(member_dn))
+        member.setdefault("memberOf", []).append(to_raw(group_dn))
+
+    def unlink(self, group_dn, member_dn):
+        for dn, attribute, value in ((group_dn, "member", member_dn), (member_dn, "memberOf", group_dn)):
+            entry = self.entry(dn)
+            if entry is None or attribute not in entry:
+                continue
+            entry[attribute] = [v for v in entry[attribute] if _text(v).lower() != value.lower()]
+            if not entry[attribute]:
+                del entry[attribute]
+
+    # Give every user that was loaded without a password the same one
+    def set_missing_passwords(self, password):
+        with self.lock:
+            for dn, entry in self.server.dit.items():
+                classes = [_text(c).lower() for c in entry.get("objectClass", [])]
+                if "user" in classes and dn.lower() not in self.passwords:
+                    self.passwords[dn.lower()] = password
+
+    # Answer operations on base_dn and below with a referral to url, the way
+    # a DC refers requests for another domain's naming context
+    def add_referral(self, base_dn, url):
+        self.referrals[safe_dn(base_dn).lower()] = url
+
+    def referral_for(self, dn):
+        dn = safe_dn(dn).lower() if dn else ""
+        for base, url in self.referrals.items():
+            if dn == base or dn.endswith("," + base):
+                return url
+        return None
+
+    # A site whose subnets (CIDRs) map clients to it, as AD Sites and Services stores them
+    def add_site(self, name, subnets=()):
+        sites = "CN=Sites,CN=Configuration," + self.base_dn
+        with self.lock:
+            for dn, object_class in (("CN=Configuration," + self.base_dn, "configuration"),
+                                     (sites, "sitesContainer"),
+                                     ("CN=Subnets," + sites, "subnetContainer")):
+                if self.entry(dn) is None:
+                    self._seeder.strategy.add_entry(dn, {"objectClass": ["top", object_class]})
+            site_dn = f"CN={name},{sites}"
+            self._seeder.strategy.add_entry(site_dn, {"objectClass": ["top", "site"], "cn": name})
+            for cidr in subnets:
+                self._seeder.strategy.add_entry(f"CN={cidr},CN=Subnets,{sites}",
+                                                {"objectClass": ["top", "subnet"], "cn": cidr, "siteObject": site_dn})
+        return site_dn
+
+    # Serve this directory over TCP; returns the started FakeADServer
+    def listen(self, host="127.0.0.1", port=0, ssl_context=None, starttls_context=None):
+        server = FakeADServer(self, (host, port), ssl_context, starttls_context=starttls_context)
+        thread = threading.Thread(target=server.serve_forever, name="fakead", daemon=True)
+        thread.start()
+        return server
+
+
+class FakeADStrategy(MockSyncStrategy):
+
+    def __init__(self, ldap_connection):
+        MockSyncStrategy.__init__(self, ldap_connection)
+        self.directory = ldap_connection.server.fake_directory
+        self.secure = False
+
+    # ---- Latency and locking for in-process use ----
+
+    def post_send_search(self, payload):
+        self.directory.inject_latency(payload[1])
+        with self.directory.lock:
+            response = MockSyncStrategy.post_send_search(self, payload)
+        if self.connection.auto_range and not hasattr(self, "_auto_range_searching"):
+            response = self._follow_ranges(payload[2], response)
+        return response
+
+    def post_send_single_response(self, payload):
+        self.directory.inject_latency(payload[1])
+        with self.directory.lock:
+            return MockSyncStrategy.post_send_single_response(self, payload)
+
+    # Fetch the remaining ;range= chunks the way ldap3 does for real servers
+    def _follow_ranges(self, request, response):
+        if not any(";range=" in name for entry in response for name in entry.get("raw_attributes", {})):
+            return response
+        result = self.connection.result
+        self._auto_range_searching = result
+        try:
+            self.do_search_on_auto_range(search_request_to_dict(request), response)
+        finally:
+            del self._auto_range_searching
+        self.connection.response = response
+        self.connection.result = result
+        return response
+
+    # ---- Directory bookkeeping ----
+
+    def add_entry(self, dn, attributes, validate=True):
+        dn = safe_dn(dn)
+        attributes = dict(attributes)
+        attributes.setdefault("distinguishedName", dn)
+        if not MockSyncStrategy.add_entry(self, dn, attributes, validate):
+            return False
+
+        entry = self.connection.server.dit[dn]
+        for attribute, index in (("sAMAccountName", self.directory.sam_index),
+                                 ("userPrincipalName", self.directory.upn_index)):
+            if attribute in entry:
+                index[_text(entry[attribute][0]).lower()] = dn
+        return True
+
+    def remove_entry(self, dn):
+        dn = safe_dn(dn)
+        entry = self.connection.server.dit.get(dn)
+        if entry is None:
+            return False
+
+        for group_dn in [_text(v) for v in entry.get("memberOf", [])]:
+            self.directory.unlink(group_dn, dn)
+        for member_dn in [_text(v) for v in entry.get("member", [])]:
+            self.directory.unlink(dn, member_dn)
+        for attribute, index in (("sAMAccountName", self.directory.sam_index),
+                                 ("userPrincipalName", self.directory.upn_index)):
+            if attribute in entry:
+                index.pop(_text(entry[attribute][0]).lower(), None)
+        self.directory.passwords.pop(dn.lower(), None)
+        del self.connection.server.dit[dn]
+        return True
+
+    def _password_error(self, dn, password):
+        if password is None:
+            return _result(RESULT_UNWILLING_TO_PERFORM, WILL_NOT_PERFORM)
+        if self.directory.require_secure_password and not self.secure:
+            return _result(RESULT_UNWILLING_TO_PERFORM, WILL_NOT_PERFORM)
+        if self.directory.check_complexity:
+            entry = self.connection.server.dit.get(dn, {})
+            sam = _text(entry["sAMAccountName"][0]) if "sAMAccountName" in entry else ""
+            if not meets_complexity(password, sam):
+                return _result(RESULT_CONSTRAINT_VIOLATION, PASSWORD_POLICY)
+        return None
+
+    # ---- Operations ----
+
+    def mock_bind(self, request_message, controls):
+        request = bind_request_to_dict(request_message)
+        result = _result()
+        result["serverSaslCreds"] = None
+
+        if "simple" not in request["authentication"]:
+            result.update(_result(RESULT_AUTH_METHOD_NOT_SUPPORTED, "only simple bind is supported"))
+            return result
+
+        name = request["name"]
+        password = _text(request["authentication"]["simple"] or "")
+        if not password:
+            # AD treats a bind with an empty password as anonymous
+            self.bound = "<anonymous>"
+            return result
+
+        dn = self.directory.resolve_account(name)
+        if dn is None or self.directory.passwords.get(dn.lower()) != password:
+            result.update(_result(RESULT_INVALID_CREDENTIALS, BAD_PASSWORD))
+            return result
+
+        entry = self.connection.server.dit[dn]
+        if "userAccountControl" in entry and int(entry["userAccountControl"][0]) & ACCOUNTDISABLE:
+            result.update(_result(RESULT_INVALID_CREDENTIALS, ACCOUNT_DISABLED))
+            return result
+
+        self.bound = dn
+        return result
+
+    def mock_add(self, request_message, controls):
+        request = add_request_to_dict(request_message)
+        dn = safe_dn(request["entry"])
+        attributes = {name: _values(values) for name, values in request["attributes"].items()}
+        dit = self.connection.server.dit
+
+        if dn in dit:
+            return _result(RESULT_ENTRY_ALREADY_EXISTS, ENTRY_EXISTS)
+        parent = dn.partition(",")[2]
+        if parent not in dit:
+            return _result(RESULT_NO_SUCH_OBJECT, NO_OBJECT)
+
+        names = {name.lower(): name for name in attributes}
+        if "sAMAccountName".lower() in names:
+            sam = _text(attributes[names["samaccountname"]][0])
+            if sam.lower() in self.directory.sam_index:
+                return _result(RESULT_ENTRY_ALREADY_EXISTS, ENTRY_EXISTS)
+        if "memberof" in names:
+            return _result(RESULT_UNWILLING_TO_PERFORM, WILL_NOT_PERFORM)
+
+        password = None
+        if "unicodepwd" in names:
+            del attributes[names["unicodepwd"]]
+            password = decode_unicode_pwd(raw_add_values(request_message, "unicodePwd")[0])
+            error = self._password_error(dn, password)
+            if error:
+                return error
+
+        members = [_text(v) for v in attributes.pop(names["member"], [])] if "member" in names else []
+        for member in members:
+            if safe_dn(member) not in dit:
+                return _result(RESULT_NO_SUCH_OBJECT, NO_OBJECT)
+
+        classes = [_text(c).lower() for c in attributes.get(names.get("objectclass", "objectClass"), [])]
+        if "user" in classes and "useraccountcontrol" not in names:
+            attributes["userAccountControl"] = [NEW_USER_UAC]
+        if "group" in classes and "grouptype" not in names:
+            attributes["groupType"] = [GLOBAL_SECURITY_GROUP]
+
+        if not self.add_entry(dn, attributes):
+            return _result(RESULT_OPERATIONS_ERROR, "error adding entry")
+
+        if password is not None:
+            self.directory.passwords[dn.lower()] = password
+        for member in members:
+            self.directory.link(dn, safe_dn(member))
+        return _result()
+
+    def mock_modify(self, request_message, controls):
+        request = modify_request_to_dict(request_message)
+        dn = safe_dn(request["entry"])
+        changes = request["changes"]
+        dit = self.connection.server.dit
+
+        if dn not in dit:
+            return _result(RESULT_NO_SUCH_OBJECT, NO_OBJECT)
+        entry = dit[dn]
+
+        attributes = [change["attribute"]["type"].lower() for change in changes]
+        if "memberof" in attributes:
+            return _result(RESULT_UNWILLING_TO_PERFORM, WILL_NOT_PERFORM)
+        if "unicodepwd" in attributes:
+            if set(attributes) != {"unicodepwd"}:
+                return _result(RESULT_UNWILLING_TO_PERFORM, WILL_NOT_PERFORM)
+            return self._modify_password(dn, raw_changes(request_message, "unicodePwd"))
+
+        # Work out the new member list first so a bad change leaves the group untouched
+        before = {_text(v).lower(): _text(v) for v in entry.get("member", [])}
+        after = dict(before)
+        for change in changes:
+            if change["attribute"]["type"].lower() != "member":
+                continue
+            values = {_text(v).lower(): _text(v) for v in change["attribute"]["value"]}
+            for value in values.values():
+                if change["operation"] in (0, 2) and safe_dn(value) not in dit:
+                    return _result(RESULT_NO_SUCH_OBJECT, NO_OBJECT)
+            if change["operation"] == 0:
+                if any(key in after for key in values):
+                    return _result(RESULT_ENTRY_ALREADY_EXISTS, MEMBER_EXISTS)
+                after.update(values)
+            elif change["operation"] == 1:
+                if not values:
+                    after = {}
+                elif any(key not in after for key in values):
+                    return _result(RESULT_UNWILLING_TO_PERFORM, NOT_A_MEMBER)
+                for key in values:
+                    after.pop(key, None)
+            elif change["operation"] == 2:
+                after = values
+
+        for change in changes:
+            if change["attribute"]["type"].lower() == "useraccountcontrol" and change["operation"] == 2:
+                uac = int(_text(change["attribute"]["value"][0]))
+                enabling = not uac & ACCOUNTDISABLE and not uac & PASSWD_NOTREQD
+                if enabling and dn.lower() not in self.directory.passwords:
+                    return _result(RESULT_UNWILLING_TO_PERFORM, PASSWORD_REQUIRED)
+
+        result = MockSyncStrategy.mock_modify(self, request_message, controls)
+        if result["resultCode"] != RESULT_SUCCESS:
+            return result
+
+        for key in before.keys() - after.keys():
+            member_entry = dit.get(safe_dn(before[key]))
+            if member_entry is not None and "memberOf" in member_entry:
+                member_entry["memberOf"] = [v for v in member_entry["memberOf"] if _text(v).lower() != dn.lower()]
+                if not member_entry["memberOf"]:
+                    del member_entry["memberOf"]
+        for key in after.keys() - before.keys():
+            member_entry = dit.get(safe_dn(after[key]))
+            if member_entry is not None:
+                member_entry.setdefault("memberOf", []).append(to_raw(dn))
+        return result
+
+    # unicodePwd is never stored in the entry: admin resets replace it, users
+    # change it by deleting the old value and adding the new one.
+    def _modify_password(self, dn, changes):
+        old_password = None
+        new_password = None
+        for operation, values in changes:
+            password = decode_unicode_pwd(values[0]) if values else None
+            if operation == 1:
+                old_password = password
+            else:
+                new_password = password
+
+        if old_password is not None and self.directory.passwords.get(dn.lower()) != old_password:
+            return _result(RESULT_CONSTRAINT_VIOLATION, PASSWORD_POLICY)
+        error = self._password_error(dn, new_password)
+        if error:
+            return error
+
+        self.directory.passwords[dn.lower()] = new_password
+        return _result()
+
+    def mock_delete(self, request_message, controls):
+        dn = safe_dn(delete_request_to_dict(request_message)["entry"])
+        dit = self.connection.server.dit
+        if dn not in dit:
+            return _result(RESULT_NO_SUCH_OBJECT, NO_OBJECT)
+
+        tree = False
+        for oid, criticality, value in control_list(controls):
+            if oid == TREE_DELETE_OID and self.directory.tree_delete:
+                tree = True
+            elif criticality:
+                return _result(RESULT_UNAVAILABLE_CRITICAL_EXTENSION, f"Critical control {oid} not available")
+
+        suffix = "," + dn.lower()
+        below = [other for other in dit if other.lower().endswith(suffix)]
+        if below and not tree:
+            return _result(RESULT_NOT_ALLOWED_ON_NON_LEAF, NON_LEAF)
+
+        for other in sorted(below, key=len, reverse=True):
+            self.remove_entry(other)
+        self.remove_entry(dn)
+        return _result()
+
+    # Searches, with statistics when the client asks for them
+    def mock_search(self, request_message, controls):
+        if not any(oid == explain.STATS_OID for oid, _, _ in control_list(controls)):
+            return self._search(request_message, controls)
+        self.search_stats = None
+        started = time.perf_counter()
+        responses, result = self._search(request_message, controls)
+        stats = self.search_stats or {"entriesVisited": len(responses)}
+        stats["entriesReturned"] = len(responses)
+        stats["callTime"] = int((time.perf_counter() - started) * 1000)
+        self.add_response_control(result, explain.response_control(stats))
+        return responses, result
+
+    def _search(self, request_message, controls):
+        request = search_request_to_dict(request_message)
+        paged = None
+        for oid, criticality, value in control_list(controls):
+            if oid == PAGED_RESULTS_OID:
+                paged, _ = decoder.decode(value, asn1Spec=RealSearchControlValue())
+            elif oid == asq.ASQ_OID:
+                control, _ = decoder.decode(value, asn1Spec=asq.ASQRequestValue())
+                request["asq"] = str(control["sourceAttribute"])
+            elif oid == vlv.SORT_OID:
+                keys, _ = decoder.decode(value, asn1Spec=vlv.SortKeyList())
+                request["sort"] = (str(keys[0]["attributeType"]), bool(keys[0]["reverseOrder"]))
+            elif oid == vlv.VLV_OID:
+                control, _ = decoder.decode(value, asn1Spec=vlv.VLVRequestValue())
+                if control["target"].getName() != "byOffset":
+                    return [], _result(RESULT_UNWILLING_TO_PERFORM, WILL_NOT_PERFORM)
+                request["vlv"] = (int(control["beforeCount"]), int(control["afterCount"]),
+                                  int(control["target"]["byOffset"]["offset"]))
+            elif criticality and oid not in SUPPORTED_CONTROLS:
+                return [], _result(RESULT_UNAVAILABLE_CRITICAL_EXTENSION, f"Critical control {oid} not available")
+
+        if request.get("vlv") is not None:
+            if paged is not None:
+                return [], _result(RESULT_UNWILLING_TO_PERFORM, WILL_NOT_PERFORM)
+            if request.get("sort") is None:
+                return [], _result(vlv.RESULT_SORT_CONTROL_MISSING, "VLV needs the sort control")
+            responses, result = self._execute_search(request)
+            responses = self._sorted(request, responses, result)
+            self._asq_response(request, result)
+            return self._window(request, responses, result)
+
+        if paged is None:
+            responses, result = self._execute_search(request)
+            responses = self._sorted(request, responses, result)
+            self._asq_response(request, result)
+            limit = self.directory.max_page_size
+            if result["resultCode"] == RESULT_SUCCESS and limit and len(responses) > limit:
+                return responses[:limit], _result(RESULT_SIZE_LIMIT_EXCEEDED, "Size Limit Exceeded")
+            return responses, result
+
+        size = int(paged["size"])
+        if self.directory.max_page_size:
+            size = min(size, self.directory.max_page_size)
+        cookie = bytes(paged["cookie"])
+
+        if not cookie:
+            responses, result = self._execute_search(request)
+            if result["resultCode"] != RESULT_SUCCESS:
+                return [], result
+            responses = self._sorted(request, responses, result)
+            offset = 0
+        else:
+            saved = self._paged_sets_by_cookie().pop(cookie, None)
+            if saved is None:
+                return [], _result(RESULT_OPERATIONS_ERROR, "Invalid cookie in paged search")
+            responses, offset = saved
+
+        page = responses[offset:offset + size]
+        offset += size
+        if offset < len(responses):
+            next_cookie = to_raw(str(random.getrandbits(48)))
+            self._paged_sets_by_cookie()[next_cookie] = (responses, offset)
+        else:
+            next_cookie = b""
+
+        result = _result()
+        self.add_response_control(result, paged_search_control(False, len(responses), next_cookie))
+        self._asq_response(request, result)
+        if request.get("sort") is not None:
+            self.add_response_control(result, vlv.sort_response_control())
+        return page, result
+
+    # Order responses by the sort control's attribute, entries without it
+    # last in either direction
+    def _sorted(self, request, responses, result):
+        if request.get("sort") is None or result["resultCode"] != RESULT_SUCCESS:
+            return responses
+        attribute, reverse = request["sort"]
+        dit = self.connection.server.dit
+
+        def key(response):
+            entry = dit.get(response["object"], {})
+            values = next((v for name, v in entry.items() if name.lower() == attribute.lower()), None)
+            return _text(values[0]).lower() if values else None
+
+        self.add_response_control(result, vlv.sort_response_control())
+        present = [response for response in responses if key(response) is not None]
+        missing = [response for response in responses if key(response) is None]
+        return sorted(present, key=key, reverse=reverse) + missing
+
+    # The VLV window around the 1-based target offset
+    def _window(self, request, responses, result):
+        if result["resultCode"] != RESULT_SUCCESS:
+            return [], result
+        before, after, offset = request["vlv"]
+        position = min(max(offset, 1), len(responses) + 1)
+        window = responses[max(0, position - 1 - before):position + after]
+        self.add_response_control(result, vlv.vlv_response_control(position, len(responses)))
+        return window, result
+
+    def _asq_response(self, request, result):
+        if request.get("asq") is not None and result["resultCode"] == RESULT_SUCCESS:
+            self.add_response_control(result, asq.response_control(RESULT_SUCCESS))
+
+    def _paged_sets_by_cookie(self):
+        if not hasattr(self, "_paged_by_cookie"):
+            self._paged_by_cookie = {}
+        return self._paged_by_cookie
+
+    # Attach a response control in both the decoded form ldap3's mock
+    # strategies return and the raw form the TCP server encodes
+    @staticmethod
+    def add_response_control(result, control):
+        result.setdefault("controls", []).append(BaseStrategy.decode_control(control))
+        result.setdefault("response_controls", []).append(control)
+
+    # Narrow the candidates for filters AD answers from an index
+    def _indexed_candidates(self, search_filter):
+        match = re.match(r"^\(sAMAccountName=([^()*\\]+)\)$", search_filter, re.IGNORECASE)
+        if match:
+            dn = self.directory.sam_index.get(match.group(1).lower())
+            return [dn] if dn else []
+
+        match = re.match(r"^\(memberOf=([^*]+)\)$", search_filter, re.IGNORECASE)
+        if match:
+            group = self.connection.server.dit.get(safe_dn(match.group(1)))
+            if group is None:
+                return []
+            return [safe_dn(_text(v)) for v in group.get("member", []) if safe_dn(_text(v)) in self.connection.server.dit]
+        return None
+
+    def _execute_search(self, request):
+        dit = self.connection.server.dit
+        scope = request["scope"]
+        if scope == 0:
+            special = self.directory.special_entry(request["base"])
+            if special is not None:
+                return [special], _result()
+        base = safe_dn(request["base"])
+
+        # attribute;range=low-high options requested by the client
+        ranges = {}
+        requested = []
+        for attribute in request["attributes"]:
+            name, _, option = attribute.partition(";range=")
+            if option:
+                low, _, high = option.partition("-")
+                ranges[name.lower()] = (int(low), None if high == "*" else int(high))
+            requested.append(name.lower())
+        if "+" in requested:
+            requested.extend(a.lower() for a in self.operational_attributes)
+
+        index = None
+        if request.get("asq") is not None:
+            # ASQ: the entries named by the base's source attribute
+            if scope != 0:
+                return [], _result(RESULT_UNWILLING_TO_PERFORM, WILL_NOT_PERFORM)
+            if base not in dit:
+                return [], _result(RESULT_NO_SUCH_OBJECT, NO_OBJECT)
+            source = next((values for name, values in dit[base].items() if name.lower() == request["asq"].lower()), [])
+            candidates = [safe_dn(_text(v)) for v in source if safe_dn(_text(v)) in dit]
+        elif scope == 0:
+            candidates = [base] if base in dit else []
+        else:
+            if base not in dit:
+                return [], _result(RESULT_NO_SUCH_OBJECT, NO_OBJECT)
+            indexed = self._indexed_candidates(request["filter"])
+            pool = indexed if indexed is not None else dit.keys()
+            index = INDEX_NAMES[request["filter"][1:].partition("=")[0].lower()] if indexed is not None else "Ancestors_index"
+            suffix = "," + base.lower()
+            candidates = []
+            for dn in pool:
+                lowered = dn.lower()
+                if lowered == base.lower() and scope == 2:
+                    candidates.append(dn)
+                elif lowered.endswith(suffix):
+                    if scope == 2 or "," not in dn[:-len(suffix)]:
+                        candidates.append(dn)
+
+        self.search_stats = {"entriesVisited": len(candidates), "filter": request["filter"]}
+        if index:
+            self.search_stats["index"] = index
+        if not candidates:
+            if base not in dit:
+                return [], _result(RESULT_NO_SUCH_OBJECT, NO_OBJECT)
+            return [], _result()
+
+        filter_root = parse_filter(request["filter"], self.connection.server.schema, auto_escape=True,
+                                   auto_encode=False, validator=self.connection.server.custom_validator,
+                                   check_names=self.connection.check_names)
+        matched = sorted(self.evaluate_filter_node(filter_root, candidates))
+
+        responses = []
+        for dn in matched:
+            attributes = []
+            for name, values in dit[dn].items():
+                lowered = name.lower()
+                if lowered not in requested and ALL_ATTRIBUTES not in requested:
+                    continue
+                if lowered in (a.lower() for a in self.operational_attributes) and lowered not in requested:
+                    continue
+                attributes.append(self._ranged(name, values, ranges.get(lowered), request["typesOnly"]))
+            responses.append({"object": dn, "attributes": attributes})
+
+        if request["sizeLimit"] > 0 and len(responses) > request["sizeLimit"]:
+            return responses[:request["sizeLimit"]], _result(RESULT_SIZE_LIMIT_EXCEEDED, "Size Limit Exceeded")
+        return responses, _result()
+
+    # Apply MaxValRange to a multi-valued attribute, as AD does for member
+    def _ranged(self, name, values, requested_range, types_only):
+        if types_only:
+            return {"type": name, "vals": []}
+
+        limit = self.directory.max_value_range
+        if requested_range is None and (not limit or len(values) <= limit):
+            return {"type": name, "vals": values}
+
+        low, high = requested_range or (0, None)
+        if high is None or (limit and high - low + 1 > limit):
+            high = low + limit - 1 if limit else len(values) - 1
+        chunk = values[low:high + 1]
+        end = "*" if high >= len(values) - 1 else str(high)
+        return {"type": f"{name};range={low}-{end}", "vals": chunk}
+
+
+# ---- TCP listener ----
+
+# Spec the listener decodes requests with. ldap3 instantiates And and Or
+# inside Filter before it gives them their component type, so its own spec
+# cannot decode (&...) and (|...) filters. These copies look the component
+# type up when it is used instead, without touching ldap3's classes. (Not
+# still recurses endlessly in pyasn1, so (!...) filters cannot be served.)
+REQUEST_SPEC = {}
+
+class ServerAnd(And):
+
+    @property
+    def componentType(self):
+        return REQUEST_SPEC.get("filter")
+
+
+class ServerOr(Or):
+
+    @property
+    def componentType(self):
+        return REQUEST_SPEC.get("filter")
+
+
+def _replaced(named_types, name, asn1_object):
+    return NamedTypes(*[NamedType(name, asn1_object) if named.name == name else named
+                        for named in named_types.namedTypes])
+
+
+class ServerFilter(Filter):
+    componentType = _replaced(_replaced(Filter.componentType, "and", ServerAnd()), "or", ServerOr())
+
+
+class ServerSearchRequest(SearchRequest):
+    componentType = _replaced(SearchRequest.componentType, "filter", ServerFilter())
+
+
+class ServerProtocolOp(ProtocolOp):
+    componentType = _replaced(ProtocolOp.componentType, "searchRequest", ServerSearchRequest())
+
+
+class ServerLDAPMessage(LDAPMessage):
+    componentType = _replaced(LDAPMessage.componentType, "protocolOp", ServerProtocolOp())
+
+
+REQUEST_SPEC["filter"] = ServerFilter()
+
+# Response type and asn1 class for each request type
+RESPONSES = {
+    "bindRequest": ("bindResponse", BindResponse),
+    "addRequest": ("addResponse", AddResponse),
+    "modifyRequest": ("modifyResponse", ModifyResponse),
+    "delRequest": ("delResponse", DelResponse),
+    "compareRequest": ("compareResponse", CompareResponse),
+    "modDNRequest": ("modDNResponse", ModifyDNResponse),
+    "extendedReq": ("extendedResp", ExtendedResponse),
+}
+
+def encode_message(message_id, operation, component, controls=None):
+    message = LDAPMessage()
+    message["messageID"] = MessageID(message_id)
+    message["protocolOp"] = ProtocolOp().setComponentByName(operation, component)
+    if controls:
+        message["controls"] = build_controls_list(controls)
+    return encoder.encode(message)
+
+def encode_result(response_class, result):
+    response = response_class()
+    response["resultCode"] = ResultCode(result["resultCode"])
+    response["matchedDN"] = LDAPDN(result.get("matchedDN") or "")
+    response["diagnosticMessage"] = LDAPString(result.get("diagnosticMessage") or "")
+    if response_class is ExtendedResponse:
+        if result.get("responseName") is not None:
+            response["responseName"] = ResponseName(_text(result["responseName"]))
+        if result.get("responseValue") is not None:
+            response["responseValue"] = ResponseValue(bytes(result["responseValue"]))
+    if result.get("referral"):
+        referral = Referral()
+        for position, url in enumerate(result["referral"]):
+            referral.setComponentByPosition(position, URI(url))
+        response["referral"] = referral
+    return response
+
+# DN an operation targets, for referrals
+def request_target(operation, request):
+    if operation == "searchRequest":
+        return str(request["baseObject"])
+    if operation == "modifyRequest":
+        return str(request["object"])
+    if operation == "delRequest":
+        return str(request)
+    if operation in ("addRequest", "modDNRequest", "compareRequest"):
+        return str(request["entry"])
+    return None
+
+def encode_entry(entry):
+    response = SearchResultEntry()
+    response["object"] = LDAPDN(entry["object"])
+    attributes = PartialAttributeList()
+    for i, attribute in enumerate(entry["attributes"]):
+        partial = PartialAttribute()
+        partial["type"] = AttributeDescription(attribute["type"])
+        vals = Vals()
+        for j, value in enumerate(attribute["vals"]):
+            vals.setComponentByPosition(j, AttributeValue(to_raw(value)))
+        partial["vals"] = vals
+        attributes.setComponentByPosition(i, partial)
+    response["attributes"] = attributes
+    return response
+
+
+class FakeADServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    # ssl_context: LDAPS (TLS from the first byte); starttls_context: plain
+    # connections may upgrade with StartTLS
+    def __init__(self, directory, address, ssl_context=None, workers=8, starttls_context=None):
+        self.directory = directory
+        self.ssl_context = ssl_context
+        self.starttls_context = starttls_context
+        self.workers = workers
+        socketserver.ThreadingTCPServer.__init__(self, address, FakeADHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def get_request(self):
+        sock, address = socketserver.ThreadingTCPServer.get_request(self)
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True)
+        return sock, address
+
+
+# ---- Stub DNS for the DC locator ----
+
+class FakeDNS(socketserver.ThreadingUDPServer):
+    daemon_threads = True
+
+    # records: SRV name -> [{"priority", "weight", "port", "target", "ttl"}]
+    def __init__(self, address, records):
+        self.records = {name.lower(): list(values) for name, values in records.items()}
+        socketserver.ThreadingUDPServer.__init__(self, address, FakeDNSHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class FakeDNSHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        data, sock = self.request
+        query_id, flags = struct.unpack("!HH", data[:4])
+        name, end = locator.read_name(data, 12)
+        qtype = struct.unpack("!H", data[end:end + 2])[0]
+        question = data[12:end + 4]
+
+        records = self.server.records.get(name.lower(), []) if qtype == locator.TYPE_SRV else []
+        rcode = 0 if name.lower() in self.server.records else locator.RCODE_NXDOMAIN
+        answers = b""
+        for r in records:
+            rdata = struct.pack("!HHH", r["priority"], r["weight"], r["port"]) + locator.encode_name(r["target"])
+            answers += struct.pack("!HHHIH", 0xC00C, locator.TYPE_SRV, locator.CLASS_IN, r.get("ttl", 600), len(rdata)) + rdata
+        header = struct.pack("!HHHHHH", query_id, 0x8180 | (flags & locator.FLAG_RECURSION) | rcode, 1, len(records), 0, 0)
+        sock.sendto(header + question + answers, self.client_address)
+
+
+# One client connection. Requests are decoded as they arrive and answered
+# from a small worker pool, so pipelined requests overlap their latency the
+# way they do on a real DC. Binds and unbinds are handled in order.
+class FakeADHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        self.directory = self.server.directory
+        self.conn = self.directory.connect()
+        self.conn.strategy._start_listen()
+        self.conn.strategy.secure = self.server.ssl_context is not None
+        self.send_lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=self.server.workers)
+        self.fast_bind_mode = False
+
+    def finish(self):
+        self.pool.shutdown(wait=True)
+
+    def handle(self):
+        buffer = b""
+        while True:
+            try:
+                data = self.request.recv(65536)
+            except (OSError, ValueError):
+                break
+            if not data:
+                break
+            buffer += data
+            while True:
+                size = BaseStrategy.compute_ldap_message_size(buffer)
+                if size == -1 or len(buffer) < size:
+                    break
+                message, buffer = buffer[:size], buffer[size:]
+                if not self.dispatch(message):
+                    return
+
+    # Returns False when the client unbinds
+    def dispatch(self, data):
+        message, _ = decoder.decode(data, asn1Spec=ServerLDAPMessage())
+        message_id = int(message["messageID"])
+        operation = message["protocolOp"].getName()
+        request = message["protocolOp"].getComponent()
+        controls = list(message["controls"]) if message["controls"].hasValue() else None
+
+        if operation == "unbindRequest":
+            return False
+        if operation == "abandonRequest":
+            return True
+        if operation == "extendedReq" and str(request["requestName"]) == STARTTLS_OID:
+            self.start_tls(message_id)
+        elif operation == "extendedReq" and str(request["requestName"]) == FAST_BIND_OID:
+            self.fast_bind(message_id)
+        elif operation == "bindRequest":
+            self.answer(message_id, operation, request, controls)
+        else:
+            self.pool.submit(self.answer, message_id, operation, request, controls)
+        return True
+
+    # Answer StartTLS in the clear, then continue on a TLS socket
+    def start_tls(self, message_id):
+        self.directory.inject_latency("extendedReq")
+        context = self.server.starttls_context
+        if context is None or self.conn.strategy.secure:
+            result = _result(RESULT_PROTOCOL_ERROR, "StartTLS is not available")
+        else:
+            result = _result()
+            result["responseName"] = STARTTLS_OID
+        with self.send_lock:
+            self.request.sendall(encode_message(message_id, "extendedResp", encode_result(ExtendedResponse, result)))
+            if result["resultCode"] == RESULT_SUCCESS:
+                self.request = context.wrap_socket(self.request, server_side=True)
+                self.conn.strategy.secure = True
+
+    # Fast bind mode: only allowed before the connection has bound. Binds in
+    # that mode only check the password; the connection is never authorised,
+    # so every other operation is refused as on an unbound connection.
+    def fast_bind(self, message_id):
+        self.directory.inject_latency("extendedReq")
+        if self.conn.strategy.bound is not None:
+            result = _result(RESULT_UNWILLING_TO_PERFORM, WILL_NOT_PERFORM)
+        else:
+            result = _result()
+            self.fast_bind_mode = True
+        with self.send_lock:
+            self.request.sendall(encode_message(message_id, "extendedResp", encode_result(ExtendedResponse, result)))
+
+    def answer(self, message_id, operation, request, controls):
+        self.directory.inject_latency(operation)
+        strategy = self.conn.strategy
+        handlers = {
+            "bindRequest": strategy.mock_bind,
+            "searchRequest": strategy.mock_search,
+            "addRequest": strategy.mock_add,
+            "modifyRequest": strategy.mock_modify,
+            "delRequest": strategy.mock_delete,
+            "compareRequest": strategy.mock_compare,
+            "modDNRequest": strategy.mock_modify_dn,
+            "extendedReq": strategy.mock_extended,
+        }
+
+        entries = []
+        target = request_target(operation, request)
+        referral = self.directory.referral_for(target) if target is not None and self.directory.referrals else None
+        try:
+            with self.directory.lock:
+                if self.fast_bind_mode and operation != "bindRequest":
+                    result = _result(RESULT_OPERATIONS_ERROR, NOT_AUTHORIZED)
+                elif referral is not None:
+                    result = _result(RESULT_REFERRAL)
+                    result["referral"] = [referral]
+                elif operation == "searchRequest":
+                    entries, result = strategy.mock_search(request, controls)
+                elif operation in handlers:
+                    result = handlers[operation](request, controls)
+                else:
+                    result = _result(RESULT_PROTOCOL_ERROR, f"unsupported operation {operation}")
+        except Exception as e:
+            logger.exception(f"Fake AD failed to answer {operation}")
+            entries = []
+            result = _result(RESULT_OTHER, str(e))
+
+        if operation == "searchRequest":
+            output = b"".join(encode_message(message_id, "searchResEntry", encode_entry(e)) for e in entries)
+            output += encode_message(message_id, "searchResDone", encode_result(SearchResultDone, result),
+                                     result.get("response_controls"))
+        else:
+            response_type, response_class = RESPONSES.get(operation, ("extendedResp", ExtendedResponse))
+            output = encode_message(message_id, response_type, encode_result(response_class, result),
+                                    result.get("response_controls"))
+        try:
+            with self.send_lock:
+                self.request.sendall(output)
+        except (OSError, ValueError):
+            pass
+
+
+# ---- Command line ----
+
+# Server-side TLS context from a PEM file holding the certificate and key
+def server_context(cert_file):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file)
+    return context
+
+def main():
+    from adtool import cli, bench
+
+    argv = sys.argv[1:]
+    host = cli.pop_option("--host", "127.0.0.1", argv)
+    port = int(cli.pop_option("--port", 3890, argv))
+    users = int(cli.pop_option("--users", 1000, argv))
+    latency = parse_latency(cli.pop_option("--latency-ms", None, argv))
+    jitter = float(cli.pop_option("--jitter-ms", 0, argv)) / 1000.0
+    admin_password = cli.pop_option("--admin-password", DEFAULT_ADMIN_PASSWORD, argv)
+    dns_port = cli.pop_option("--dns-port", None, argv)
+    site = cli.pop_option("--site", None, argv)
+    referral = cli.pop_option("--referral", None, argv)
+    ldaps_port = cli.pop_option("--ldaps-port", None, argv)
+    cert = cli.pop_option("--cert", None, argv)
+    test_ou = cli.pop_option("--test-ou", None, argv)
+    tree_delete = not cli.pop_flag("--no-tree-delete", argv)
+
+    if argv:
+        print("Usage: python -m adtool.fakead [--host H] [--port N] [--users N] "
+              "[--latency-ms 5|search=2,modify=10] [--jitter-ms N] [--admin-password P] "
+              "[--dns-port N [--site NAME]] [--referral DN=URL] [--cert PEM [--ldaps-port N]] "
+              "[--test-ou NAME=N] [--no-tree-delete]")
+        sys.exit()
+    if ldaps_port is not None and cert is None:
+        print("--ldaps-port needs --cert")
+        sys.exit()
+
+    directory = FakeDirectory(latency=latency, jitter=jitter, tree_delete=tree_delete)
+    directory.add_user("Administrator", password=admin_password)
+    groups = max(1, users // bench.USERS_PER_GROUP)
+    memberships = bench.build_directory(directory._seeder, users, groups)
+    if test_ou is not None:
+        name, _, count = test_ou.partition("=")
+        print(f"Test OU {directory.add_test_ou(name, int(count or TEST_OU_SIZE))}")
+    directory.set_missing_passwords(DEFAULT_USER_PASSWORD)
+
+    if referral is not None:
+        base, _, url = referral.partition("=ldap")
+        directory.add_referral(base, "ldap" + url)
+
+    context = server_context(cert) if cert is not None else None
+    server = FakeADServer(directory, (host, port), starttls_context=context)
+    print(f"Fake AD for {directory.domain} listening on {host}:{server.port} "
+          f"({users} users, {groups} groups, {memberships} memberships)"
+          + (", StartTLS enabled" if context is not None else ""))
+    if ldaps_port is not None:
+        ldaps = FakeADServer(directory, (host, int(ldaps_port)), ssl_context=context)
+        threading.Thread(target=ldaps.serve_forever, name="fakead-ldaps", daemon=True).start()
+        print(f"LDAPS on {host}:{ldaps.port}")
+    print(f'Bind as "{directory.netbios}\\Administrator" with password "{admin_password}"')
+
+    if dns_port is not None:
+        record = {"priority": 0, "weight": 100, "port": server.port, "target": host}
+        records = {locator.srv_name(directory.domain): [record]}
+        if site:
+            directory.add_site(site, [f"{host}/32"])
+            records[locator.srv_name(directory.domain, site)] = [record]
+        dns = FakeDNS((host, int(dns_port)), records)
+        threading.Thread(target=dns.serve_forever, name="fakedns", daemon=True).start()
+        print(f"DC locator SRV records on udp {host}:{dns.port}" + (f" (site {site})" if site else ""))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
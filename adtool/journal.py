@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+from datetime import datetime
+
+from adtool import cli
+
+# ---- Job journal for resumable bulk runs ----
+#
+# Every batch run is a job with an append-only journal in
+# ~/adtool_logs/jobs/<JOB_ID>.journal. The first line describes the job; each
+# following line records one finished input line:
+#
+#   {"job": "20261019-0712-3f2a9c", "source": "users.txt", "started": "..."}
+#   {"line": 1, "hash": "9c1185a5c5e9fc54", "ok": true}
+#
+# Writes are flushed to disk (fsync) every SYNC_EVERY records or SYNC_INTERVAL
+# seconds, and on close, so a crash loses at most the last few records.
+# --resume JOB_ID loads the journal into a set of (line, hash) and skips
+# every line that already succeeded without contacting the DC; failed lines
+# are run again. The last record of a line counts, so a line recorded as
+# done can later be recorded as failed (batch --lazy-commit does this when
+# its writes do not read back). The hash of the line text means an edited input file does
+# not skip lines that changed.
+
+JOB_DIR = cli.LOG_DIR / "jobs"
+SYNC_EVERY = 100
+SYNC_INTERVAL = 1.0
+
+
+
+def new_job_id():
+    return datetime.now().strftime("%Y%m%d-%H%M") + "-" + uuid.uuid4().hex[:6]
+
+def journal_path(job_id):
+    return JOB_DIR / f"{job_id}.journal"
+
+def line_hash(text):
+    return hashlib.sha1(text.strip().encode("utf-8")).hexdigest()[:16]
+
+# Header and the set of (line, hash) that completed successfully
+def load(job_id):
+    path = journal_path(job_id)
+    header = None
+    done = set()
+    with open(path) as f:
+        for text in f:
+            try:
+                record = json.loads(text)
+            except ValueError:
+                # a torn last line from a crash
+                continue
+            if header is None:
+                header = record
+            elif record.get("ok"):
+                done.add((record["line"], record["hash"]))
+            else:
+                done.discard((record["line"], record["hash"]))
+    return header, done
+
+
+class Journal(object):
+
+    def __init__(self, job_id, source=None):
+        JOB_DIR.mkdir(parents=True, exist_ok=True)
+        self.job_id = job_id
+        self.path = journal_path(job_id)
+        exists = self.path.exists()
+        self.file = open(self.path, "a")
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+        if not exists:
+            self.write({"job": job_id, "source": source, "started": datetime.now().isoformat(timespec="seconds")})
+            self.sync()
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def record(self, number, digest, ok):
+        self.write({"line": number, "hash": digest, "ok": ok})
+        self.unsynced += 1
+        if self.unsynced >= SYNC_EVERY or time.monotonic() - self.synced_at >= SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.sync()
+        self.file.close()
@@ -0,0 +1,333 @@
+import io
+import sys
+import json
+import time
+import queue
+import random
+import socket
+import threading
+import socketserver
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from ldap3 import Server, Connection, ALL
+
+from adtool import cli, bench, fakead
+
+# ---- Latency-injecting LDAP proxy (dev tool) ----
+#
+# Forwards TCP between adtool and any LDAP endpoint, delaying each chunk by
+# half the configured round trip (plus jitter) in each direction and pacing
+# it to an optional bandwidth cap. Point dc_ip in credentials.json at the
+# proxy to see how a command behaves over a WAN link.
+#
+#   python -m adtool.latencyproxy --target dc01.lab.local:389 --port 3891 --rtt-ms 80 --jitter-ms 10
+#   python -m adtool.latencyproxy --sweep --rtts 0,10,25,50,100,200 --out sweep.json --plot sweep.png
+#
+# --sweep starts an in-process fake DC (or uses --target, which must be a
+# "python -m adtool.fakead" with the same --users) and measures operations
+# per second for every command at each RTT, both in bulk mode (many calls
+# on one connection) and per invocation (connect, bind, command, unbind).
+
+DEFAULT_PORT = 3891
+DEFAULT_RTTS = "0,10,25,50,100,200"
+DEFAULT_SWEEP_ITERATIONS = 20
+DEFAULT_SWEEP_USERS = 2000
+CHUNK_SIZE = 65536
+
+
+
+def parse_address(text, default_port=389):
+    host, _, port = text.rpartition(":")
+    if not host:
+        return text, default_port
+    return host, int(port)
+
+
+# One direction of a proxied connection. A reader thread stamps each chunk
+# with the time it may be delivered; a writer thread sends chunks in order
+# once that time has passed. Chunks never overtake each other.
+class Link(object):
+
+    def __init__(self, proxy, source, sink):
+        self.proxy = proxy
+        self.source = source
+        self.sink = sink
+        self.chunks = queue.Queue()
+        self.line_free = 0.0
+        self.last_delivery = 0.0
+
+    def start(self):
+        threads = [
+            threading.Thread(target=self.read, daemon=True),
+            threading.Thread(target=self.write, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def deliver_at(self, size):
+        now = time.perf_counter()
+        delay = self.proxy.rtt / 2.0
+        if self.proxy.jitter:
+            delay += self.proxy.rng.uniform(0, self.proxy.jitter / 2.0)
+
+        sent = now
+        if self.proxy.bandwidth:
+            # the chunk leaves once the line is free and takes size/bandwidth to send
+            self.line_free = max(self.line_free, now) + size / self.proxy.bandwidth
+            sent = self.line_free
+
+        self.last_delivery = max(self.last_delivery, sent + delay)
+        return self.last_delivery
+
+    def read(self):
+        try:
+            while True:
+                data = self.source.recv(CHUNK_SIZE)
+                if not data:
+                    break
+                self.chunks.put((self.deliver_at(len(data)), data))
+        except OSError:
+            pass
+        self.chunks.put((None, None))
+
+    def write(self):
+        while True:
+            when, data = self.chunks.get()
+            if data is None:
+                break
+            wait = when - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.sink.sendall(data)
+            except OSError:
+                break
+        try:
+            self.sink.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class ProxyHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            upstream = socket.create_connection(self.server.target)
+        except OSError as e:
+            cli.logger.warning(f"Proxy could not reach {self.server.target}: {e}")
+            return
+        upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        threads = Link(self.server, self.request, upstream).start()
+        threads += Link(self.server, upstream, self.request).start()
+        for thread in threads:
+            thread.join()
+        upstream.close()
+
+
+# Settings are read for every chunk, so rtt/jitter/bandwidth can be changed
+# while the proxy runs.
+class LatencyProxy(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, target, address=("127.0.0.1", 0), rtt=0.0, jitter=0.0, bandwidth=None, seed=None):
+        self.target = target
+        self.rtt = rtt                # seconds
+        self.jitter = jitter          # seconds, added on top of the round trip
+        self.bandwidth = bandwidth    # bytes per second in each direction, None = unlimited
+        self.rng = random.Random(seed)
+        socketserver.ThreadingTCPServer.__init__(self, address, ProxyHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="latencyproxy", daemon=True)
+        thread.start()
+        return self
+
+
+# ---- RTT sweep ----
+
+# Bound connection through the proxy, configured like cli.connect()
+def proxy_connect(proxy, user, password):
+    server = Server(f"127.0.0.1:{proxy.port}", get_info=ALL)
+    conn = Connection(server, user=user, password=password, collect_usage=True)
+    if not conn.bind():
+        raise RuntimeError(f"Bind through proxy failed: {conn.result}")
+    return conn
+
+# Arguments for a command that are unique to one RTT and mode, so every
+# call takes the same code path (no "already exists" shortcuts)
+def sweep_arguments(command, users, groups, iterations, rng, label, bulk):
+    if command == "create-user":
+        return [[f"Sweep{label}{i:05d}.Bench"] for i in range(iterations)]
+    if command == "create-group":
+        return [[f"SweepGroup{label}{i:05d}"] for i in range(iterations)]
+    arg_lists = bench.command_arguments(command, users, groups, iterations * 2, rng)
+    if command in ("add-user-to-group", "delete-user-from-group"):
+        return arg_lists[:iterations] if bulk else arg_lists[iterations:]
+    return arg_lists[:iterations]
+
+def run_calls(func, conn, arg_lists):
+    with redirect_stdout(io.StringIO()):
+        for args in arg_lists:
+            func(conn, *args)
+
+def sweep(proxy, rtts, iterations, users, user, password, seed=0):
+    groups = max(1, users // bench.USERS_PER_GROUP)
+    rng = random.Random(seed)
+    results = []
+
+    for rtt in rtts:
+        proxy.rtt = rtt / 1000.0
+        row = {"rtt_ms": rtt, "bulk": {}, "invocation": {}}
+
+        for command, (func, arg_names) in cli.COMMANDS.items():
+            stdin, sys.stdin = sys.stdin, io.StringIO((bench.BENCH_PASSWORD + "\n") * iterations * 2)
+            try:
+                label = f"{rtt:03d}b"
+                arg_lists = sweep_arguments(command, users, groups, iterations, rng, label, True)
+                conn = proxy_connect(proxy, user, password)
+                started = time.perf_counter()
+                run_calls(func, conn, arg_lists)
+                row["bulk"][command] = len(arg_lists) / (time.perf_counter() - started)
+                conn.unbind()
+
+                label = f"{rtt:03d}i"
+                arg_lists = sweep_arguments(command, users, groups, iterations, rng, label, False)
+                started = time.perf_counter()
+                for args in arg_lists:
+                    conn = proxy_connect(proxy, user, password)
+                    run_calls(func, conn, [args])
+                    conn.unbind()
+                row["invocation"][command] = len(arg_lists) / (time.perf_counter() - started)
+            finally:
+                sys.stdin = stdin
+
+        print(f"RTT {rtt:>3} ms: " + "  ".join(
+            f"{command} {row['bulk'][command]:.1f}/{row['invocation'][command]:.1f}"
+            for command in cli.COMMANDS
+        ))
+        results.append(row)
+    return results
+
+# Text chart of bulk ops/s per command against RTT
+def print_table(results):
+    commands = list(cli.COMMANDS)
+    print()
+    print("ops/s (bulk / per invocation)")
+    print(f"{'command':<24}" + "".join(f"{str(r['rtt_ms']) + ' ms':>16}" for r in results))
+    for command in commands:
+        print(f"{command:<24}" + "".join(
+            f"{r['bulk'][command]:>8.1f}/{r['invocation'][command]:<7.1f}" for r in results
+        ))
+
+def plot(results, path):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed; skipping plot (pip install adtool[plot])")
+        return
+
+    rtts = [r["rtt_ms"] for r in results]
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5), sharey=True)
+    for ax, mode in zip(axes, ("bulk", "invocation")):
+        for command in cli.COMMANDS:
+            ax.plot(rtts, [r[mode][command] for r in results], marker="o", label=command)
+        ax.set_title(f"{mode} mode")
+        ax.set_xlabel("round trip (ms)")
+        ax.set_yscale("log")
+        ax.grid(True, which="both", alpha=0.3)
+    axes[0].set_ylabel("operations per second")
+    axes[1].legend(fontsize="small")
+    fig.tight_layout()
+    fig.savefig(path)
+    print(f"Plot written to {path}")
+
+
+def main():
+    argv = sys.argv[1:]
+    do_sweep = cli.pop_flag("--sweep", argv)
+    target = cli.pop_option("--target", None, argv)
+    host = cli.pop_option("--host", "127.0.0.1", argv)
+    port = int(cli.pop_option("--port", DEFAULT_PORT if not do_sweep else 0, argv))
+    rtt = float(cli.pop_option("--rtt-ms", 0, argv)) / 1000.0
+    jitter = float(cli.pop_option("--jitter-ms", 0, argv)) / 1000.0
+    bandwidth = cli.pop_option("--bandwidth-kbps", None, argv)
+    rtts = cli.pop_option("--rtts", DEFAULT_RTTS, argv)
+    iterations = int(cli.pop_option("--iterations", DEFAULT_SWEEP_ITERATIONS, argv))
+    users = int(cli.pop_option("--users", DEFAULT_SWEEP_USERS, argv))
+    out = cli.pop_option("--out", None, argv)
+    plot_file = cli.pop_option("--plot", None, argv)
+
+    if argv or (not do_sweep and not target):
+        print("Usage: python -m adtool.latencyproxy --target HOST:PORT [--host H] [--port N]")
+        print("                                     [--rtt-ms N] [--jitter-ms N] [--bandwidth-kbps N]")
+        print("       python -m adtool.latencyproxy --sweep [--target HOST:PORT] [--rtts 0,10,25,50,100,200]")
+        print("                                     [--iterations N] [--users N] [--out FILE] [--plot FILE.png]")
+        sys.exit()
+
+    bandwidth = float(bandwidth) * 1000 / 8 if bandwidth else None
+
+    fake_server = None
+    if do_sweep and not target:
+        directory = fakead.FakeDirectory()
+        directory.add_user("Administrator", password=fakead.DEFAULT_ADMIN_PASSWORD)
+        groups = max(1, users // bench.USERS_PER_GROUP)
+        bench.build_directory(directory._seeder, users, groups)
+        directory.set_missing_passwords(fakead.DEFAULT_USER_PASSWORD)
+        fake_server = directory.listen()
+        target = f"127.0.0.1:{fake_server.port}"
+
+    proxy = LatencyProxy(parse_address(target), (host, port), rtt, jitter, bandwidth)
+
+    if not do_sweep:
+        print(f"Proxying {host}:{proxy.port} -> {target} with {rtt * 1000:.0f} ms RTT, "
+              f"{jitter * 1000:.0f} ms jitter, "
+              f"{'unlimited' if not bandwidth else f'{bandwidth * 8 / 1000:.0f} kbit/s'} bandwidth")
+        try:
+            proxy.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            proxy.server_close()
+        return
+
+    proxy.start()
+    results = sweep(
+        proxy,
+        [int(r) for r in rtts.split(",")],
+        iterations,
+        users,
+        f"{fakead.DEFAULT_NETBIOS}\\Administrator",
+        fakead.DEFAULT_ADMIN_PASSWORD,
+    )
+    proxy.shutdown()
+    if fake_server:
+        fake_server.shutdown()
+
+    print_table(results)
+    if out:
+        with open(out, "w") as f:
+            json.dump({
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "iterations": iterations,
+                "users": users,
+                "jitter_ms": jitter * 1000,
+                "bandwidth_kbps": bandwidth * 8 / 1000 if bandwidth else None,
+                "results": results,
+            }, f, indent=2)
+        print(f"Results written to {out}")
+    if plot_file:
+        plot(results, plot_file)
+
+if __name__ == "__main__":
+    main()
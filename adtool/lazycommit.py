@@ -0,0 +1,120 @@
+import logging
+
+from ldap3 import BASE, MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap3.protocol.controls import build_control
+from ldap3.utils.conv import escape_filter_chars
+
+logger = logging.getLogger(__name__)
+
+# ---- Lazy commit for bulk writes ----
+#
+#   adtool batch import.txt --lazy-commit
+#
+# Adds and modifies carry the AD LDAP_SERVER_LAZY_COMMIT control, so the DC
+# answers once a change is applied in memory instead of after flushing it
+# to its database log; large imports then run at memory speed rather than
+# disk speed. The control is not critical: DCs that do not know it commit
+# as usual.
+#
+# Because a lazy commit can in principle be lost (e.g. the DC crashes before
+# it flushes), every object written is read back once the run is over,
+# with a base search per object whose filter asserts the values it should
+# now have (members added, attributes replaced, the object itself), and a
+# second one for the values it should no longer have (members removed).
+# Write-only attributes (unicodePwd) are not checked.
+
+LAZY_COMMIT_OID = "1.2.840.113556.1.4.619"
+
+UNVERIFIABLE_ATTRIBUTES = {"unicodepwd", "userpassword"}
+
+
+
+def control():
+    return build_control(LAZY_COMMIT_OID, False, None)
+
+def with_control(controls):
+    return list(controls or []) + [control()]
+
+# Send adds and modifies with lazy commit and remember what they wrote
+def attach(conn):
+    conn.lazy_writes = {}   # DN -> {(attribute, value or None): should be present}
+    conn.lazy_log = []      # DNs in the order they were written
+    add = conn.add
+    modify = conn.modify
+
+    def lazy_add(dn, object_class=None, attributes=None, controls=None):
+        value = add(dn, object_class, attributes, controls=with_control(controls))
+        if conn.result and conn.result.get("result") == 0:
+            conn.lazy_writes.setdefault(dn, {})
+            conn.lazy_log.append(dn)
+        return value
+
+    def lazy_modify(dn, changes, controls=None):
+        value = modify(dn, changes, controls=with_control(controls))
+        if conn.result and conn.result.get("result") == 0:
+            expect(conn.lazy_writes.setdefault(dn, {}), changes)
+            conn.lazy_log.append(dn)
+        return value
+
+    conn.add = lazy_add
+    conn.modify = lazy_modify
+
+def values_of(values):
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    return [v.decode() if isinstance(v, bytes) else str(v) for v in values]
+
+# Record the state a modify leaves behind; later changes override earlier ones
+def expect(expected, changes):
+    for attribute, operations in changes.items():
+        if attribute.lower() in UNVERIFIABLE_ATTRIBUTES:
+            continue
+        if isinstance(operations, tuple):
+            operations = [operations]
+        for operation, values in operations:
+            values = [v.lower() for v in values_of(values)]
+            key = attribute.lower()
+            if operation == MODIFY_REPLACE or (operation == MODIFY_DELETE and not values):
+                for name, value in list(expected):
+                    if name == key:
+                        del expected[(name, value)]
+            if operation in (MODIFY_REPLACE, MODIFY_ADD):
+                expected.update(((key, v), True) for v in values)
+            elif operation == MODIFY_DELETE:
+                expected.update(((key, v), False) for v in values)
+                if not values:
+                    expected[(key, None)] = False
+
+def assertion(attribute, value):
+    return f"({attribute}={'*' if value is None else escape_filter_chars(value)})"
+
+# (filter the object must match, filter it must not match or None)
+def verify_filters(expected):
+    present = "".join(assertion(a, v) for (a, v), wanted in expected.items() if wanted)
+    absent = "".join(assertion(a, v) for (a, v), wanted in expected.items() if not wanted)
+    return f"(&(objectClass=*){present})", f"(|{absent})" if absent else None
+
+def matches(conn, dn, search_filter):
+    conn.search(dn, search_filter, BASE, attributes=["1.1"])
+    if conn.result["result"] != 0:
+        raise LookupError(conn.result.get("description"))
+    return any(e.get("type") == "searchResEntry" for e in conn.response or [])
+
+# Read back every object written; returns [(DN, problem)] for those that
+# do not match what was written
+def verify(conn):
+    problems = []
+    writes = getattr(conn, "lazy_writes", {})
+    for dn, expected in writes.items():
+        present, absent = verify_filters(expected)
+        try:
+            if not matches(conn, dn, present):
+                problems.append((dn, "is missing values that were written"))
+            elif absent is not None and matches(conn, dn, absent):
+                problems.append((dn, "still has values that were removed"))
+        except LookupError as e:
+            problems.append((dn, str(e)))
+    for dn, problem in problems:
+        logger.error(f"Lazy commit verification: {dn} {problem}")
+    logger.info(f"Lazy commit verification: {len(writes)} objects read back, {len(problems)} mismatches")
+    return problems
@@ -0,0 +1,266 @@
+import json
+import time
+import random
+import socket
+import struct
+import logging
+import ipaddress
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# ---- DC locator ----
+#
+# Instead of dc_ip, credentials.json can name the domain and let adtool find
+# its DCs the way Windows clients do:
+#
+#   {"domain": "lab.local", "username": "...", "password": "..."}
+#   {"domain": "lab.local", "site": "Branch1", ...}          # fixed site
+#   {"domain": "lab.local", "dns_server": "127.0.0.1:5353"}  # other resolver
+#
+# DCs come from the SRV records
+#
+#   _ldap._tcp.<site>._sites.dc._msdcs.<domain>   DCs covering the site
+#   _ldap._tcp.dc._msdcs.<domain>                 every DC in the domain
+#
+# in-site DCs first, ordered by SRV priority and weight. The client's site
+# is taken from "site" or, after the first bind, looked up by matching the
+# client's address against the subnet objects in the configuration
+# partition (CN=Subnets,CN=Sites,CN=Configuration,...), the same mapping the
+# DC locator uses. Records are cached in ~/adtool_logs/dc_locator.json for
+# their DNS TTL and the site for SITE_TTL, so most invocations neither query
+# DNS nor cross the WAN.
+#
+# Queries use a small stdlib DNS client (UDP, falling back to TCP when the
+# answer is truncated) against the first nameserver in /etc/resolv.conf, or
+# "dns_server"; fakead --dns-port serves matching records for testing.
+
+CACHE_FILE = Path.home() / "adtool_logs" / "dc_locator.json"
+SITE_TTL = 86400
+MIN_TTL = 60
+DNS_TIMEOUT = 2
+RESOLV_CONF = "/etc/resolv.conf"
+
+TYPE_SRV = 33
+CLASS_IN = 1
+RCODE_NXDOMAIN = 3
+FLAG_TRUNCATED = 0x0200
+FLAG_RECURSION = 0x0100
+
+
+
+class LocatorError(Exception):
+    pass
+
+
+def srv_name(domain, site=None):
+    if site:
+        return f"_ldap._tcp.{site}._sites.dc._msdcs.{domain}"
+    return f"_ldap._tcp.dc._msdcs.{domain}"
+
+# ---- DNS wire format ----
+
+def encode_name(name):
+    data = b""
+    for label in name.rstrip(".").split("."):
+        data += bytes([len(label)]) + label.encode("ascii")
+    return data + b"\x00"
+
+def encode_query(query_id, name, qtype=TYPE_SRV):
+    header = struct.pack("!HHHHHH", query_id, FLAG_RECURSION, 1, 0, 0, 0)
+    return header + encode_name(name) + struct.pack("!HH", qtype, CLASS_IN)
+
+# (name, offset after it), following compression pointers
+def read_name(data, offset):
+    labels = []
+    end = None
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack("!H", data[offset:offset + 2])[0] & 0x3FFF
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode("ascii"))
+        offset += length
+    return ".".join(labels), end if end is not None else offset
+
+# (flags, SRV records) from a response
+def parse_response(data, query_id):
+    ident, flags, questions, answers, _, _ = struct.unpack("!HHHHHH", data[:12])
+    if ident != query_id:
+        raise LocatorError("DNS answer for another query")
+    offset = 12
+    for _ in range(questions):
+        _, offset = read_name(data, offset)
+        offset += 4
+
+    records = []
+    for _ in range(answers):
+        _, offset = read_name(data, offset)
+        rtype, _, ttl, length = struct.unpack("!HHIH", data[offset:offset + 10])
+        offset += 10
+        if rtype == TYPE_SRV:
+            priority, weight, port = struct.unpack("!HHH", data[offset:offset + 6])
+            target, _ = read_name(data, offset + 6)
+            records.append({"priority": priority, "weight": weight, "port": port, "target": target, "ttl": ttl})
+        offset += length
+    return flags, records
+
+def system_nameserver():
+    try:
+        with open(RESOLV_CONF) as f:
+            for line in f:
+                words = line.split()
+                if len(words) >= 2 and words[0] == "nameserver":
+                    return words[1]
+    except OSError:
+        pass
+    raise LocatorError(f"No nameserver in {RESOLV_CONF}; set dns_server in credentials.json")
+
+# "10.0.0.1" or "127.0.0.1:5353" -> (host, port)
+def parse_nameserver(text):
+    if text.count(":") == 1:
+        host, port = text.split(":")
+        return host, int(port)
+    return text, 53
+
+# SRV records for name; an empty list if the name does not exist
+def query_srv(name, nameserver=None, timeout=DNS_TIMEOUT):
+    address = parse_nameserver(nameserver or system_nameserver())
+    query_id = random.randrange(0x10000)
+    query = encode_query(query_id, name)
+
+    family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(query, address)
+        data, _ = sock.recvfrom(65535)
+    flags, records = parse_response(data, query_id)
+
+    if flags & FLAG_TRUNCATED:
+        with socket.create_connection(address, timeout=timeout) as sock:
+            sock.sendall(struct.pack("!H", len(query)) + query)
+            length = struct.unpack("!H", recv_exactly(sock, 2))[0]
+            flags, records = parse_response(recv_exactly(sock, length), query_id)
+
+    rcode = flags & 0x000F
+    if rcode == RCODE_NXDOMAIN:
+        return []
+    if rcode != 0:
+        raise LocatorError(f"DNS query for {name} failed with rcode {rcode}")
+    return records
+
+def recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise LocatorError("DNS server closed the connection")
+        data += chunk
+    return data
+
+# ---- Cache ----
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"records": {}, "sites": {}}
+
+def save_cache(cache):
+    CACHE_FILE.parent.mkdir(exist_ok=True)
+    with open(CACHE_FILE, "w") as f:
+        json.dump(cache, f, indent=2)
+
+# SRV records for name, from the cache while their TTL lasts.
+# Returns (records, True if DNS was queried).
+def cached_srv(cache, name, nameserver=None):
+    entry = cache["records"].get(name.lower())
+    if entry is not None and entry["expires"] > time.time():
+        return entry["records"], False
+
+    records = query_srv(name, nameserver)
+    ttl = max(MIN_TTL, min((r["ttl"] for r in records), default=MIN_TTL))
+    cache["records"][name.lower()] = {"records": records, "expires": time.time() + ttl}
+    logger.info(f"DNS {name}: {len(records)} DCs, cached for {ttl}s")
+    return records, True
+
+# Lowest priority first, higher weight first within a priority
+def order_records(records):
+    ordered = sorted(records, key=lambda r: (r["priority"], -r["weight"], r["target"]))
+    return [f"ldap://{r['target']}:{r['port']}" for r in ordered]
+
+# ---- Site ----
+
+def cached_site(creds, cache):
+    if creds.get("site"):
+        return creds["site"]
+    entry = cache["sites"].get(creds["domain"].lower())
+    if entry is not None and entry["expires"] > time.time():
+        return entry["name"]
+    return None
+
+# Site of a client address from subnet objects: [(cidr, siteObject DN)]
+def site_for_address(address, subnets):
+    ip = ipaddress.ip_address(address)
+    best = None
+    for cidr, site_dn in subnets:
+        try:
+            network = ipaddress.ip_network(cidr, strict=False)
+        except ValueError:
+            continue
+        if ip.version == network.version and ip in network:
+            if best is None or network.prefixlen > best[0].prefixlen:
+                best = (network, site_dn)
+    if best is None:
+        return None
+    # CN=Branch1,CN=Sites,CN=Configuration,... -> Branch1
+    return best[1].split(",", 1)[0].split("=", 1)[1]
+
+# After binding: look up and cache the client's site if it is not known yet
+def learn_site(conn, creds):
+    if "domain" not in creds or creds.get("site"):
+        return
+    cache = load_cache()
+    key = creds["domain"].lower()
+    entry = cache["sites"].get(key)
+    if entry is not None and entry["expires"] > time.time():
+        return
+
+    config_nc = conn.server.info.other.get("configurationNamingContext", [None])[0] if conn.server.info else None
+    if config_nc is None or conn.socket is None:
+        return
+    conn.search(f"CN=Subnets,CN=Sites,{config_nc}", "(objectClass=subnet)", attributes=["cn", "siteObject"])
+    subnets = [(e["attributes"]["cn"], e["attributes"]["siteObject"]) for e in conn.response or []
+               if e.get("type") == "searchResEntry" and e["attributes"].get("siteObject")]
+    address = conn.socket.getsockname()[0]
+    site = site_for_address(address, subnets)
+
+    logger.info(f"Client {address} is in site {site or '(none)'}")
+    cache["sites"][key] = {"name": site, "expires": time.time() + SITE_TTL}
+    save_cache(cache)
+
+# DCs for the domain as (in-site, others), each in SRV order
+def locate(creds):
+    cache = load_cache()
+    domain = creds["domain"]
+    nameserver = creds.get("dns_server")
+    site = cached_site(creds, cache)
+
+    local, queried_site = [], False
+    if site:
+        records, queried_site = cached_srv(cache, srv_name(domain, site), nameserver)
+        local = order_records(records)
+    records, queried = cached_srv(cache, srv_name(domain), nameserver)
+    others = [dc for dc in order_records(records) if dc not in local]
+    if queried or queried_site:
+        save_cache(cache)
+
+    if not local and not others:
+        raise LocatorError(f"No DCs found for {domain} in DNS")
+    return local, others
@@ -0,0 +1,170 @@
+import io
+import sys
+import time
+import pstats
+import cProfile
+import tracemalloc
+
+# ---- Profiling hooks for --profile cpu|mem ----
+#
+# cpu: runs the command under cProfile, writes a pstats dump and prints the
+#      top functions by cumulative time.
+# mem: traces allocations with tracemalloc and takes a snapshot whenever the
+#      command moves to another phase:
+#        connect  opening and binding the connection
+#        resolve  searches (looking up users and groups)
+#        write    add / modify / delete / extended operations
+#        output   printing results
+#      Phases are detected from the LDAP operations sent and from writes to
+#      stdout, so commands need no changes. cli.main() marks the end of the
+#      connect phase once the connection is bound.
+#
+# Both reports are tagged with the subcommand they were taken for.
+
+PROFILE_MODES = ["cpu", "mem"]
+DEFAULT_TOP = 25
+TRACE_FRAMES = 1
+
+WRITE_OPERATIONS = {"addRequest", "modifyRequest", "delRequest", "modDNRequest", "extendedReq"}
+
+
+
+def default_dump_file(command):
+    return f"adtool-{command}.pstats"
+
+
+class CpuProfile(object):
+
+    def __init__(self, command, out=None, top=DEFAULT_TOP):
+        self.command = command
+        self.out = out or default_dump_file(command)
+        self.top = top
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def attach(self, conn):
+        return conn
+
+    def enter(self, phase):
+        pass
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self):
+        self.profile.dump_stats(self.out)
+        text = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=text)
+        stats.sort_stats("cumulative").print_stats(self.top)
+        print(f"CPU profile for {self.command} written to {self.out}")
+        print(text.getvalue())
+
+
+class PhaseStdout(object):
+
+    # Marks the output phase whenever the command prints
+    def __init__(self, stream, profile):
+        self.stream = stream
+        self.profile = profile
+
+    def write(self, text):
+        self.profile.enter("output")
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class MemoryProfile(object):
+
+    def __init__(self, command, top=5):
+        self.command = command
+        self.top = top
+        self.phase = None
+        self.started = None
+        self.snapshot = None
+        self.segments = []
+        self.stdout = None
+
+    def start(self):
+        tracemalloc.start(TRACE_FRAMES)
+        self.stdout = sys.stdout
+        sys.stdout = PhaseStdout(sys.stdout, self)
+        self.enter("connect")
+
+    # Route the connection's operations through phase tracking
+    def attach(self, conn):
+        send = conn.send
+
+        def phase_send(message_type, request, controls=None):
+            if message_type == "searchRequest" and self.phase != "connect":
+                self.enter("resolve")
+            elif message_type in WRITE_OPERATIONS:
+                self.enter("write")
+            return send(message_type, request, controls)
+
+        conn.send = phase_send
+        return conn
+
+    # Close the current phase with a snapshot and start the next one
+    def enter(self, phase):
+        if phase == self.phase:
+            return
+        self._close_phase()
+        self.phase = phase
+        self.started = time.perf_counter()
+        tracemalloc.reset_peak()
+
+    def _close_phase(self):
+        if self.phase is None:
+            self.snapshot = self._take_snapshot()
+            return
+        elapsed = time.perf_counter() - self.started
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = self._take_snapshot()
+        self.segments.append({
+            "phase": self.phase,
+            "elapsed": elapsed,
+            "current": current,
+            "peak": peak,
+            "top": snapshot.compare_to(self.snapshot, "lineno")[:self.top],
+        })
+        self.snapshot = snapshot
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+
+    def stop(self):
+        if self.stdout is None:
+            return
+        sys.stdout, self.stdout = self.stdout, None
+        self._close_phase()
+        self.phase = None
+        tracemalloc.stop()
+
+    def report(self):
+        print(f"Memory profile for {self.command}:")
+        for segment in self.segments:
+            print(
+                f"  {segment['phase']:<8} {segment['elapsed'] * 1000:8.1f} ms  "
+                f"{segment['current'] // 1024:>7} KiB traced  {segment['peak'] // 1024:>7} KiB peak"
+            )
+            for stat in segment["top"]:
+                if stat.size_diff <= 0:
+                    continue
+                frame = stat.traceback[0]
+                print(f"      +{stat.size_diff // 1024:>6} KiB  {stat.count_diff:>+7} blocks  {frame.filename}:{frame.lineno}")
+
+
+def create(mode, command, out=None, top=None):
+    if mode == "cpu":
+        return CpuProfile(command, out, top or DEFAULT_TOP)
+    if mode == "mem":
+        return MemoryProfile(command, top or 5)
+    raise ValueError(f"Unknown profile mode {mode}, use one of: {', '.join(PROFILE_MODES)}")
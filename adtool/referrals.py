@@ -0,0 +1,59 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ---- Referral policy ----
+#
+# ldap3 follows referrals by itself: a request answered with a referral
+# (result 10, e.g. for another domain's naming context) opens, binds and
+# unbinds a new connection to the referred DC, which can refer again. None
+# of that is visible to adtool except as latency. The policy makes it
+# explicit:
+#
+#   never       return the referral to the command (it reports the failure)
+#   follow      follow referrals on a throwaway connection each (ldap3's default)
+#   follow:N    follow at most N hops, then return the referral
+#   pooled      follow on connections kept open per referral target and reused
+#   pooled:N    pooled, at most N hops
+#
+# Set it with "referrals" in credentials.json or --referrals on the command
+# line. Referrals received, followed and the connections opened for them
+# are counted in the command's --usage line and logged.
+
+MODES = ["never", "follow", "pooled"]
+DEFAULT_POLICY = "follow"
+
+
+
+# "pooled:2" -> ("pooled", 2); hops is None for no limit
+def parse_policy(text):
+    mode, _, hops = text.partition(":")
+    if mode not in MODES or (hops and (not hops.isdigit() or mode == "never")):
+        raise ValueError(f"Unknown referral policy {text!r}. Use never, follow[:N] or pooled[:N]")
+    return mode, int(hops) if hops else None
+
+def apply(conn, policy):
+    conn.referral_policy = policy or DEFAULT_POLICY
+    mode, hops = parse_policy(conn.referral_policy)
+    configure(conn, mode, hops)
+
+def configure(conn, mode, hops):
+    if mode == "never" or hops == 0:
+        conn.auto_referrals = False
+        return
+    conn.auto_referrals = True
+    conn.use_referral_cache = mode == "pooled"
+
+    create = conn.strategy.create_referral_connection
+
+    # Give each new referral connection the remaining hops
+    def create_limited(referrals):
+        selected, referral_conn, key = create(referrals)
+        if referral_conn is not None and not getattr(referral_conn, "referral_policy_set", False):
+            referral_conn.referral_policy_set = True
+            configure(referral_conn, mode, None if hops is None else hops - 1)
+            logger.info(f"Following referral to {selected['host']}:{key[1]} ({mode}, "
+                        f"{'unlimited' if hops is None else hops - 1} hops left)")
+        return selected, referral_conn, key
+
+    conn.strategy.create_referral_connection = create_limited
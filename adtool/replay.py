@@ -0,0 +1,380 @@
+import io
+import sys
+import gzip
+import json
+import time
+import base64
+import logging
+from collections import deque
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from ldap3 import Server, Connection, MOCK_SYNC, OFFLINE_AD_2012_R2
+from ldap3.core.results import RESULT_OTHER
+from ldap3.strategy.base import BaseStrategy
+from ldap3.strategy.mockSync import MockSyncStrategy
+
+logger = logging.getLogger(__name__)
+
+# ---- Record and replay of LDAP sessions ----
+#
+# Capture mode records every request/response pair adtool exchanges with a
+# DC, with timings, into a gzipped JSON-lines file. Passwords are redacted
+# before they are written. Replay mode serves those responses back through a
+# MOCK_SYNC connection, sleeping for the recorded (or scaled) latency, so a
+# slow run can be profiled and benchmarked offline.
+#
+#   adtool --capture run.jsonl.gz list-users-in-group BigGroup
+#   adtool --replay run.jsonl.gz list-users-in-group BigGroup
+#   python -m adtool.replay run.jsonl.gz --repeat 20 --latency-scale 1.0
+
+CAPTURE_VERSION = 1
+REDACTED = "<redacted>"
+
+# Attributes whose values are never written to a capture file
+SECRET_ATTRIBUTES = {"unicodepwd", "userpassword", "clearpassword", "ntpwdhistory", "lmpwdhistory"}
+
+
+
+# Text for valid UTF-8, otherwise {"b64": ...} so binary values survive JSON
+def encode_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            return bytes(value).decode("utf-8")
+        except UnicodeDecodeError:
+            return {"b64": base64.b64encode(bytes(value)).decode("ascii")}
+    return value
+
+def decode_value(value):
+    if isinstance(value, dict) and "b64" in value:
+        return base64.b64decode(value["b64"])
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return value
+
+# JSON-safe copy of a decoded request or control structure
+def jsonable(value):
+    if isinstance(value, dict):
+        return {str(k): jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [jsonable(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return encode_value(value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+# Decoded request with credentials and password values replaced
+def redact_request(message_type, request):
+    request = jsonable(request)
+    if message_type == "bindRequest":
+        authentication = request.get("authentication", {})
+        for key in ("simple", "sasl", "credentials"):
+            if authentication.get(key):
+                authentication[key] = REDACTED
+        if isinstance(authentication.get("sasl"), dict):
+            authentication["sasl"] = REDACTED
+    elif message_type == "addRequest":
+        for name in request.get("attributes", {}):
+            if name.lower() in SECRET_ATTRIBUTES:
+                request["attributes"][name] = [REDACTED]
+    elif message_type == "modifyRequest":
+        for change in request.get("changes", []):
+            if change["attribute"]["type"].lower() in SECRET_ATTRIBUTES:
+                change["attribute"]["value"] = [REDACTED]
+    return request
+
+# Key used to match a replayed request with a recorded one
+def request_key(message_type, request):
+    if message_type == "bindRequest":
+        request = {"name": request.get("name")}
+    return message_type + " " + json.dumps(request, sort_keys=True)
+
+def _result_controls(result):
+    controls = (result or {}).get("controls") or {}
+    return {oid: jsonable(control.get("value")) for oid, control in controls.items()}
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.operations = []
+        self.commands = []
+        self.started = time.perf_counter()
+        self._pending = []
+
+    # Wrap the strategy entry points of a connection; call before bind()
+    def attach(self, conn):
+        send = conn.send
+        post_send_search = conn.post_send_search
+        post_send_single_response = conn.post_send_single_response
+
+        def recording_send(message_type, request, controls=None):
+            decoded = BaseStrategy.decode_request(message_type, request, controls)
+            self._pending.append((message_type, redact_request(message_type, decoded), time.perf_counter()))
+            message_id = send(message_type, request, controls)
+            if message_type in ("unbindRequest", "abandonRequest"):
+                self._finish(conn, None)
+            return message_id
+
+        def recording_post_send_search(message_id):
+            response = post_send_search(message_id)
+            self._finish(conn, response)
+            return response
+
+        def recording_post_send_single_response(message_id):
+            response = post_send_single_response(message_id)
+            self._finish(conn, None)
+            return response
+
+        conn.send = recording_send
+        conn.post_send_search = recording_post_send_search
+        conn.post_send_single_response = recording_post_send_single_response
+        return conn
+
+    def _finish(self, conn, response):
+        if not self._pending:
+            return
+        message_type, request, started = self._pending.pop()
+        if self._pending:
+            # searches ldap3 issues inside another operation (auto-range);
+            # their time and values are already part of the outer operation
+            return
+
+        operation = {
+            "op": message_type,
+            "request": request,
+            "t": round(started - self.started, 6),
+            "elapsed": round(time.perf_counter() - started, 6),
+        }
+        result = conn.result if message_type not in ("unbindRequest", "abandonRequest") else None
+        if result:
+            operation["result"] = {
+                "code": result.get("result"),
+                "message": result.get("message", ""),
+                "dn": result.get("dn", ""),
+                "referrals": result.get("referrals"),
+            }
+            for key in ("responseName", "responseValue", "saslCreds"):
+                if result.get(key) is not None:
+                    operation["result"][key] = encode_value(result[key])
+            controls = _result_controls(result)
+            if controls:
+                operation["result"]["controls"] = controls
+        if response is not None:
+            operation["entries"] = [
+                {
+                    "dn": entry["dn"],
+                    "attributes": {
+                        name: [REDACTED] if name.lower() in SECRET_ATTRIBUTES else [encode_value(v) for v in values]
+                        for name, values in entry.get("raw_attributes", {}).items()
+                    },
+                }
+                for entry in response if entry.get("type") == "searchResEntry"
+            ]
+            references = [uri for entry in response if entry.get("type") == "searchResRef" for uri in entry.get("uri", [])]
+            if references:
+                operation["references"] = references
+        self.operations.append(operation)
+
+    # Note which adtool command the operations that follow belong to
+    def start_command(self, command, args):
+        self.operations.append({"command": command, "args": list(args), "t": round(time.perf_counter() - self.started, 6)})
+
+    def save(self, path, server=None):
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            header = {
+                "version": CAPTURE_VERSION,
+                "captured": datetime.now().isoformat(timespec="seconds"),
+                "server": server,
+            }
+            f.write(json.dumps(header) + "\n")
+            for operation in self.operations:
+                f.write(json.dumps(operation, separators=(",", ":")) + "\n")
+
+
+# Header and records of a capture file
+def load_capture(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines or lines[0].get("version") != CAPTURE_VERSION:
+        raise ValueError(f"{path} is not an adtool capture file")
+    return lines[0], lines[1:]
+
+
+# ---- Replay ----
+
+class ReplayStrategy(MockSyncStrategy):
+
+    def __init__(self, ldap_connection):
+        MockSyncStrategy.__init__(self, ldap_connection)
+        self.replay = ldap_connection.server.replay
+
+    def _serve(self, message_type, request_message, controls):
+        decoded = BaseStrategy.decode_request(message_type, request_message, controls)
+        key = request_key(message_type, redact_request(message_type, decoded))
+        operation = self.replay.next_operation(key)
+        if operation is None:
+            logger.warning(f"Request not found in capture: {key}")
+            return None, {"resultCode": RESULT_OTHER, "matchedDN": "", "referral": None,
+                          "diagnosticMessage": "request not found in capture",
+                          "responseName": None, "responseValue": None, "serverSaslCreds": None}
+
+        if self.replay.latency_scale:
+            time.sleep(operation["elapsed"] * self.replay.latency_scale)
+
+        recorded = operation.get("result", {})
+        result = {
+            "resultCode": recorded.get("code", 0),
+            "matchedDN": recorded.get("dn", ""),
+            "diagnosticMessage": recorded.get("message", ""),
+            "referral": recorded.get("referrals"),
+        }
+        for key in ("responseName", "responseValue"):
+            result[key] = decode_value(recorded[key]) if key in recorded else None
+        result["serverSaslCreds"] = decode_value(recorded["saslCreds"]) if "saslCreds" in recorded else None
+        if recorded.get("controls"):
+            result["controls"] = [
+                (oid, {"description": "", "criticality": False, "value": self._control_value(value)})
+                for oid, value in recorded["controls"].items()
+            ]
+        return operation, result
+
+    @staticmethod
+    def _control_value(value):
+        if isinstance(value, dict) and "cookie" in value:
+            value = dict(value)
+            value["cookie"] = decode_value(value["cookie"])
+        return value
+
+    def mock_bind(self, request_message, controls):
+        operation, result = self._serve("bindRequest", request_message, controls)
+        if result["resultCode"] == 0:
+            self.bound = self.replay.header.get("server") or "replay"
+        return result
+
+    def mock_search(self, request_message, controls):
+        operation, result = self._serve("searchRequest", request_message, controls)
+        if operation is None:
+            return [], result
+        entries = [
+            {
+                "object": entry["dn"],
+                "attributes": [
+                    {"type": name, "vals": [decode_value(v) for v in values]}
+                    for name, values in entry["attributes"].items()
+                ],
+            }
+            for entry in operation.get("entries", [])
+        ]
+        return entries, result
+
+    def mock_add(self, request_message, controls):
+        return self._serve("addRequest", request_message, controls)[1]
+
+    def mock_modify(self, request_message, controls):
+        return self._serve("modifyRequest", request_message, controls)[1]
+
+    def mock_delete(self, request_message, controls):
+        return self._serve("delRequest", request_message, controls)[1]
+
+    def mock_modify_dn(self, request_message, controls):
+        return self._serve("modDNRequest", request_message, controls)[1]
+
+    def mock_compare(self, request_message, controls):
+        return self._serve("compareRequest", request_message, controls)[1]
+
+    def mock_extended(self, request_message, controls):
+        return self._serve("extendedReq", request_message, controls)[1]
+
+
+class Replay(object):
+
+    def __init__(self, path, latency_scale=1.0):
+        self.path = path
+        self.header, self.records = load_capture(path)
+        self.latency_scale = latency_scale
+        self.commands = [r for r in self.records if "command" in r]
+        self.reset()
+
+    # Queue the recorded operations again, in capture order per request
+    def reset(self):
+        self.queues = {}
+        for record in self.records:
+            if "op" in record and record["op"] not in ("unbindRequest", "abandonRequest"):
+                key = request_key(record["op"], record["request"])
+                self.queues.setdefault(key, deque()).append(record)
+
+    def next_operation(self, key):
+        queue = self.queues.get(key)
+        if not queue:
+            return None
+        return queue.popleft()
+
+    # A bound connection that answers from the capture; hooks as in cli.connect()
+    def connect(self, before_bind=()):
+        binds = [r for r in self.records if r.get("op") == "bindRequest"]
+        user = binds[0]["request"]["name"] if binds else None
+        server = Server("replay", get_info=OFFLINE_AD_2012_R2)
+        server.replay = self
+        conn = Connection(server, user=user, password=REDACTED, client_strategy=MOCK_SYNC, collect_usage=True)
+        strategy = ReplayStrategy(conn)
+        conn.strategy = strategy
+        conn.send = strategy.send
+        conn.open = strategy.open
+        conn.get_response = strategy.get_response
+        conn.post_send_single_response = strategy.post_send_single_response
+        conn.post_send_search = strategy.post_send_search
+        for hook in before_bind:
+            hook(conn)
+        conn.bind()
+        return conn
+
+
+# ---- Command line: replay captured commands as a benchmark ----
+
+def main():
+    from adtool import cli, usage
+    from adtool.bench import percentile
+
+    argv = sys.argv[1:]
+    repeat = int(cli.pop_option("--repeat", 10, argv))
+    latency_scale = float(cli.pop_option("--latency-scale", 1.0, argv))
+
+    if len(argv) != 1:
+        print("Usage: python -m adtool.replay CAPTURE_FILE [--repeat N] [--latency-scale 1.0]")
+        sys.exit()
+
+    replay = Replay(argv[0], latency_scale)
+    if not replay.commands:
+        print("Capture has no recorded commands.")
+        sys.exit()
+
+    for record in replay.commands:
+        command, args = record["command"], record["args"]
+        latencies = []
+        operations = 0
+        for i in range(repeat):
+            replay.reset()
+            conn = replay.connect()
+            before = usage.snapshot(conn)
+            # password prompts get a placeholder; passwords are redacted in the capture
+            stdin, sys.stdin = sys.stdin, io.StringIO(REDACTED + "\n")
+            try:
+                with redirect_stdout(io.StringIO()):
+                    cli.run_command(conn, command, args)
+            finally:
+                sys.stdin = stdin
+            totals = usage.usage_since(conn, before)
+            latencies.append(totals["elapsed"])
+            operations = totals["operations"]
+            conn.unbind()
+        print(
+            f"{command} {' '.join(args)}: {operations} LDAP ops, "
+            f"p50 {percentile(latencies, 50) * 1000:.1f} ms, "
+            f"p90 {percentile(latencies, 90) * 1000:.1f} ms, "
+            f"max {max(latencies) * 1000:.1f} ms over {repeat} runs"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import time
+import random
+import logging
+import threading
+
+from ldap3.core.results import RESULT_BUSY, RESULT_UNAVAILABLE, RESULT_TIME_LIMIT_EXCEEDED
+from ldap3.core.exceptions import LDAPSocketOpenError, LDAPSocketReceiveError, LDAPSocketSendError, LDAPSessionTerminatedByServerError
+
+from adtool import tracing
+
+logger = logging.getLogger(__name__)
+
+# ---- Retries and circuit breakers for transient DC errors ----
+#
+# attach(conn) wraps the connection's LDAP operations (search, add, modify,
+# delete, modify_dn, compare, extended) so that a transient failure
+#
+#   - result busy (51), unavailable (52) or timeLimitExceeded (3)
+#   - a reset or dropped socket (the connection is bound again first)
+#
+# is retried up to ATTEMPTS times with full-jitter exponential backoff:
+# sleep a random time between 0 and min(MAX_DELAY, BASE_DELAY * 2**attempt).
+# Anything else, and the last failure, is returned to the caller exactly as
+# before, so commands still print their own errors.
+#
+# Each DC (server host) has a circuit breaker shared by every connection in
+# the process. After BREAKER_THRESHOLD transient failures in a row the
+# breaker opens and operations for that DC wait out a cool-down instead of
+# hitting it; then one operation is let through as a probe. A success closes
+# the breaker, a failure opens it again with twice the cool-down (up to
+# MAX_COOLDOWN). Bulk runs slow down while a DC struggles and speed up again
+# on their own, rather than aborting or piling on.
+#
+# A write whose response was lost to a socket reset may have been applied;
+# its retry then reports "already exists" or "not a member".
+
+ATTEMPTS = 5
+BASE_DELAY = 0.1
+MAX_DELAY = 5.0
+
+BREAKER_THRESHOLD = 5
+COOLDOWN = 5.0
+MAX_COOLDOWN = 60.0
+
+TRANSIENT_RESULTS = {RESULT_BUSY, RESULT_UNAVAILABLE, RESULT_TIME_LIMIT_EXCEEDED}
+SOCKET_ERRORS = (LDAPSocketOpenError, LDAPSocketReceiveError, LDAPSocketSendError, LDAPSessionTerminatedByServerError, ConnectionError)
+
+OPERATIONS = ["search", "add", "modify", "delete", "modify_dn", "compare", "extended"]
+
+# Retries made in this process, for summaries
+retries = 0
+
+
+
+# Seconds to wait before retry number attempt (0-based)
+def backoff(attempt):
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, cooldown=COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Condition()
+
+    # True while the breaker is open and its cool-down has not run out
+    def is_open(self):
+        with self.lock:
+            return self.state == self.OPEN and time.monotonic() < self.opened_at + self.cooldown
+
+    # Block until an operation may be sent to this DC
+    def wait(self):
+        with self.lock:
+            while True:
+                if self.state == self.CLOSED:
+                    return
+                now = time.monotonic()
+                if self.state == self.OPEN:
+                    remaining = self.opened_at + self.cooldown - now
+                    if remaining > 0:
+                        self.lock.wait(remaining)
+                        continue
+                    self.state = self.HALF_OPEN
+                    logger.info(f"Circuit for {self.name} half-open, sending a probe")
+                if not self.probing:
+                    self.probing = True
+                    return
+                # someone else's probe is in flight
+                self.lock.wait(self.cooldown)
+
+    def success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for {self.name} closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self.probing = False
+            self.lock.notify_all()
+
+    # An operation let through ended without telling us anything about the DC
+    def release(self):
+        with self.lock:
+            self.probing = False
+            self.lock.notify_all()
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.cooldown = min(MAX_COOLDOWN, self.cooldown * 2)
+                self.open()
+            elif self.state == self.CLOSED and self.failures >= self.threshold:
+                self.open()
+
+    def open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.probing = False
+        logger.warning(f"Circuit for {self.name} open after {self.failures} failures, waiting {self.cooldown:.0f}s")
+        self.lock.notify_all()
+
+
+# DC host -> CircuitBreaker
+breakers = {}
+breakers_lock = threading.Lock()
+
+def breaker_for(host):
+    with breakers_lock:
+        breaker = breakers.get(host)
+        if breaker is None:
+            breaker = breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def call(conn, operation, name, args, kwargs):
+    global retries
+    attempt = 0
+    while True:
+        breaker = breaker_for(conn.server.host)
+        breaker.wait()
+        try:
+            if conn.closed:
+                # the socket was lost on an earlier attempt
+                conn.bind()
+            value = operation(*args, **kwargs)
+        except SOCKET_ERRORS as e:
+            breaker.failure()
+            if attempt + 1 >= ATTEMPTS:
+                raise
+            reason = f"{type(e).__name__}: {e}"
+            try:
+                conn.strategy.close()
+            except Exception:
+                pass
+        except Exception:
+            breaker.release()
+            raise
+        else:
+            code = (conn.result or {}).get("result")
+            if code not in TRANSIENT_RESULTS:
+                breaker.success()
+                return value
+            breaker.failure()
+            if attempt + 1 >= ATTEMPTS:
+                return value
+            reason = conn.result.get("description")
+
+        delay = backoff(attempt)
+        attempt += 1
+        retries += 1
+        logger.warning(f"{name} on {conn.server.host} failed ({reason}), retry {attempt} in {delay:.2f}s")
+        with tracing.span("backoff", cat="retry", operation=name, attempt=attempt, reason=reason):
+            time.sleep(delay)
+
+def attach(conn):
+    for name in OPERATIONS:
+        operation = getattr(conn, name)
+
+        def wrapped(*args, _operation=operation, _name=name, **kwargs):
+            return call(conn, _operation, _name, args, kwargs)
+
+        setattr(conn, name, wrapped)
@@ -0,0 +1,104 @@
+import time
+import logging
+
+from ldap3 import Server, Connection, NONE
+
+from adtool import retry, serverpool, usage, referrals, tlssession
+
+logger = logging.getLogger(__name__)
+
+# ---- Read/write routing ----
+#
+# With "read_from" in credentials.json, name lookups and listings go to a
+# read-only target while writes stay on the writable DC the connection
+# bound to:
+#
+#   {"read_from": "gc", ...}                            Global Catalog (port 3268) of that DC
+#   {"read_from": "ldap://rodc1.branch.lab.local", ...} a read replica
+#   {"read_from": ["ldap://rodc1", "ldap://dc2"], ...}  the nearest of several (see serverpool.py)
+#
+# The read connection is opened the first time it is needed, with the same
+# credentials, referral policy and before_bind hooks, and without
+# downloading the schema.
+# After a successful write, reads on that connection stay on the DC that
+# accepted the write for PIN_SECONDS, so a user created a moment ago is
+# found without waiting for replication. Lookups that feed a
+# read-modify-write (enable-user, disable-user) always read the writable DC.
+# If the read target cannot be reached, reads fall back to the writable DC.
+
+PIN_SECONDS = 30
+GC_PORT = 3268
+
+WRITE_OPERATIONS = ["add", "modify", "delete", "modify_dn", "extended"]
+
+
+
+def attach(conn, creds, before_bind=()):
+    conn.read_from = creds.get("read_from")
+    conn.reader = None
+    if not conn.read_from:
+        return
+    conn.read_creds = creds
+    conn.read_hooks = list(before_bind)
+    conn.pinned_until = 0.0
+    conn.reader_baseline = None
+
+    for name in WRITE_OPERATIONS:
+        operation = getattr(conn, name)
+
+        def wrapped(*args, _operation=operation, **kwargs):
+            value = _operation(*args, **kwargs)
+            if conn.result and conn.result.get("result") == 0:
+                conn.pinned_until = time.monotonic() + PIN_SECONDS
+            return value
+
+        setattr(conn, name, wrapped)
+
+    unbind = conn.unbind
+
+    def unbind_both(*args, **kwargs):
+        if conn.reader is not None:
+            try:
+                conn.reader.unbind()
+            except Exception:
+                pass
+        return unbind(*args, **kwargs)
+
+    conn.unbind = unbind_both
+
+def read_server(conn):
+    read_from = conn.read_from
+    if read_from == "gc":
+        secure = conn.server.ssl
+        return Server(conn.server.host, port=tlssession.GC_LDAPS_PORT if secure else GC_PORT, use_ssl=secure,
+                      tls=conn.server.tls, get_info=NONE)
+    creds = dict(conn.read_creds, dc_ip=read_from)
+    return serverpool.server_for(creds, get_info=NONE)
+
+def open_reader(conn):
+    creds = conn.read_creds
+    reader = Connection(read_server(conn), user=creds["username"], password=creds["password"], collect_usage=True)
+    tlssession.attach(reader, creds)
+    retry.attach(reader)
+    referrals.apply(reader, conn.referral_policy)
+    for hook in conn.read_hooks:
+        hook(reader)
+    if not reader.bind():
+        raise ConnectionError(f"bind to {reader.server.host}:{reader.server.port} failed: {reader.result.get('description')}")
+    tlssession.remember(reader)
+    conn.reader_baseline = usage.snapshot(reader)
+    logger.info(f"Reads go to {reader.server.host}:{reader.server.port}, writes to {conn.server.host}:{conn.server.port}")
+    return reader
+
+# Connection to run a read-only lookup or listing on
+def reader(conn):
+    if not getattr(conn, "read_from", None) or time.monotonic() < conn.pinned_until:
+        return conn
+    if conn.reader is None or conn.reader.closed:
+        try:
+            conn.reader = open_reader(conn)
+        except Exception as e:
+            logger.warning(f"Cannot open read connection ({e}), reading from the writable DC")
+            conn.read_from = None
+            return conn
+    return conn.reader
@@ -0,0 +1,179 @@
+import json
+import time
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from ldap3 import Server, ServerPool, Connection, ALL, NONE, BASE, FIRST
+
+from adtool import retry, locator, tlssession
+
+logger = logging.getLogger(__name__)
+
+# ---- Multi-DC server pool ----
+#
+# credentials.json may name several DCs, or give "domain" instead of dc_ip
+# to find them in DNS (see locator.py):
+#
+#   {"dc_ip": ["10.0.0.10", "10.0.0.11", "ldap://10.0.1.10:389"], ...}
+#
+# With more than one, each DC is probed in parallel (bind, then a base
+# search of the root DSE) and they are ordered healthy-first by bind +
+# search RTT. The order is cached in ~/adtool_logs/dc_cache.json for
+# CACHE_TTL seconds, so later invocations connect straight to the fastest DC
+# without probing. Connections use an ldap3 ServerPool in that order with
+# active failover: a DC that does not answer is skipped (and left out for
+# EXHAUST_SECONDS) and the next one is tried. When a connection ends up on
+# a DC other than the preferred one, the cache is dropped so the next
+# invocation probes again. DCs whose circuit breaker is open (retry.py) go
+# to the back of the order.
+#
+# Located DCs come in two tiers, in-site and the rest of the domain. Only
+# the in-site DCs are probed (at most MAX_PROBES); the others are kept as
+# failover targets and only probed when no in-site DC answers.
+
+CACHE_FILE = Path.home() / "adtool_logs" / "dc_cache.json"
+CACHE_TTL = 3600
+PROBE_TIMEOUT = 3
+ACTIVE_ROUNDS = 2
+EXHAUST_SECONDS = 60
+MAX_PROBES = 10
+
+
+
+# Configured or located DCs as (preferred, others)
+def dc_tiers(creds):
+    if "dc_ip" not in creds:
+        local, others = locator.locate(creds)
+        local, others = (local, others) if local else (others, [])
+    else:
+        dcs = creds["dc_ip"]
+        local, others = ([dcs] if isinstance(dcs, str) else list(dcs)), []
+    return [tlssession.server_url(dc, creds) for dc in local], [tlssession.server_url(dc, creds) for dc in others]
+
+def dc_list(creds):
+    local, others = dc_tiers(creds)
+    return local + others
+
+# Time a bind and a root DSE search against one DC
+def probe(dc, creds, timeout=PROBE_TIMEOUT):
+    result = {"dc": dc, "ok": False, "bind_ms": None, "search_ms": None, "error": None}
+    server = Server(dc, get_info=NONE, connect_timeout=timeout, tls=tlssession.tls_for(creds))
+    conn = Connection(server, user=creds["username"], password=creds["password"], receive_timeout=timeout)
+    tlssession.attach(conn, creds)
+    try:
+        started = time.perf_counter()
+        if not conn.bind():
+            result["error"] = conn.result.get("description")
+            return result
+        bound = time.perf_counter()
+        tlssession.remember(conn)
+        conn.search("", "(objectClass=*)", BASE, attributes=["currentTime"])
+        searched = time.perf_counter()
+        result["bind_ms"] = round((bound - started) * 1000, 2)
+        result["search_ms"] = round((searched - bound) * 1000, 2)
+        result["ok"] = conn.result["result"] == 0
+        if not result["ok"]:
+            result["error"] = conn.result.get("description")
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+    return result
+
+def probe_all(dcs, creds):
+    with ThreadPoolExecutor(max_workers=len(dcs)) as executor:
+        return list(executor.map(lambda dc: probe(dc, creds), dcs))
+
+# Healthy DCs fastest first, then the rest in configured order
+def rank(probes):
+    healthy = sorted((p for p in probes if p["ok"]), key=lambda p: p["bind_ms"] + p["search_ms"])
+    return [p["dc"] for p in healthy] + [p["dc"] for p in probes if not p["ok"]]
+
+# ---- On-disk cache of the chosen order ----
+
+# One entry per set of DCs (the write DCs, and the read DCs of router.py)
+
+def cache_key(dcs):
+    return "|".join(sorted(dcs))
+
+def read_cache_file():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_cache_file(entries):
+    CACHE_FILE.parent.mkdir(exist_ok=True)
+    with open(CACHE_FILE, "w") as f:
+        json.dump(entries, f, indent=2)
+
+def load_cache(dcs):
+    cached = read_cache_file().get(cache_key(dcs))
+    if cached is None or cached.get("dcs") != dcs or time.time() - cached.get("probed", 0) > CACHE_TTL:
+        return None
+    return cached
+
+def save_cache(dcs, order, probes):
+    entries = read_cache_file()
+    entries[cache_key(dcs)] = {"dcs": dcs, "order": order, "probes": probes, "probed": time.time()}
+    write_cache_file(entries)
+
+def forget(dcs):
+    entries = read_cache_file()
+    if entries.pop(cache_key(dcs), None) is not None:
+        write_cache_file(entries)
+
+# DCs in the order to try them, probing unless the cache is fresh
+def ordered_dcs(creds, refresh=False):
+    local, others = dc_tiers(creds)
+    dcs = local + others
+    if len(dcs) == 1:
+        return dcs
+
+    cached = None if refresh else load_cache(dcs)
+    if cached is not None:
+        order = cached["order"]
+    else:
+        probes = probe_all(local[:MAX_PROBES], creds)
+        if others and not any(p["ok"] for p in probes):
+            probes += probe_all(others[:MAX_PROBES], creds)
+        probed = {p["dc"] for p in probes}
+        order = rank(probes) + [dc for dc in dcs if dc not in probed]
+        save_cache(dcs, order, probes)
+        for p in probes:
+            if p["ok"]:
+                logger.info(f"DC probe {p['dc']}: bind {p['bind_ms']}ms, search {p['search_ms']}ms")
+            else:
+                logger.warning(f"DC probe {p['dc']} failed: {p['error']}")
+
+    # DCs this process has seen failing go last
+    return sorted(order, key=lambda dc: retry.breaker_for(Server(dc).host).is_open())
+
+# Server (one DC) or ServerPool (several) for a Connection
+def server_for(creds, refresh=False, get_info=ALL):
+    dcs = ordered_dcs(creds, refresh)
+    tls = tlssession.tls_for(creds)
+    if len(dcs) == 1:
+        return Server(dcs[0], get_info=get_info, tls=tls)
+    servers = [Server(dc, get_info=get_info, connect_timeout=PROBE_TIMEOUT, tls=tls) for dc in dcs]
+    pool = ServerPool(servers, FIRST, active=ACTIVE_ROUNDS, exhaust=EXHAUST_SECONDS)
+    pool.dcs = dcs
+    return pool
+
+# After binding: learn the client's site and note a failover away from
+# the preferred DC
+def after_bind(conn, creds):
+    if "dc_ip" not in creds:
+        locator.learn_site(conn, creds)
+    pool = conn.server_pool
+    if pool is None:
+        return
+    preferred = pool.servers[0]
+    if conn.server is not preferred:
+        logger.warning(f"{preferred.host}:{preferred.port} did not answer, failed over to {conn.server.host}:{conn.server.port}")
+        forget(pool.dcs)
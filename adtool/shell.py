@@ -0,0 +1,175 @@
+import os
+import cmd
+import shlex
+import logging
+
+from adtool import cli, usage
+from adtool.cache import ResolutionCache
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+logger = logging.getLogger(__name__)
+
+# ---- Interactive shell ----
+#
+#   adtool shell
+#   adtool> add-user-to-group John.Doe Helpdesk
+#   adtool> list-users-in-group Helpdesk --usage
+#   adtool> source onboarding.txt
+#
+# Binds once and keeps the connection (and downloaded schema) for the whole
+# session. User and group DNs are cached, so repeated commands on the same
+# names skip their lookup searches. Tab completes commands and names seen in
+# the session; history is kept in ~/.adtool_history.
+
+HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".adtool_history")
+HISTORY_LENGTH = 1000
+
+
+
+class ADShell(cmd.Cmd):
+    prompt = "adtool> "
+    intro = "adtool shell. Type help for commands, exit to leave."
+    identchars = cmd.Cmd.identchars + "-"
+
+    def __init__(self, conn, connect=None):
+        cmd.Cmd.__init__(self)
+        self.conn = conn
+        self.connect = connect or cli.connect
+        self.names = set()
+
+    # Run one adtool command line, e.g. "enable-user John.Doe --usage"
+    def run_line(self, line):
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            print(f"Cannot parse line: {e}")
+            return
+        if not words:
+            return
+
+        show_usage = cli.pop_flag("--usage", words)
+        command, args = words[0], words[1:]
+        if not cli.check_arguments(command, args):
+            return
+
+        if self.conn.closed:
+            print("Connection closed, binding again.")
+            self.conn = self.connect()
+
+        self.names.update(args)
+        before = usage.snapshot(self.conn)
+        cli.run_command(self.conn, command, args)
+        cli.report_usage(self.conn, command, before, show_usage)
+
+    def default(self, line):
+        if line == "EOF":
+            print()
+            return True
+        self.run_line(line)
+
+    def emptyline(self):
+        pass
+
+    def do_source(self, arg):
+        "source FILE: run the adtool commands in FILE, one per line"
+        path = arg.strip()
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except OSError as e:
+            print(f"Cannot read {path}: {e.strerror}")
+            return
+
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            print(f"{path}:{number}: {line}")
+            self.run_line(line)
+
+    def do_cache(self, arg):
+        "cache [clear]: show or clear the cached user and group DNs"
+        if arg.strip() == "clear":
+            cli.dn_cache.clear()
+        stats = cli.dn_cache.stats()
+        print(f"{stats['entries']} cached DNs, {stats['hits']} hits, {stats['misses']} misses")
+
+    def do_exit(self, arg):
+        "exit: leave the shell"
+        return True
+
+    do_quit = do_exit
+
+    def do_help(self, arg):
+        if arg:
+            return cmd.Cmd.do_help(self, arg)
+        print("Commands:")
+        cli.print_commands()
+        print()
+        print("Shell commands:")
+        print("  source FILE            run the commands in FILE")
+        print("  cache [clear]          show or clear cached DNs")
+        print("  exit                   leave the shell")
+        print()
+        print("Add --usage to a command to print its LDAP cost.")
+
+    # ---- Completion ----
+
+    def completenames(self, text, *ignored):
+        names = list(cli.COMMANDS) + ["source", "cache", "exit", "help"]
+        return [name for name in names if name.startswith(text)]
+
+    def completedefault(self, text, line, begidx, endidx):
+        known = self.names | set(cli.dn_cache.names())
+        matches = sorted(name for name in known if name.lower().startswith(text.lower()))
+        if "--usage".startswith(text) and text.startswith("-"):
+            matches.append("--usage")
+        return matches
+
+    def complete_source(self, text, line, begidx, endidx):
+        directory, prefix = os.path.split(text)
+        try:
+            entries = os.listdir(directory or ".")
+        except OSError:
+            return []
+        return [os.path.join(directory, e) for e in entries if e.startswith(prefix)]
+
+
+def load_history():
+    if readline is None:
+        return
+    readline.set_completer_delims(" \t\n")
+    try:
+        readline.read_history_file(HISTORY_FILE)
+    except OSError:
+        pass
+    readline.set_history_length(HISTORY_LENGTH)
+
+def save_history():
+    if readline is None:
+        return
+    try:
+        readline.write_history_file(HISTORY_FILE)
+    except OSError:
+        logger.warning(f"Could not write shell history to {HISTORY_FILE}")
+
+def main(argv):
+    if argv:
+        print("Usage: adtool shell")
+        return
+
+    cli.dn_cache = ResolutionCache()
+    conn = cli.connect()
+    load_history()
+    shell = ADShell(conn)
+    try:
+        shell.cmdloop()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        save_history()
+        shell.conn.unbind()
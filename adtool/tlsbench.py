@@ -0,0 +1,142 @@
+import ssl
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+import ldap3
+from ldap3 import Server, Connection, NONE
+
+from adtool import cli, bench, fakead, latencyproxy, tlssession
+
+# ---- TLS connect benchmark (dev tool) ----
+#
+# Measures what a new connection costs (connect, TLS, simple bind, unbind)
+# against a local fake DC with a self-signed certificate, optionally behind
+# latencyproxy to add a round trip:
+#
+#   python -m adtool.tlsbench --iterations 50 --rtt-ms 20 --out tls.json
+#
+#   plaintext          ldap:// with no TLS
+#   ldaps-full         LDAPS, a full handshake every time
+#   ldaps-resumed      LDAPS, resuming the previous TLS session
+#   starttls-full      StartTLS on 389, a full handshake every time
+#   starttls-resumed   StartTLS, resuming the previous TLS session
+#
+# The certificate is made with the openssl command line tool unless --cert
+# names a PEM file with a certificate and key for 127.0.0.1.
+
+DEFAULT_ITERATIONS = 50
+USERS = 100
+
+CASES = ["plaintext", "ldaps-full", "ldaps-resumed", "starttls-full", "starttls-resumed"]
+
+
+
+# Self-signed certificate and key for 127.0.0.1 in directory; returns the PEM path
+def make_certificate(directory):
+    if shutil.which("openssl") is None:
+        print("openssl is not installed; pass --cert with a PEM certificate and key for 127.0.0.1")
+        sys.exit(1)
+    key, cert = Path(directory) / "key.pem", Path(directory) / "cert.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", str(key), "-out", str(cert), "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True, capture_output=True
+    )
+    pem = Path(directory) / "lab.pem"
+    pem.write_text(cert.read_text() + key.read_text())
+    return str(pem)
+
+# Milliseconds for one connect + bind + unbind
+def connect_once(port, creds, tls):
+    server = Server(tlssession.server_url(f"127.0.0.1:{port}", creds), get_info=NONE, tls=tls)
+    conn = Connection(server, user=f"{fakead.DEFAULT_NETBIOS}\\Administrator", password=fakead.DEFAULT_ADMIN_PASSWORD)
+    tlssession.attach(conn, creds)
+    started = time.perf_counter()
+    if not conn.bind():
+        raise RuntimeError(f"Bind failed: {conn.result}")
+    tlssession.remember(conn)
+    conn.unbind()
+    return (time.perf_counter() - started) * 1000
+
+def run_case(case, ports, pem, iterations):
+    mode, _, handshake = case.partition("-")
+    creds = {} if mode == "plaintext" else {"tls": mode, "ca_certs": pem}
+    cache = tlssession.SessionCache()
+    tls = None if mode == "plaintext" else tlssession.ResumingTls(cache, validate=ssl.CERT_REQUIRED, ca_certs_file=pem)
+    port = ports["ldaps"] if mode == "ldaps" else ports["ldap"]
+
+    # One connection first so there is a session to resume
+    if handshake == "resumed":
+        connect_once(port, creds, tls)
+        cache.full = 0
+    samples = []
+    for _ in range(iterations):
+        if handshake == "full":
+            cache.clear()
+        samples.append(connect_once(port, creds, tls))
+
+    result = {
+        "median_ms": round(bench.percentile(samples, 50), 2),
+        "p95_ms": round(bench.percentile(samples, 95), 2),
+    }
+    if tls is not None:
+        result.update(full_handshakes=cache.full, resumed_handshakes=cache.resumed)
+    return result
+
+
+def main():
+    argv = sys.argv[1:]
+    iterations = int(cli.pop_option("--iterations", DEFAULT_ITERATIONS, argv))
+    rtt = float(cli.pop_option("--rtt-ms", 0, argv))
+    cert = cli.pop_option("--cert", None, argv)
+    out = cli.pop_option("--out", None, argv)
+
+    if argv:
+        print("Usage: python -m adtool.tlsbench [--iterations N] [--rtt-ms N] [--cert PEM] [--out FILE]")
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pem = cert or make_certificate(directory)
+        context = fakead.server_context(pem)
+
+        fake = fakead.FakeDirectory()
+        fake.add_user("Administrator", password=fakead.DEFAULT_ADMIN_PASSWORD)
+        bench.build_directory(fake._seeder, USERS, max(1, USERS // bench.USERS_PER_GROUP))
+        servers = [fake.listen(starttls_context=context), fake.listen(ssl_context=context)]
+        proxies = [latencyproxy.LatencyProxy(("127.0.0.1", s.port), rtt=rtt / 1000.0).start() for s in servers]
+        ports = {"ldap": proxies[0].port, "ldaps": proxies[1].port}
+
+        results = {}
+        try:
+            for case in CASES:
+                results[case] = run_case(case, ports, pem, iterations)
+                r = results[case]
+                print(f"{case:<18} median {r['median_ms']:>8.2f} ms   p95 {r['p95_ms']:>8.2f} ms" + (
+                    f"   ({r['full_handshakes']} full, {r['resumed_handshakes']} resumed)" if "full_handshakes" in r else ""))
+        finally:
+            for s in proxies + servers:
+                s.shutdown()
+
+    if out:
+        with open(out, "w") as f:
+            json.dump({
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "openssl": ssl.OPENSSL_VERSION,
+                "ldap3": ldap3.__version__,
+                "iterations": iterations,
+                "rtt_ms": rtt,
+                "results": results,
+            }, f, indent=2)
+        print(f"Results written to {out}")
+
+if __name__ == "__main__":
+    main()
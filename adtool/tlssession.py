@@ -0,0 +1,145 @@
+import ssl
+import logging
+import threading
+
+from ldap3 import Tls
+from ldap3.core.tls import check_hostname
+
+logger = logging.getLogger(__name__)
+
+# ---- LDAPS / StartTLS with TLS session resumption ----
+#
+#   {"dc_ip": "dc1.lab.local", "tls": "ldaps", "ca_certs": "lab-ca.pem", ...}
+#   {"dc_ip": "dc1.lab.local", "tls": "starttls", ...}
+#
+# "ldaps" connects to port 636 (3269 for the Global Catalog), "starttls"
+# upgrades the plain connection on 389 before the bind. Certificates are
+# checked against "ca_certs" (or the system store); "tls_validate": false
+# turns that off for lab DCs with self-signed certificates.
+#
+# Every connection in the process shares one SSLContext and a cache of the
+# last TLS session per DC, so the second and later connections to a DC
+# (api and aio workers, batch and shell reconnects, the read connection of
+# router.py) resume the session with an abbreviated handshake instead of a
+# full one. Python's ssl module cannot export a session, so a new process
+# always starts with a full handshake; use a long-running mode (api, shell,
+# batch) when many operations are needed. python -m adtool.tlsbench measures
+# the difference.
+
+MODES = ["ldaps", "starttls"]
+LDAPS_PORT = 636
+GC_LDAPS_PORT = 3269
+
+
+
+class SessionCache(object):
+
+    def __init__(self):
+        self.sessions = {}   # (host, port) -> ssl.SSLSession
+        self.lock = threading.Lock()
+        self.full = 0
+        self.resumed = 0
+
+    def get(self, key):
+        with self.lock:
+            return self.sessions.get(key)
+
+    def put(self, key, session, reused):
+        with self.lock:
+            if session is not None:
+                self.sessions[key] = session
+            if reused:
+                self.resumed += 1
+            else:
+                self.full += 1
+
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"sessions": len(self.sessions), "full": self.full, "resumed": self.resumed}
+
+
+sessions = SessionCache()
+
+
+# ldap3 Tls that keeps one SSLContext and offers the cached session for the DC
+class ResumingTls(Tls):
+
+    def __init__(self, cache=sessions, **kwargs):
+        Tls.__init__(self, **kwargs)
+        self.cache = cache
+        self.context = None
+        self.lock = threading.Lock()
+
+    def build_context(self):
+        context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH, cafile=self.ca_certs_file)
+        context.check_hostname = False
+        context.verify_mode = self.validate
+        return context
+
+    def wrap_socket(self, connection, do_handshake=False):
+        with self.lock:
+            if self.context is None:
+                self.context = self.build_context()
+        key = (connection.server.host, connection.server.port)
+        wrapped = self.context.wrap_socket(connection.socket, server_side=False, do_handshake_on_connect=do_handshake,
+                                           server_hostname=self.sni, session=self.cache.get(key))
+        if do_handshake and self.validate in (ssl.CERT_REQUIRED, ssl.CERT_OPTIONAL):
+            check_hostname(wrapped, connection.server.host, self.valid_names)
+        connection.socket = wrapped
+
+
+# One ResumingTls per CA file and validation setting, shared by all connections
+tls_configs = {}
+tls_lock = threading.Lock()
+
+def tls_for(creds):
+    if creds.get("tls") not in MODES:
+        return None
+    validate = ssl.CERT_NONE if creds.get("tls_validate") is False else ssl.CERT_REQUIRED
+    key = (creds.get("ca_certs"), validate)
+    with tls_lock:
+        if key not in tls_configs:
+            tls_configs[key] = ResumingTls(validate=validate, ca_certs_file=creds.get("ca_certs"))
+        return tls_configs[key]
+
+# DC address with the scheme and port for the TLS mode
+def server_url(dc, creds):
+    if creds.get("tls") != "ldaps":
+        return dc
+    host = dc.split("://", 1)[-1].rstrip("/")
+    port = LDAPS_PORT
+    if host.count(":") == 1:
+        host, given = host.split(":")
+        if int(given) != 389:
+            port = int(given)
+    return f"ldaps://{host}:{port}"
+
+# Upgrade every (re)opened socket of the connection with StartTLS
+def attach(conn, creds):
+    if creds.get("tls") != "starttls":
+        return
+    open_plain = conn.open
+
+    def open_tls(*args, **kwargs):
+        value = open_plain(*args, **kwargs)
+        if not conn.tls_started:
+            conn.start_tls(read_server_info=False)
+        return value
+
+    conn.open = open_tls
+
+# After a TLS bind: keep the session for the next connection to the DC
+def remember(conn):
+    sock = conn.socket
+    if not isinstance(sock, ssl.SSLSocket):
+        return
+    tls = conn.server.tls
+    cache = tls.cache if isinstance(tls, ResumingTls) else sessions
+    reused = sock.session_reused
+    cache.put((conn.server.host, conn.server.port), sock.session, reused)
+    logger.info(f"TLS to {conn.server.host}:{conn.server.port}: {sock.version()}, "
+                f"{'resumed' if reused else 'full'} handshake")
@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# ---- Chrome trace export for --trace FILE ----
+#
+# Records a span for the bind, every LDAP operation, cache lookups and
+# writes to stdout, in Chrome Trace Event format. Open the file in
+# https://ui.perfetto.dev or chrome://tracing. Each connection gets its own
+# track (tid) and every operation span carries its LDAP message ID, so
+# pipelined or parallel runs show where requests wait on each other.
+#
+# Code that wants its own spans uses the module-level helper, which does
+# nothing unless a trace is being recorded:
+#
+#   with tracing.span("cache lookup", cat="cache", key=name):
+#       ...
+
+OPERATION_NAMES = {
+    "bindRequest": "bind",
+    "unbindRequest": "unbind",
+    "searchRequest": "search",
+    "addRequest": "add",
+    "modifyRequest": "modify",
+    "delRequest": "delete",
+    "modDNRequest": "modify dn",
+    "compareRequest": "compare",
+    "extendedReq": "extended",
+    "abandonRequest": "abandon",
+}
+
+# Tracer receiving spans from tracing.span(), set by Tracer.start()
+active = None
+
+
+
+@contextmanager
+def span(name, cat="adtool", **args):
+    tracer = active
+    if tracer is None:
+        yield
+        return
+    started = tracer.now()
+    try:
+        yield
+    finally:
+        tracer.complete(name, cat, started, tracer.now(), args=args)
+
+
+class TraceStdout(object):
+
+    # Records an "output" span for every write to stdout
+    def __init__(self, stream, tracer):
+        self.stream = stream
+        self.tracer = tracer
+
+    def write(self, text):
+        started = self.tracer.now()
+        result = self.stream.write(text)
+        self.tracer.output(started, self.tracer.now(), len(text))
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Tracer(object):
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.stdout = None
+
+    # Microseconds since the trace started
+    def now(self):
+        return (time.perf_counter() - self.origin) * 1000000.0
+
+    def complete(self, name, cat, start, end, tid=None, args=None):
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": round(start, 1),
+            "dur": round(end - start, 1),
+            "pid": self.pid,
+            "tid": tid if tid is not None else threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    # Adjacent writes are merged into one span so large listings stay readable
+    def output(self, start, end, size):
+        tid = threading.get_ident()
+        with self.lock:
+            last = self.events[-1] if self.events else None
+            if last and last["name"] == "output" and last["tid"] == tid:
+                last["dur"] = round(end - last["ts"], 1)
+                last["args"]["bytes"] += size
+                last["args"]["writes"] += 1
+                return
+        self.complete("output", "output", start, end, tid, {"bytes": size, "writes": 1})
+
+    def start(self):
+        global active
+        active = self
+        self.events.append({
+            "name": "thread_name", "ph": "M", "pid": self.pid, "tid": threading.get_ident(),
+            "args": {"name": threading.current_thread().name},
+        })
+        self.stdout = sys.stdout
+        sys.stdout = TraceStdout(sys.stdout, self)
+
+    def stop(self):
+        global active
+        if self.stdout is None:
+            return
+        sys.stdout, self.stdout = self.stdout, None
+        if active is self:
+            active = None
+
+    # Trace every operation of a connection; call before bind() to include it
+    def attach(self, conn):
+        with self.lock:
+            self.connections += 1
+            connection_id = self.connections
+            self.events.append({
+                "name": "thread_name", "ph": "M", "pid": self.pid, "tid": connection_id,
+                "args": {"name": f"connection {connection_id} ({conn.server.host})"},
+            })
+        conn.trace_id = connection_id
+
+        pending = {}
+        send = conn.send
+        post_send_search = conn.post_send_search
+        post_send_single_response = conn.post_send_single_response
+
+        # the mock strategies return (message_id, type, request, controls)
+        def message_id_of(payload):
+            return payload[0] if isinstance(payload, tuple) else payload
+
+        def tracing_send(message_type, request, controls=None):
+            started = self.now()
+            payload = send(message_type, request, controls)
+            message_id = message_id_of(payload)
+            args = {"message_id": message_id, "connection_id": connection_id}
+            args.update(self._request_details(message_type, conn.request))
+            name = OPERATION_NAMES.get(message_type, message_type)
+            if message_type in ("unbindRequest", "abandonRequest"):
+                self.complete(name, "ldap", started, self.now(), connection_id, args)
+            else:
+                pending[message_id] = (name, started, args)
+            return payload
+
+        def finish(payload, response=None):
+            message_id = message_id_of(payload)
+            if message_id not in pending:
+                return
+            name, started, args = pending.pop(message_id)
+            if conn.result:
+                args["result"] = conn.result.get("result")
+            if response is not None:
+                args["entries"] = len(response)
+            self.complete(name, "ldap", started, self.now(), connection_id, args)
+
+        def tracing_post_send_search(message_id):
+            response = post_send_search(message_id)
+            finish(message_id, response)
+            return response
+
+        def tracing_post_send_single_response(message_id):
+            response = post_send_single_response(message_id)
+            finish(message_id)
+            return response
+
+        conn.send = tracing_send
+        conn.post_send_search = tracing_post_send_search
+        conn.post_send_single_response = tracing_post_send_single_response
+        return conn
+
+    # A few fields of the decoded request (ldap3 keeps it in conn.request)
+    @staticmethod
+    def _request_details(message_type, decoded):
+        if not decoded:
+            return {}
+        if message_type == "searchRequest":
+            return {"base": decoded["base"], "filter": decoded["filter"]}
+        if message_type == "bindRequest":
+            return {"user": decoded["name"]}
+        if message_type == "extendedReq":
+            return {"oid": str(decoded["name"])}
+        for key in ("entry", "name"):
+            if key in decoded:
+                return {"dn": str(decoded[key])}
+        return {}
+
+    def save(self, path):
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
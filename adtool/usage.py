@@ -0,0 +1,91 @@
+import time
+
+
+# Counters copied out of ldap3's ConnectionUsage for every command
+USAGE_FIELDS = [
+    "operations",
+    "search_operations",
+    "add_operations",
+    "modify_operations",
+    "delete_operations",
+    "extended_operations",
+    "bytes_transmitted",
+    "bytes_received",
+    "referrals_received",
+    "referrals_followed",
+    "referrals_connections",
+]
+
+# Maximum number of LDAP operations each command may send once the
+# connection is bound. Bind, schema download and unbind are paid once per
+# connection and are not counted against a command.
+ROUND_TRIP_BUDGETS = {
+    "create-user": 4,
+    "create-group": 1,
+    "add-user-to-group": 3,
+    "delete-user-from-group": 3,
+    "list-users-in-group": 1,
+    "enable-user": 2,
+    "disable-user": 2,
+}
+
+
+
+# Take a copy of the usage counters of a connection opened with collect_usage=True
+
+def snapshot(conn):
+    usage = conn.usage
+    if usage is None:
+        return None
+
+    counters = {field: getattr(usage, field) for field in USAGE_FIELDS}
+
+    # plus the read connection (router.py) since it bound
+    reader = getattr(conn, "reader", None)
+    if reader is not None and reader.usage is not None and conn.reader_baseline is not None:
+        for field in USAGE_FIELDS:
+            counters[field] += getattr(reader.usage, field) - conn.reader_baseline[field]
+
+    counters["time"] = time.perf_counter()
+    return counters
+
+# Totals sent and received on the connection since the given snapshot
+def usage_since(conn, before):
+    after = snapshot(conn)
+    if before is None or after is None:
+        return None
+
+    totals = {field: after[field] - before[field] for field in USAGE_FIELDS}
+    totals["elapsed"] = after["time"] - before["time"]
+    return totals
+
+# Return the budget a command went over, or None if it stayed within it
+def over_budget(command, totals):
+    budget = ROUND_TRIP_BUDGETS.get(command)
+    if budget is None or totals is None:
+        return None
+
+    if totals["operations"] > budget:
+        return budget
+    return None
+
+# One line summary of a command's LDAP cost
+def format_usage(command, totals):
+    return (
+        f"{command}: {totals['operations']} operations "
+        f"(search={totals['search_operations']} add={totals['add_operations']} "
+        f"modify={totals['modify_operations']} delete={totals['delete_operations']} "
+        f"extended={totals['extended_operations']}), "
+        f"{totals['bytes_transmitted']} bytes sent, "
+        f"{totals['bytes_received']} bytes received, "
+        f"{totals['elapsed'] * 1000:.1f} ms"
+    ) + format_referrals(totals)
+
+# Referral counts, when the command met any
+def format_referrals(totals):
+    if not totals["referrals_received"]:
+        return ""
+    return (
+        f", {totals['referrals_received']} referrals "
+        f"({totals['referrals_followed']} followed, {totals['referrals_connections']} new connections)"
+    )
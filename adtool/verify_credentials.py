@@ -0,0 +1,207 @@
+import re
+import sys
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ldap3 import Connection, NONE, SIMPLE
+
+from adtool import cli, serverpool, tlssession
+
+logger = logging.getLogger(__name__)
+
+# ---- Bulk credential check with fast bind ----
+#
+#   adtool verify-credentials accounts.txt
+#   adtool verify-credentials accounts.ndjson --ndjson --connections 8
+#
+# Input is one account per line, "name password" (the password is the rest
+# of the line after the first space, spaces included) or {"username": ..., "password": ...}. Names without a
+# domain get the one from credentials.json ("LAB\name" or "name@lab.local").
+#
+# Each connection of a small pool first asks the DC for fast bind mode
+# (LDAP_SERVER_FAST_BIND_OID), then checks one account after another with
+# simple binds on the same socket. In that mode the DC only validates the
+# password: it builds no security token and looks up no group memberships,
+# and the connection is never authorised for anything else. That is much
+# cheaper than a connect, bind and unbind per account, on both ends.
+#
+# Fast bind only allows simple binds, so passwords cross the wire as sent;
+# use "tls" in credentials.json (see tlssession.py) outside a lab.
+
+FAST_BIND_OID = "1.2.840.113556.1.4.1781"
+DEFAULT_CONNECTIONS = 4
+
+# AD's reason for a failed bind, from "data NNN" in the diagnostic message
+BIND_ERRORS = {
+    "525": "user not found",
+    "52e": "invalid credentials",
+    "530": "logon not permitted at this time",
+    "531": "logon not permitted from this workstation",
+    "532": "password expired",
+    "533": "account disabled",
+    "701": "account expired",
+    "773": "must change password",
+    "775": "account locked out",
+}
+
+BIND_DATA = re.compile(r"data ([0-9a-f]+)", re.IGNORECASE)
+
+
+
+# (username, password) from one input line, or None for blank/comment lines
+def parse_line(text):
+    text = text.rstrip("\r\n").lstrip()
+    if not text.strip() or text.startswith("#"):
+        return None
+    if text.startswith("{"):
+        document = json.loads(text)
+        return document["username"], document.get("password") or ""
+    # spaces are part of the password, only the line ending is not
+    name, _, password = text.partition(" ")
+    return name, password
+
+# Bind name for an account, in the domain of the tool's own account
+def bind_name(username, creds):
+    if "\\" in username or "@" in username or "=" in username:
+        return username
+    own = creds["username"]
+    if "\\" in own:
+        return f"{own.split(chr(92), 1)[0]}\\{username}"
+    if "@" in own:
+        return f"{username}@{own.split('@', 1)[1]}"
+    return username
+
+def reason(result):
+    match = BIND_DATA.search(result.get("message") or "")
+    if match and match.group(1).lower() in BIND_ERRORS:
+        return BIND_ERRORS[match.group(1).lower()]
+    return result.get("description") or "bind failed"
+
+
+class FastBindPool(object):
+
+    def __init__(self, creds, connections=DEFAULT_CONNECTIONS):
+        self.creds = creds
+        self.server = serverpool.server_for(creds, get_info=NONE)
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix="fastbind")
+        self.lock = threading.Lock()
+        self.connections = []
+        self.opened = 0
+        self.fast = 0
+
+    # This thread's connection, in fast bind mode if the DC allows it
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and not conn.closed:
+            return conn
+        conn = Connection(self.server, authentication=SIMPLE)
+        tlssession.attach(conn, self.creds)
+        conn.open()
+        conn.extended(FAST_BIND_OID)
+        fast = conn.result["result"] == 0
+        if not fast:
+            logger.warning(f"DC refused fast bind ({conn.result.get('description')}), checking with full binds")
+        with self.lock:
+            self.connections.append(conn)
+            self.opened += 1
+            self.fast += fast
+        self.local.conn = conn
+        return conn
+
+    # {"username", "ok", "reason"} for one account
+    def check(self, account):
+        username, password = account
+        result = {"username": username, "ok": False, "reason": None}
+        if not password:
+            # an empty password is an anonymous bind and would "succeed"
+            result["reason"] = "no password"
+            return result
+        try:
+            conn = self.connection()
+            conn.user = bind_name(username, self.creds)
+            conn.password = password
+            result["ok"] = conn.bind()
+            if not result["ok"]:
+                result["reason"] = reason(conn.result)
+        except Exception as e:
+            logger.warning(f"Checking {username} failed: {type(e).__name__}: {e}")
+            result["reason"] = f"{type(e).__name__}: {e}"
+            self.drop()
+        return result
+
+    def drop(self):
+        conn, self.local.conn = getattr(self.local, "conn", None), None
+        if conn is not None:
+            with self.lock:
+                if conn in self.connections:
+                    self.connections.remove(conn)
+            try:
+                conn.unbind()
+            except Exception:
+                pass
+
+    def check_all(self, accounts):
+        return self.executor.map(self.check, accounts)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            try:
+                conn.unbind()
+            except Exception:
+                pass
+
+
+def main(argv):
+    ndjson = cli.pop_flag("--ndjson", argv)
+    connections = int(cli.pop_option("--connections", DEFAULT_CONNECTIONS, argv))
+
+    if len(argv) != 1:
+        print("Usage: adtool verify-credentials FILE|- [--ndjson] [--connections N]")
+        return
+
+    source = argv[0]
+    try:
+        stream = sys.stdin if source == "-" else open(source)
+    except OSError as e:
+        print(f"Cannot read {source}: {e.strerror}")
+        sys.exit(1)
+    with stream:
+        accounts = []
+        for number, text in enumerate(stream, 1):
+            try:
+                account = parse_line(text)
+            except (ValueError, KeyError) as e:
+                print(f"Line {number}: cannot parse ({e})", file=sys.stderr)
+                continue
+            if account is not None:
+                accounts.append(account)
+
+    creds = cli.load_credentials()
+    if creds.get("tls") not in tlssession.MODES:
+        logger.warning("verify-credentials over plain LDAP: passwords are sent in clear text")
+    pool = FastBindPool(creds, connections)
+    started = time.perf_counter()
+    valid = 0
+    try:
+        for result in pool.check_all(accounts):
+            valid += result["ok"]
+            if ndjson:
+                print(json.dumps(result))
+            else:
+                print(f"{result['username']}: {'ok' if result['ok'] else result['reason']}")
+    finally:
+        pool.close()
+
+    elapsed = time.perf_counter() - started
+    summary = (f"verify-credentials: {len(accounts)} accounts, {valid} valid, {len(accounts) - valid} invalid, "
+               f"{len(accounts) / elapsed if elapsed else 0:.0f}/s on {pool.opened} connections "
+               f"({pool.fast} in fast bind mode)")
+    logger.info(summary)
+    print(summary, file=sys.stderr if ndjson else sys.stdout)
@@ -0,0 +1,253 @@
+import heapq
+import logging
+
+from pyasn1.codec.ber import decoder
+from pyasn1.type import tag
+from pyasn1.type.namedtype import NamedTypes, NamedType, OptionalNamedType, DefaultedNamedType
+from pyasn1.type.univ import Sequence, SequenceOf, Choice, OctetString, Integer, Enumerated, Boolean
+from ldap3 import SUBTREE
+from ldap3.core.results import RESULT_SUCCESS
+from ldap3.protocol.controls import build_control
+
+logger = logging.getLogger(__name__)
+
+# ---- Sorted and windowed listings ----
+#
+#   adtool list-users-in-group AllStaff --sort sn --offset 20000 --limit 100
+#   adtool list-users-in-group AllStaff --sort -whenCreated --limit 20
+#
+# --sort ATTR orders the listing by an attribute ("-ATTR" for descending)
+# and --offset/--limit cut a window out of it. The DC does the work when it
+# can: the server-side sort control (RFC 2891) orders the result and the
+# Virtual List View control returns only the window, so entries 20,000 to
+# 20,100 of a million-member group cost one search returning 100 entries.
+# A window without --sort is ordered by sAMAccountName, since VLV needs a
+# sort order.
+#
+# A DC that refuses either control (unavailableCriticalExtension, or an
+# error in the sort or VLV response control) is read with an ordinary
+# paged search instead, keeping only the best offset + limit entries in a
+# heap as the pages stream past; memory stays bounded by the window end,
+# not the size of the group.
+
+SORT_OID = "1.2.840.113556.1.4.473"
+SORT_RESPONSE_OID = "1.2.840.113556.1.4.474"
+VLV_OID = "2.16.840.1.113730.3.4.9"
+VLV_RESPONSE_OID = "2.16.840.1.113730.3.4.10"
+PAGED_RESULTS_OID = "1.2.840.113556.1.4.319"
+PAGE_SIZE = 500
+DEFAULT_SORT = "sAMAccountName"
+
+RESULT_UNAVAILABLE_CRITICAL_EXTENSION = 12
+RESULT_UNWILLING_TO_PERFORM = 53
+RESULT_SORT_CONTROL_MISSING = 60
+RESULT_OFFSET_RANGE_ERROR = 61
+RESULT_VLV_ERROR = 76
+
+# Results that mean "the DC will not sort or window this", not a failed search
+REFUSED_RESULTS = {RESULT_UNAVAILABLE_CRITICAL_EXTENSION, RESULT_UNWILLING_TO_PERFORM,
+                   RESULT_SORT_CONTROL_MISSING, RESULT_OFFSET_RANGE_ERROR, RESULT_VLV_ERROR}
+
+
+
+# ---- Control values ----
+
+class SortKey(Sequence):
+    # SortKey ::= SEQUENCE { attributeType AttributeDescription,
+    #     orderingRule [0] MatchingRuleId OPTIONAL, reverseOrder [1] BOOLEAN DEFAULT FALSE }
+    componentType = NamedTypes(
+        NamedType("attributeType", OctetString()),
+        OptionalNamedType("orderingRule", OctetString().subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 0))),
+        DefaultedNamedType("reverseOrder", Boolean(False).subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 1)))
+    )
+
+
+class SortKeyList(SequenceOf):
+    componentType = SortKey()
+
+
+class SortResult(Sequence):
+    # SortResult ::= SEQUENCE { sortResult ENUMERATED, attributeType [0] AttributeDescription OPTIONAL }
+    componentType = NamedTypes(
+        NamedType("sortResult", Enumerated()),
+        OptionalNamedType("attributeType", OctetString().subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 0)))
+    )
+
+
+class ByOffset(Sequence):
+    componentType = NamedTypes(NamedType("offset", Integer()), NamedType("contentCount", Integer()))
+
+
+class VLVTarget(Choice):
+    componentType = NamedTypes(
+        NamedType("byOffset", ByOffset().subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatConstructed, 0))),
+        NamedType("greaterThanOrEqual", OctetString().subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 1)))
+    )
+
+
+class VLVRequestValue(Sequence):
+    # VirtualListViewRequest ::= SEQUENCE { beforeCount INTEGER, afterCount INTEGER,
+    #     target CHOICE { byOffset [0] SEQUENCE { offset, contentCount }, greaterThanOrEqual [1] },
+    #     contextID OCTET STRING OPTIONAL }
+    componentType = NamedTypes(
+        NamedType("beforeCount", Integer()),
+        NamedType("afterCount", Integer()),
+        NamedType("target", VLVTarget()),
+        OptionalNamedType("contextID", OctetString())
+    )
+
+
+class VLVResponseValue(Sequence):
+    # VirtualListViewResponse ::= SEQUENCE { targetPosition INTEGER, contentCount INTEGER,
+    #     virtualListViewResult ENUMERATED, contextID OCTET STRING OPTIONAL }
+    componentType = NamedTypes(
+        NamedType("targetPosition", Integer()),
+        NamedType("contentCount", Integer()),
+        NamedType("virtualListViewResult", Enumerated()),
+        OptionalNamedType("contextID", OctetString())
+    )
+
+
+class ControlRefused(Exception):
+
+    def __init__(self, message, result=None):
+        Exception.__init__(self, message)
+        self.result = result
+
+
+# "sn" -> ("sn", False), "-sn" -> ("sn", True)
+def parse_sort(text):
+    reverse = text.startswith("-")
+    attribute = text.lstrip("-")
+    if not attribute or not all(c.isalnum() or c == "-" for c in attribute):
+        raise ValueError(f"Not an attribute name: {text!r}")
+    return attribute, reverse
+
+def sort_control(attribute, reverse=False):
+    key = SortKey()
+    key["attributeType"] = attribute
+    if reverse:
+        key["reverseOrder"] = True
+    keys = SortKeyList()
+    keys.append(key)
+    return build_control(SORT_OID, True, keys)
+
+# offset is 0-based here; VLV counts from 1
+def vlv_control(offset, limit):
+    value = VLVRequestValue()
+    value["beforeCount"] = 0
+    value["afterCount"] = max(0, limit - 1)
+    value["target"]["byOffset"]["offset"] = offset + 1
+    value["target"]["byOffset"]["contentCount"] = 0
+    return build_control(VLV_OID, True, value)
+
+def sort_response_control(code=RESULT_SUCCESS):
+    value = SortResult()
+    value["sortResult"] = code
+    return build_control(SORT_RESPONSE_OID, False, value)
+
+def vlv_response_control(position, count, code=RESULT_SUCCESS):
+    value = VLVResponseValue()
+    value["targetPosition"] = position
+    value["contentCount"] = count
+    value["virtualListViewResult"] = code
+    return build_control(VLV_RESPONSE_OID, False, value)
+
+def decoded(result, oid, spec):
+    control = (result.get("controls") or {}).get(oid)
+    if control is None or not control.get("value"):
+        return None
+    value, _ = decoder.decode(control["value"], asn1Spec=spec)
+    return value
+
+# ---- Searches ----
+
+def entries_of(conn):
+    return [entry for entry in conn.response or [] if entry.get("type") == "searchResEntry"]
+
+# Raise ControlRefused if the DC refused the sort or VLV control
+def check_refused(conn, what):
+    result = conn.result
+    if result["result"] in REFUSED_RESULTS:
+        raise ControlRefused(f"{what} refused: {result.get('description')}", result)
+    if result["result"] != RESULT_SUCCESS:
+        raise RuntimeError(f"{what} failed: {result.get('description')} {result.get('message')}")
+    sort = decoded(result, SORT_RESPONSE_OID, SortResult())
+    if sort is not None and int(sort["sortResult"]) != RESULT_SUCCESS:
+        raise ControlRefused(f"{what}: server-side sort failed with {int(sort['sortResult'])}", result)
+
+# One search with sort + VLV; returns (entries, total)
+def server_window(conn, base, search_filter, attributes, sort, offset, limit, scope=SUBTREE):
+    attribute, reverse = sort
+    conn.search(base, search_filter, scope, attributes=attributes,
+                controls=[sort_control(attribute, reverse), vlv_control(offset, limit)])
+    check_refused(conn, "VLV search")
+    vlv = decoded(conn.result, VLV_RESPONSE_OID, VLVResponseValue())
+    if vlv is None or int(vlv["virtualListViewResult"]) != RESULT_SUCCESS:
+        raise ControlRefused("VLV search: no usable VLV response", conn.result)
+    return entries_of(conn), int(vlv["contentCount"])
+
+# Paged search, optionally server-sorted; yields entries
+def paged(conn, base, search_filter, attributes, scope=SUBTREE, controls=()):
+    cookie = None
+    while True:
+        conn.search(base, search_filter, scope, attributes=attributes, controls=list(controls),
+                    paged_size=PAGE_SIZE, paged_cookie=cookie)
+        check_refused(conn, "Sorted search" if controls else "Search")
+        for entry in entries_of(conn):
+            yield entry
+        control = conn.result.get("controls", {}).get(PAGED_RESULTS_OID, {})
+        cookie = control.get("value", {}).get("cookie")
+        if not cookie:
+            return
+
+# Case-insensitive sort key on the first value, or None without one
+def sort_key(attribute):
+    def key(entry):
+        value = entry["attributes"].get(attribute)
+        if isinstance(value, list):
+            value = value[0] if value else None
+        return str(value).lower() if value is not None else None
+    return key
+
+# Bounded top-k over a paged search: keeps at most offset + limit entries.
+# Entries without the attribute go last in either direction.
+def client_window(conn, base, search_filter, attributes, sort, offset, limit, scope=SUBTREE):
+    attribute, reverse = sort
+    stream = paged(conn, base, search_filter, attributes, scope)
+    key = sort_key(attribute)
+    counted = [0]
+    missing = []
+
+    def counting():
+        for entry in stream:
+            counted[0] += 1
+            if key(entry) is not None:
+                yield entry
+            elif limit is None or len(missing) < offset + limit:
+                missing.append(entry)
+
+    if limit is None:
+        ordered = sorted(counting(), key=key, reverse=reverse)
+    elif reverse:
+        ordered = heapq.nlargest(offset + limit, counting(), key=key)
+    else:
+        ordered = heapq.nsmallest(offset + limit, counting(), key=key)
+    ordered += missing
+    end = None if limit is None else offset + limit
+    return ordered[offset:end], counted[0]
+
+# The sorted window [offset, offset + limit) of a search; returns (entries, total).
+# limit None means everything from offset on.
+def window(conn, base, search_filter, attributes, sort, offset=0, limit=None, scope=SUBTREE):
+    attributes = list(attributes)
+    if sort[0].lower() not in (a.lower() for a in attributes):
+        attributes.append(sort[0])
+    try:
+        if limit is not None:
+            return server_window(conn, base, search_filter, attributes, sort, offset, limit, scope)
+        entries = list(paged(conn, base, search_filter, attributes, scope, [sort_control(*sort)]))
+        return entries[offset:], len(entries)
+    except ControlRefused as e:
+        logger.warning(f"{e}; sorting on the client")
+    return client_window(conn, base, search_filter, attributes, sort, offset, limit, scope)
@@ -7,6 +7,9 @@ setup(
     install_requires=[
         "ldap3"
     ],
+    extras_require={
+        "plot": ["matplotlib"]
+    },
     entry_points={
         "console_scripts": [
             "adtool=adtool.cli:main"
@@ -0,0 +1,48 @@
+import io
+
+import ldap3
+import pytest
+
+from adtool import bench, cli, journal, lazycommit
+from adtool.batch import BatchRunner
+
+# ---- Batch journal with lazy commit ----
+#
+# A line whose write does not read back after a --lazy-commit run must be
+# recorded as failed again, so --resume runs it once more.
+
+GROUP = bench.group_name(1)
+
+
+
+@pytest.fixture
+def conn(monkeypatch, tmp_path):
+    monkeypatch.setattr(journal, "JOB_DIR", tmp_path)
+    conn = bench.mock_connect("fakead")
+    bench.build_directory(conn, 20, 3)
+    cli.dn_cache = None
+    lazycommit.attach(conn)
+    yield conn
+    conn.unbind()
+
+def non_member(conn):
+    conn.search(bench.group_dn(GROUP), "(objectClass=*)", attributes=["member"])
+    current = {dn.lower() for dn in conn.response[0]["attributes"].get("member", [])}
+    return next(bench.user_name(n) for n in range(20) if bench.user_dn(bench.user_name(n)).lower() not in current)
+
+def test_unverified_lines_are_resumed(conn):
+    user = non_member(conn)
+    lines = [f"add-user-to-group {user} {GROUP}\n", f"disable-user {bench.user_name(3)}\n"]
+    job = journal.Journal("lazy")
+    runner = BatchRunner(conn, out=io.StringIO(), journal=job, lazy=True)
+    runner.run(lines)
+
+    # the DC loses the member add
+    ldap3.Connection.modify(conn, bench.group_dn(GROUP), {"member": [(ldap3.MODIFY_DELETE, [bench.user_dn(user)])]})
+    mismatches = lazycommit.verify(conn)
+    assert [dn.lower() for dn, _ in mismatches] == [bench.group_dn(GROUP).lower()]
+    assert runner.unverified(dn for dn, _ in mismatches) == 1
+    job.close()
+
+    _, done = journal.load("lazy")
+    assert done == {(2, journal.line_hash(lines[1]))}
@@ -0,0 +1,73 @@
+import pytest
+from ldap3 import MODIFY_ADD, MODIFY_DELETE
+
+from adtool import bench
+from adtool.coalesce import MembershipCoalescer
+
+# ---- Membership coalescing ----
+#
+# Changes are buffered without a window and flushed by hand against the
+# fake AD directory; every request must end as it would have one after the
+# other, and the member as the last request left it.
+
+GROUP = bench.group_name(4)
+
+
+
+@pytest.fixture
+def conn():
+    conn = bench.mock_connect("fakead")
+    bench.build_directory(conn, 40, 5)
+    yield conn
+    conn.unbind()
+
+def members(conn):
+    conn.search(bench.group_dn(GROUP), "(objectClass=*)", attributes=["member"])
+    return {dn.lower() for dn in conn.response[0]["attributes"].get("member", [])}
+
+# Users that are not in GROUP
+def non_members(conn):
+    current = members(conn)
+    users = [bench.user_dn(bench.user_name(number)) for number in range(40)]
+    return [dn for dn in users if dn.lower() not in current]
+
+@pytest.fixture
+def coalescer(conn):
+    def modify(group_dn, changes):
+        conn.modify(group_dn, {"member": changes})
+        return conn.result
+
+    return MembershipCoalescer(modify, window=None)
+
+def test_add_then_delete_cancels_out(conn, coalescer):
+    user = non_members(conn)[0]
+    added = coalescer.submit(bench.group_dn(GROUP), user, MODIFY_ADD)
+    deleted = coalescer.submit(bench.group_dn(GROUP), user, MODIFY_DELETE)
+    coalescer.flush()
+
+    assert added.result()["result"] == 0
+    assert deleted.result()["result"] == 0
+    assert user.lower() not in members(conn)
+    assert coalescer.stats() == {"submitted": 2, "cancelled": 2, "modifies": 0}
+
+def test_repeated_add_is_sent_once(conn, coalescer):
+    user = non_members(conn)[0]
+    first = coalescer.submit(bench.group_dn(GROUP), user, MODIFY_ADD)
+    repeat = coalescer.submit(bench.group_dn(GROUP), user, MODIFY_ADD)
+    coalescer.flush()
+
+    assert first.result()["result"] == 0
+    assert repeat.result()["description"] == "entryAlreadyExists"
+    assert user.lower() in members(conn)
+    assert coalescer.stats()["modifies"] == 1
+
+def test_failed_change_retried_alone(conn, coalescer):
+    user, other = non_members(conn)[:2]
+    added = coalescer.submit(bench.group_dn(GROUP), user, MODIFY_ADD)
+    deleted = coalescer.submit(bench.group_dn(GROUP), other, MODIFY_DELETE)
+    coalescer.flush()
+
+    assert added.result()["result"] == 0
+    assert deleted.result()["description"] == "unwillingToPerform"
+    assert user.lower() in members(conn)
+    assert coalescer.stats()["modifies"] == 3
@@ -0,0 +1,88 @@
+import sys
+import gzip
+import json
+
+import pytest
+
+from adtool import bench, explain, replay
+
+# ---- Search statistics decoding ----
+#
+# Statistics control values as a DC sends them, in the name/value format
+# and in the older tag/value format (as recorded in a capture file), must
+# decode to the same fields --explain reports.
+
+# Name/value format: entriesReturned 2, entriesVisited 2,
+# index "idx_sAMAccountName:2:N", callTime 0
+V4_VALUE = bytes.fromhex(
+    "305b3014040f656e747269657352657475726e65648001023013040e656e747269657356697369746564800102"
+    "301f0405696e64657881166964785f73414d4163636f756e744e616d653a323a4e300d040863616c6c54696d65800100"
+)
+
+# Tag/value format from a capture: entriesReturned 3, entriesVisited 4000,
+# index "Ancestors_index:4000:N" (NUL terminated)
+LEGACY_CAPTURED = {"b64": "MCkCAQUCAQMCAQYCAg+gAgEIBBdBbmNlc3RvcnNfaW5kZXg6NDAwMDpOAA=="}
+
+
+
+def test_decode_name_value_format():
+    stats = explain.decode(V4_VALUE)
+    assert stats == {
+        "entriesReturned": 2,
+        "entriesVisited": 2,
+        "index": "idx_sAMAccountName:2:N",
+        "callTime": 0,
+    }
+    assert not explain.scanned(stats)
+
+def test_decode_captured_tag_value_format():
+    stats = explain.decode(replay.decode_value(LEGACY_CAPTURED))
+    assert stats == {"entriesReturned": 3, "entriesVisited": 4000, "index": "Ancestors_index:4000:N"}
+    assert explain.scanned(stats)
+    assert "(not indexed: subtree scan)" in explain.describe("DC=lab,DC=local", "(description=x)", stats)[1]
+
+def test_capture_encoding_round_trips():
+    assert explain.decode(replay.decode_value(replay.encode_value(V4_VALUE))) == explain.decode(V4_VALUE)
+
+def test_statistics_of_a_result():
+    result = {"controls": {explain.STATS_OID: {"value": V4_VALUE}}}
+    assert explain.statistics(result)["entriesReturned"] == 2
+    assert explain.statistics({"controls": {}}) is None
+    assert explain.statistics({"controls": {explain.STATS_OID: {"value": b"\x04\x03abc"}}}) is None
+
+def test_decode_rejects_other_values():
+    with pytest.raises(ValueError):
+        explain.decode(bytes.fromhex("3006040161040162"))
+
+def test_explainer_records_fake_statistics():
+    conn = bench.mock_connect("fakead")
+    bench.build_directory(conn, 20, 2)
+    explainer = explain.Explainer()
+    explainer.attach(conn)
+    explainer.start()
+    conn.search("DC=lab,DC=local", f"(sAMAccountName={bench.user_name(1)})", attributes=["cn"])
+    explainer.stop()
+    conn.unbind()
+
+    [query] = explainer.queries
+    assert query["stats"]["entriesReturned"] == 1
+
+def test_capture_report_skips_damaged_values(tmp_path, monkeypatch, capsys):
+    records = [
+        {"version": replay.CAPTURE_VERSION, "captured": "2026-10-19T08:00:00", "server": None},
+        {"command": "list-users-in-group", "args": ["AllStaff"]},
+        {"op": "searchRequest", "request": {"base": "DC=lab,DC=local", "filter": "(cn=broken)"},
+         "result": {"controls": {explain.STATS_OID: replay.encode_value(b"\x30\x03\x02")}}},
+        {"op": "searchRequest", "request": {"base": "DC=lab,DC=local", "filter": "(description=x)"},
+         "result": {"controls": {explain.STATS_OID: LEGACY_CAPTURED}}},
+    ]
+    path = tmp_path / "run.jsonl.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+    monkeypatch.setattr(sys, "argv", ["explain", str(path)])
+    explain.main()
+    output = capsys.readouterr().out
+    assert "(cn=broken) under DC=lab,DC=local\n      cannot decode statistics" in output
+    assert "3 returned / 4000 visited" in output
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from adtool import locator, serverpool
+
+# ---- DC locator ----
+#
+# locate() is run against a stub resolver in place of DNS: SRV records are
+# ordered by priority and weight, in-site DCs come first, and a domain
+# without site records (or without any) falls back as the DC locator does.
+
+DOMAIN = "lab.local"
+SITE = "Branch1"
+
+DOMAIN_RECORDS = [
+    {"priority": 10, "weight": 100, "port": 389, "target": "dc3.lab.local", "ttl": 600},
+    {"priority": 0, "weight": 10, "port": 389, "target": "dc2.lab.local", "ttl": 600},
+    {"priority": 0, "weight": 50, "port": 389, "target": "dc1.lab.local", "ttl": 600},
+    {"priority": 0, "weight": 50, "port": 3268, "target": "branch-dc.lab.local", "ttl": 600},
+]
+
+SITE_RECORDS = [
+    {"priority": 0, "weight": 0, "port": 389, "target": "branch-dc2.lab.local", "ttl": 600},
+    {"priority": 0, "weight": 50, "port": 3268, "target": "branch-dc.lab.local", "ttl": 600},
+]
+
+
+
+class StubResolver(object):
+
+    def __init__(self):
+        self.zone = {}      # lower-case SRV name -> records
+        self.queries = []
+
+    # Stands in for locator.query_srv: no records is NXDOMAIN
+    def query_srv(self, name, nameserver=None, timeout=locator.DNS_TIMEOUT):
+        self.queries.append(name)
+        return [dict(record) for record in self.zone.get(name.lower(), [])]
+
+
+@pytest.fixture
+def resolver(monkeypatch, tmp_path):
+    resolver = StubResolver()
+    monkeypatch.setattr(locator, "query_srv", resolver.query_srv)
+    monkeypatch.setattr(locator, "CACHE_FILE", tmp_path / "dc_locator.json")
+    return resolver
+
+def test_priority_then_weight(resolver):
+    resolver.zone[locator.srv_name(DOMAIN).lower()] = DOMAIN_RECORDS
+    local, others = locator.locate({"domain": DOMAIN})
+    assert local == []
+    assert others == [
+        "ldap://branch-dc.lab.local:3268",
+        "ldap://dc1.lab.local:389",
+        "ldap://dc2.lab.local:389",
+        "ldap://dc3.lab.local:389",
+    ]
+
+def test_site_dcs_first(resolver):
+    resolver.zone[locator.srv_name(DOMAIN).lower()] = DOMAIN_RECORDS
+    resolver.zone[locator.srv_name(DOMAIN, SITE).lower()] = SITE_RECORDS
+    local, others = locator.locate({"domain": DOMAIN, "site": SITE})
+    assert local == ["ldap://branch-dc.lab.local:3268", "ldap://branch-dc2.lab.local:389"]
+    assert others == ["ldap://dc1.lab.local:389", "ldap://dc2.lab.local:389", "ldap://dc3.lab.local:389"]
+
+def test_learned_site_from_cache(resolver):
+    resolver.zone[locator.srv_name(DOMAIN).lower()] = DOMAIN_RECORDS
+    resolver.zone[locator.srv_name(DOMAIN, SITE).lower()] = SITE_RECORDS
+    cache = locator.load_cache()
+    cache["sites"][DOMAIN] = {"name": SITE, "expires": time.time() + locator.SITE_TTL}
+    locator.save_cache(cache)
+
+    local, _ = locator.locate({"domain": DOMAIN})
+    assert local[0] == "ldap://branch-dc.lab.local:3268"
+
+def test_records_cached_for_their_ttl(resolver):
+    resolver.zone[locator.srv_name(DOMAIN).lower()] = DOMAIN_RECORDS
+    first = locator.locate({"domain": DOMAIN, "site": SITE})
+    second = locator.locate({"domain": DOMAIN, "site": SITE})
+    assert first == second
+    assert resolver.queries == [locator.srv_name(DOMAIN, SITE), locator.srv_name(DOMAIN)]
+
+def test_no_site_records_falls_back_to_domain(resolver):
+    resolver.zone[locator.srv_name(DOMAIN).lower()] = DOMAIN_RECORDS
+    local, others = locator.locate({"domain": DOMAIN, "site": SITE})
+    assert local == []
+    assert len(others) == len(DOMAIN_RECORDS)
+
+    preferred, failover = serverpool.dc_tiers({"domain": DOMAIN, "site": SITE})
+    assert preferred[0] == "ldap://branch-dc.lab.local:3268"
+    assert failover == []
+
+def test_no_srv_records(resolver):
+    with pytest.raises(locator.LocatorError):
+        locator.locate({"domain": DOMAIN})
@@ -0,0 +1,66 @@
+import pytest
+
+from adtool import bench, cli, usage
+
+# ---- Round-trip budgets ----
+#
+# Each command in cli.COMMANDS is run once against the fake AD directory
+# (bench's "fakead" backend) and must stay within its budget in
+# usage.ROUND_TRIP_BUDGETS, so an extra search or modify fails CI.
+
+USERS = 40
+GROUPS = 4
+
+# The user the single-user commands act on, and the group the membership
+# commands change (its members and non-members are looked up per test)
+USER = bench.user_name(0)
+GROUP = bench.group_name(0)
+
+
+
+@pytest.fixture
+def conn():
+    conn = bench.mock_connect("fakead")
+    bench.build_directory(conn, USERS, GROUPS)
+    conn.server.fake_directory.set_missing_passwords(bench.BENCH_PASSWORD)
+    cli.dn_cache = None
+    yield conn
+    conn.unbind()
+
+def non_member(conn):
+    conn.search(bench.group_dn(GROUP), "(objectClass=*)", attributes=["member"])
+    members = {str(dn).lower() for dn in conn.entries[0].member.values}
+    return next(bench.user_name(i) for i in range(USERS)
+                if bench.user_dn(bench.user_name(i)).lower() not in members)
+
+# Arguments for a command that make it do its work, not bail out early
+def arguments(conn, command):
+    if command == "create-user":
+        return ["New000001.Bench", bench.BENCH_PASSWORD]
+    if command == "create-group":
+        return ["NewGroup00001"]
+    if command == "add-user-to-group":
+        return [non_member(conn), GROUP]
+    if command == "delete-user-from-group":
+        conn.search(bench.group_dn(GROUP), "(objectClass=*)", attributes=["member"])
+        member_dn = str(conn.entries[0].member.values[0])
+        conn.search(member_dn, "(objectClass=*)", attributes=["sAMAccountName"])
+        return [conn.entries[0].sAMAccountName.value, GROUP]
+    if command == "list-users-in-group":
+        return [GROUP]
+    return [USER]
+
+def test_every_command_has_a_budget():
+    assert set(cli.COMMANDS) <= set(usage.ROUND_TRIP_BUDGETS)
+
+@pytest.mark.parametrize("command", sorted(cli.COMMANDS))
+def test_command_within_budget(conn, command, capsys):
+    args = arguments(conn, command)
+    func, arg_names = cli.COMMANDS[command]
+
+    before = usage.snapshot(conn)
+    ok = func(conn, *args)
+    totals = usage.usage_since(conn, before)
+
+    assert ok is True, capsys.readouterr().out
+    assert totals["operations"] <= usage.ROUND_TRIP_BUDGETS[command], usage.format_usage(command, totals)
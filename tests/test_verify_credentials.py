@@ -0,0 +1,50 @@
+import pytest
+from ldap3 import Server, Connection, SIMPLE
+
+from adtool import bench
+from adtool.verify_credentials import FastBindPool, FAST_BIND_OID
+
+# ---- Fast bind checks against the fake DC ----
+#
+# verify-credentials relies on fast bind mode: binds only check the
+# password and the connection can do nothing else.
+
+
+
+@pytest.fixture
+def server():
+    conn = bench.mock_connect("fakead")
+    bench.build_directory(conn, 5, 1)
+    directory = conn.server.fake_directory
+    directory.set_missing_passwords(bench.BENCH_PASSWORD)
+    server = directory.listen()
+    yield directory, f"ldap://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    conn.unbind()
+
+def test_fast_bind_connection_only_binds(server):
+    directory, url = server
+    conn = Connection(Server(url), authentication=SIMPLE)
+    conn.open()
+    conn.extended(FAST_BIND_OID)
+    assert conn.result["result"] == 0
+
+    conn.user = f"{directory.netbios}\\{bench.user_name(1)}"
+    conn.password = bench.BENCH_PASSWORD
+    assert conn.bind()
+    conn.search(directory.base_dn, "(objectClass=user)", attributes=["cn"])
+    assert conn.result["description"] == "operationsError"
+    assert not conn.entries
+    conn.unbind()
+
+def test_pool_checks_passwords(server):
+    directory, url = server
+    creds = {"dc_ip": url, "username": f"{directory.netbios}\\Administrator", "password": "unused"}
+    pool = FastBindPool(creds, connections=2)
+    try:
+        results = list(pool.check_all([(bench.user_name(1), bench.BENCH_PASSWORD), (bench.user_name(2), "wrong")]))
+    finally:
+        pool.close()
+    assert [r["ok"] for r in results] == [True, False]
+    assert pool.fast == pool.opened
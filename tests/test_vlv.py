@@ -0,0 +1,50 @@
+import pytest
+
+from adtool import bench, vlv
+
+# ---- Sorted windows ----
+#
+# The fake DC's server-side sort and the client-side fallback must agree,
+# and entries without the sort attribute go last in both directions.
+
+BASE = "OU=Sorted,DC=lab,DC=local"
+FILTER = "(objectClass=contact)"
+
+# cn -> description (None: no description)
+CONTACTS = {"One": "b", "Two": None, "Three": "a", "Four": "C"}
+
+ASCENDING = ["Three", "One", "Four", "Two"]
+DESCENDING = ["Four", "One", "Three", "Two"]
+
+
+
+@pytest.fixture
+def conn():
+    conn = bench.mock_connect("fakead")
+    bench.build_directory(conn, 5, 1)
+    conn.add(BASE, ["top", "organizationalUnit"])
+    for cn, description in CONTACTS.items():
+        conn.add(f"CN={cn},{BASE}", ["top", "contact"], {"description": description} if description else {})
+    yield conn
+    conn.unbind()
+
+def names(entries):
+    return [entry["attributes"]["cn"] for entry in entries]
+
+@pytest.mark.parametrize("reverse, expected", [(False, ASCENDING), (True, DESCENDING)])
+@pytest.mark.parametrize("limit", [None, 2, 10])
+def test_server_sort(conn, reverse, expected, limit):
+    entries, total = vlv.window(conn, BASE, FILTER, ["cn"], ("description", reverse), 0, limit)
+    assert names(entries) == expected[:limit]
+    assert total == len(CONTACTS)
+
+@pytest.mark.parametrize("reverse, expected", [(False, ASCENDING), (True, DESCENDING)])
+@pytest.mark.parametrize("limit", [None, 2, 10])
+def test_client_sort(conn, reverse, expected, limit):
+    entries, total = vlv.client_window(conn, BASE, FILTER, ["cn", "description"], ("description", reverse), 0, limit)
+    assert names(entries) == expected[:limit]
+    assert total == len(CONTACTS)
+
+def test_descending_window_past_the_sorted_entries(conn):
+    entries, _ = vlv.client_window(conn, BASE, FILTER, ["cn", "description"], ("description", True), 2, 2)
+    assert names(entries) == ["Three", "Two"]